@@ -0,0 +1,66 @@
+"""
+Benchmark the streaming catalogue import and export.
+
+    python -m benchmarks.bench_catalogue_io --rows 1000000
+"""
+import argparse
+import csv
+import os
+import resource
+import tempfile
+from time import perf_counter
+
+from services.catalogue_io import export_books, export_copies, import_catalogue
+from services.library import Library
+
+
+def write_catalogue(path, rows, copies_per_book):
+    with open(path, 'w', newline='') as catalogue_file:
+        writer = csv.writer(catalogue_file)
+        writer.writerow(['book_id', 'title', 'authors', 'publishers', 'copy_ids', 'genre'])
+        for book_no in range(rows):
+            copy_ids = ';'.join(f"c{book_no}-{copy_no}" for copy_no in range(copies_per_book))
+            writer.writerow([f"b{book_no}", f"Title {book_no}", f"author{book_no % 5000};author{book_no % 777}",
+                             f"publisher{book_no % 200}", copy_ids, f"genre{book_no % 20}"])
+
+
+def max_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--copies-per-book', type=int, default=1)
+    parser.add_argument('--chunk-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        catalogue_path = os.path.join(directory, 'catalogue.csv')
+        write_catalogue(catalogue_path, args.rows, args.copies_per_book)
+
+        library = Library()
+        library.create_library(args.rows * args.copies_per_book)
+        rss_before = max_rss_mb()
+
+        start = perf_counter()
+        report, error = import_catalogue(library, catalogue_path, chunk_size=args.chunk_size)
+        elapsed = perf_counter() - start
+        if error:
+            raise SystemExit(error)
+        print(f"import: {report.rows} rows, {report.copies_added} copies in {elapsed:.2f}s "
+              f"({report.rows / elapsed:,.0f} rows/s), {len(report.errors)} errors, "
+              f"max RSS {rss_before:.0f} -> {max_rss_mb():.0f} MB")
+
+        for name, export in (('export books', lambda path: export_books(path)),
+                             ('export copies', lambda path: export_copies(library, path))):
+            export_path = os.path.join(directory, 'export.jsonl')
+            start = perf_counter()
+            count, error = export(export_path)
+            elapsed = perf_counter() - start
+            print(f"{name}: {count} rows in {elapsed:.2f}s ({count / elapsed:,.0f} rows/s), "
+                  f"{os.path.getsize(export_path) / 1e6:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""
+Measure resident memory against lookup latency for a range of cold tier attribute budgets.
+
+The budget only covers the titles and extra attributes of the books, estimated with
+tiered_store.deep_size. The Book and BookCopy objects, their ids and keys and the indexes
+stay in memory, so the RSS at a budget of 0 is the floor the cold tier cannot go below.
+For every budget the run reports the estimated bytes of attributes kept in memory next to
+the estimate for the whole catalogue, and the RSS of the process.
+
+Every budget runs in a fresh process, with the cold tier enabled before the catalogue is
+loaded, so the RSS is not inflated by attributes that were loaded and then evicted.
+
+    python -m benchmarks.bench_cold_tier --books 20000 --budgets-mib 0 8 32 none
+"""
+import argparse
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+from services.book import Book
+from services.library import Library
+from services.tiered_store import payload_size
+
+
+def rss_mib():
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 2 ** 20
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_budget(args, budget):
+    directory = tempfile.mkdtemp()
+    library = Library()
+    library.create_library(args.books)
+    if budget is not None:
+        library.enable_cold_tier(os.path.join(directory, 'cold.sqlite'), budget)
+    rng = random.Random(1)
+    attribute_bytes = 0
+    for start in range(0, args.books, 1000):
+        books = [{'book_id': f"cold-b{book_no}", 'title': f"Title {book_no}", 'authors': [f"Author{book_no % 300}"],
+                  'publishers': ["Publisher"], 'book_copy_ids': [f"cold-c{book_no}"],
+                  'kwargs': {'summary': ''.join(rng.choices('abcdefgh ', k=args.summary_bytes))}}
+                 for book_no in range(start, min(start + 1000, args.books))]
+        attribute_bytes += sum(payload_size({'title': book['title'], **book['kwargs']}) for book in books)
+        library.add_books(books)
+    rss = rss_mib()
+    statistics = library.get_cold_tier_statistics()[0]
+    resident_bytes = attribute_bytes if statistics is None else statistics['resident_bytes']
+
+    # Most lookups go to a small set of popular books
+    weights = [1 / (book_no + 1) for book_no in range(args.books)]
+    book_ids = [f"cold-b{book_no}" for book_no in rng.choices(range(args.books), weights, k=args.lookups)]
+    latencies = []
+    for book_id in book_ids:
+        start = perf_counter()
+        Book.get_book(book_id).title
+        latencies.append(perf_counter() - start)
+    latencies.sort()
+    faults = (library.get_cold_tier_statistics()[0] or {'faults': 0})['faults']
+    library.disable_cold_tier()
+    shutil.rmtree(directory)
+    label = 'none' if budget is None else f"{budget / 2 ** 20:g} MiB"
+    attributes = f"{resident_bytes / 2 ** 20:.1f}/{attribute_bytes / 2 ** 20:.1f}"
+    print(f"{label:>10} {attributes:>13} {rss:9.0f} {latencies[len(latencies) // 2] * 1e6:9.1f} "
+          f"{latencies[int(len(latencies) * 0.99)] * 1e6:9.1f} {faults / len(latencies) * 100:8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--summary-bytes', type=int, default=2000)
+    parser.add_argument('--lookups', type=int, default=50000)
+    parser.add_argument('--budgets-mib', nargs='+', default=['0', '8', '32', 'none'],
+                        help="attribute budgets in MiB, 'none' runs without the cold tier")
+    parser.add_argument('--run-budget', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_budget is not None:
+        run_budget(args, None if args.run_budget == 'none' else int(float(args.run_budget) * 2 ** 20))
+        return
+
+    print(f"{'budget':>10} {'attr_mib':>13} {'rss_mib':>9} {'p50_us':>9} {'p99_us':>9} {'faults':>9}")
+    for budget in args.budgets_mib:
+        subprocess.run([sys.executable, '-m', 'benchmarks.bench_cold_tier', '--books', str(args.books),
+                        '--summary-bytes', str(args.summary_bytes), '--lookups', str(args.lookups),
+                        '--run-budget', budget], check=True)
+
+
+if __name__ == '__main__':
+    main()
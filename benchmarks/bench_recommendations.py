@@ -0,0 +1,66 @@
+"""
+Benchmark the co-borrow index: incremental updates, top-k latency and the offline rebuild.
+
+    python -m benchmarks.bench_recommendations --users 20000 --books 5000 --loans-per-user 8
+"""
+import argparse
+import random
+from time import perf_counter
+
+from services.recommendations import CoBorrowIndex
+
+
+def synthetic_borrows(users, books, loans_per_user, seed=1):
+    rng = random.Random(seed)
+    # Popularity falls off with the book number, as a few titles account for most loans
+    weights = [1 / (book_no + 1) for book_no in range(books)]
+    for user_no in range(users):
+        for book_no in rng.choices(range(books), weights, k=rng.randint(1, loans_per_user * 2 - 1)):
+            yield f"u{user_no}", f"b{book_no}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--users', type=int, default=20000)
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--loans-per-user', type=int, default=8)
+    parser.add_argument('--k', type=int, default=10)
+    args = parser.parse_args()
+
+    borrows = list(synthetic_borrows(args.users, args.books, args.loans_per_user))
+
+    index = CoBorrowIndex()
+    start = perf_counter()
+    for user_id, book_id in borrows:
+        index.record_borrow(user_id, book_id)
+    elapsed = perf_counter() - start
+    pairs = sum(len(counts) for counts in index.counts.values())
+    print(f"incremental: {len(borrows)} borrows in {elapsed:.2f}s ({elapsed / len(borrows) * 1e6:.1f} us/borrow), "
+          f"{pairs} non-zero pairs")
+
+    book_ids = [f"b{book_no}" for book_no in range(args.books)]
+    start = perf_counter()
+    for book_id in book_ids:
+        index.recommend(book_id, args.k)
+    elapsed = perf_counter() - start
+    print(f"top-{args.k}: {elapsed / len(book_ids) * 1e6:.1f} us/book on average")
+    busiest = max(index.counts, key=lambda book_id: len(index.counts[book_id]))
+    start = perf_counter()
+    index.recommend(busiest, args.k)
+    print(f"top-{args.k} of the most co-borrowed book ({len(index.counts[busiest])} neighbours): "
+          f"{(perf_counter() - start) * 1e6:.0f} us")
+
+    start = perf_counter()
+    rebuilt = CoBorrowIndex.rebuild(borrows)
+    elapsed = perf_counter() - start
+    try:
+        import scipy  # noqa: F401
+        engine = 'scipy sparse product'
+    except ImportError:
+        engine = 'pure Python pair counting'
+    print(f"rebuild ({engine}): {elapsed:.2f}s")
+    assert all(rebuilt.recommend(book_id, args.k) == index.recommend(book_id, args.k) for book_id in book_ids[:200])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,69 @@
+"""
+Compare per-row print() rendering of search results with the buffered renderer.
+
+    python -m benchmarks.bench_render --books 2000 --copies-per-book 50
+"""
+import argparse
+import contextlib
+import io
+from time import perf_counter
+
+from services.library import Library
+from views.render import FORMATS, render_search_results, write_output
+
+
+def print_rows(book_copies):
+    # The rendering of search_library_for_book_by_attribute before the render module
+    for book_copy in book_copies:
+        comma_separated_author = ', '.join(map(str, book_copy.book.author_id))
+        comma_separated_publisher = ', '.join(map(str, book_copy.book.publisher_id))
+        rack_no = book_copy.rack_no if not book_copy.borrowed_by else -1
+        print(f"Book Copy: {book_copy.copy_id} {book_copy.book.book_id} {book_copy.book.title} "
+              f"{comma_separated_author} {comma_separated_publisher} {rack_no} "
+              f"{book_copy.borrowed_by if rack_no == -1 else ''} {book_copy.due_date if rack_no == -1 else ''}")
+
+
+def timed(render, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        buffer = io.StringIO()
+        with contextlib.redirect_stdout(buffer):
+            start = perf_counter()
+            render()
+            best = min(best, perf_counter() - start)
+    return best, buffer.getvalue()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=2000)
+    parser.add_argument('--copies-per-book', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    library = Library()
+    library.create_library(args.books * args.copies_per_book)
+    authors = [f"Author {number} with a long name" for number in range(4)]
+    library.add_books([{'book_id': f"render-b{book_no}", 'title': f"Title{book_no}", 'authors': authors,
+                        'publishers': ["Publisher"],
+                        'book_copy_ids': [f"render-c{book_no}-{copy_no}" for copy_no in range(args.copies_per_book)]}
+                       for book_no in range(args.books)])
+    for book_no in range(0, args.books, 3):
+        library.borrow_book_copy_by_id(f"render-c{book_no}-0", f"render-u{book_no % 50}", '2024-05-10')
+
+    start = perf_counter()
+    book_copies = library.search('author_id', authors[0])
+    search_time = perf_counter() - start
+    print(f"{len(book_copies)} copies found in {search_time * 1000:.0f} ms")
+
+    legacy_time, legacy_output = timed(lambda: print_rows(book_copies), args.repeat)
+    print(f"print per row:   {legacy_time * 1000:8.1f} ms")
+    for fmt in FORMATS:
+        render_time, output = timed(lambda: write_output(render_search_results(book_copies, fmt)), args.repeat)
+        if fmt == 'text':
+            assert output == legacy_output
+        print(f"render {fmt:6}:   {render_time * 1000:8.1f} ms ({legacy_time / render_time:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""
+Compare CLI startup from a setup file replayed on every run (cold) with startup from the cached warm state.
+
+    python -m benchmarks.bench_startup --books 20000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+MAIN = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'main.py')
+QUERY = "search author_id author7\n"
+
+
+def write_setup(path, books, copies_per_book):
+    with open(path, 'w') as setup_file:
+        setup_file.write(f"create_library {books * copies_per_book}\n")
+        for book_no in range(books):
+            copy_ids = ','.join(f"c{book_no}-{copy_no}" for copy_no in range(copies_per_book))
+            setup_file.write(f"add_book b{book_no} title{book_no} author{book_no % 500} publisher{book_no % 50} "
+                             f"{copy_ids}\n")
+
+
+def run(args):
+    start = perf_counter()
+    result = subprocess.run([sys.executable, MAIN] + args, input=QUERY, capture_output=True, text=True, check=True)
+    return perf_counter() - start, result.stdout
+
+
+def best_of(repeat, args):
+    timings = [run(args) for _ in range(repeat)]
+    return min(elapsed for elapsed, _ in timings), timings[0][1]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=20000)
+    parser.add_argument('--copies-per-book', type=int, default=2)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        setup_path = os.path.join(directory, 'setup.txt')
+        cache_dir = os.path.join(directory, 'cache')
+        write_setup(setup_path, args.books, args.copies_per_book)
+
+        empty, _ = best_of(args.repeat, [])
+        cold, cold_output = best_of(args.repeat, ['--init', setup_path])
+        build, _ = run(['--init', setup_path, '--cache-dir', cache_dir])
+        warm, warm_output = best_of(args.repeat, ['--init', setup_path, '--cache-dir', cache_dir])
+        assert cold_output == warm_output
+
+        state_size = sum(os.path.getsize(os.path.join(cache_dir, name)) for name in os.listdir(cache_dir))
+        print(f"{args.books} books, {args.books * args.copies_per_book} copies")
+        print(f"no setup:        {empty:.3f}s")
+        print(f"cold (replay):   {cold:.3f}s")
+        print(f"first cached:    {build:.3f}s (replay and write {state_size / 1e6:.1f} MB state)")
+        print(f"warm (cached):   {warm:.3f}s ({cold / warm:.1f}x faster than cold)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,132 @@
+"""
+Compare per-record author/publisher strings with interned integer keys on a synthetic catalogue,
+then time Library.search by author on real Book objects with and without the interned keys.
+
+    python -m benchmarks.bench_symbols --books 200000 --library-books 50000
+"""
+import argparse
+import contextlib
+import random
+import tracemalloc
+from time import perf_counter
+from unittest import mock
+
+from services.book import Book
+from services.library import Library
+from services.state import reset_registries
+from services.symbols import SymbolTable
+
+
+def fresh(prefix, number):
+    # Build the string at runtime so every record gets its own str object, as parsing input does
+    return ''.join([prefix, ' ', str(number), ' of the long name list'])
+
+
+def synthetic_records(books, authors, publishers):
+    random.seed(books)
+    for _ in range(books):
+        yield ([fresh('Author', random.randrange(authors)) for _ in range(random.randint(1, 3))],
+               [fresh('Publisher', random.randrange(publishers))])
+
+
+def measure(build):
+    tracemalloc.start()
+    start = perf_counter()
+    catalogue = build()
+    elapsed = perf_counter() - start
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return catalogue, size, elapsed
+
+
+def time_search(catalogue, matches):
+    start = perf_counter()
+    found = sum(1 for authors, _ in catalogue if matches(authors))
+    return found, perf_counter() - start
+
+
+@contextlib.contextmanager
+def string_attributes(books):
+    """
+    Store the authors and publishers of every book as plain lists of strings again, as Book did
+    before interning, so Library.search takes its attribute-matching path over them.
+    """
+    saved = {name: Book.__dict__[name] for name in Book.KEYED_ATTRIBUTES}
+    for book in books:
+        for name in saved:
+            # Copy every string, so matches compare characters as they did for parsed input
+            values = [(value + '.')[:-1] for value in getattr(book, name)]
+            vars(book)[name] = values
+    try:
+        for name in saved:
+            delattr(Book, name)
+        with mock.patch.dict(Book.KEYED_ATTRIBUTES, clear=True):
+            yield
+    finally:
+        for name, descriptor in saved.items():
+            setattr(Book, name, descriptor)
+        for book in books:
+            for name in saved:
+                vars(book).pop(name, None)
+
+
+def time_library_search(library, authors, repeat):
+    start = perf_counter()
+    found = [len(library.search('author_id', author)) for author in authors for _ in range(repeat)]
+    return found, (perf_counter() - start) / len(found)
+
+
+def search_library(args):
+    reset_registries()
+    library = Library()
+    library.create_library(args.library_books)
+    library.add_books([{'book_id': f"sym-b{book_no}", 'title': f"Title {book_no}", 'authors': authors,
+                        'publishers': publishers, 'book_copy_ids': [f"sym-c{book_no}"]}
+                       for book_no, (authors, publishers)
+                       in enumerate(synthetic_records(args.library_books, args.authors, args.publishers))])
+    authors = [fresh('Author', author_no) for author_no in range(0, args.authors, args.authors // 10)]
+
+    keys_found, keys_search = time_library_search(library, authors, args.repeat)
+    with string_attributes(Book.get_all_books()):
+        strings_found, strings_search = time_library_search(library, authors, args.repeat)
+    assert strings_found == keys_found
+    reset_registries()
+    print(f"Library.search by author over {args.library_books} books: strings {strings_search * 1000:.2f} ms, "
+          f"keys {keys_search * 1000:.2f} ms ({strings_search / keys_search:.1f}x faster), "
+          f"{sum(keys_found) / len(keys_found):.0f} copies per search")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=200000)
+    parser.add_argument('--authors', type=int, default=5000)
+    parser.add_argument('--publishers', type=int, default=200)
+    parser.add_argument('--library-books', type=int, default=50000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    strings, strings_size, strings_time = measure(
+        lambda: [record for record in synthetic_records(args.books, args.authors, args.publishers)])
+
+    author_symbols, publisher_symbols = SymbolTable(), SymbolTable()
+    keys, keys_size, keys_time = measure(
+        lambda: [(author_symbols.intern_all(authors), publisher_symbols.intern_all(publishers))
+                 for authors, publishers in synthetic_records(args.books, args.authors, args.publishers)])
+
+    print(f"{args.books} books, {args.authors} authors, {args.publishers} publishers")
+    print(f"strings: {strings_size / 1e6:8.1f} MB, built in {strings_time:.2f}s")
+    print(f"keys:    {keys_size / 1e6:8.1f} MB including symbol tables, built in {keys_time:.2f}s "
+          f"({strings_size / keys_size:.1f}x smaller)")
+
+    target = fresh('Author', 42)
+    found_strings, strings_search = time_search(strings, lambda authors: target in authors)
+    target_key = author_symbols.key_of(target)
+    found_keys, keys_search = time_search(keys, lambda authors: target_key in authors)
+    assert found_strings == found_keys
+    print(f"search by author: strings {strings_search * 1000:.1f} ms, keys {keys_search * 1000:.1f} ms "
+          f"({strings_search / keys_search:.1f}x faster), {found_keys} matches")
+    search_library(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""
+Measure the storage and query cost of the copy timeline over a year of synthetic circulation.
+
+    python -m benchmarks.bench_timeline --books 500 --copies-per-book 4 --loans-per-day 60
+
+Loans look copies up by scanning the racks, so the circulation itself dominates the run time;
+the time spent recording the timeline is reported separately.
+"""
+import argparse
+import random
+import sys
+from time import perf_counter
+
+from services.clock import epoch_day, from_epoch_day
+from services.library import Library
+
+START = '2024-01-01'
+
+
+def timeline_bytes(timeline):
+    # The day arrays, state lists and state tuples; copy, book and user ids are shared with the library
+    size = sys.getsizeof(timeline.days) + sys.getsizeof(timeline.states)
+    size += sum(sys.getsizeof(days) for days in timeline.days.values())
+    for states in timeline.states.values():
+        size += sys.getsizeof(states) + sum(sys.getsizeof(state) for state in states if state is not None)
+    return size
+
+
+def timed_record(timeline):
+    record = timeline.record
+    spent = [0.0]
+
+    def wrapper(*args):
+        start = perf_counter()
+        record(*args)
+        spent[0] += perf_counter() - start
+
+    timeline.record = wrapper
+    return spent
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--books', type=int, default=500)
+    parser.add_argument('--copies-per-book', type=int, default=4)
+    parser.add_argument('--loans-per-day', type=int, default=60)
+    parser.add_argument('--days', type=int, default=365)
+    parser.add_argument('--queries', type=int, default=20000)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    first_day = epoch_day(START)
+    library = Library()
+    library.today = lambda: START
+    library.create_library(args.books * args.copies_per_book)
+    library.add_books([{'book_id': f"tl-b{book_no}", 'title': f"Title{book_no}", 'authors': [f"Author{book_no % 100}"],
+                        'publishers': ["Publisher"],
+                        'book_copy_ids': [f"tl-c{book_no}-{copy_no}" for copy_no in range(args.copies_per_book)]}
+                       for book_no in range(args.books)])
+
+    on_loan = {}
+    recording = timed_record(library.timeline)
+    start = perf_counter()
+    for day in range(first_day, first_day + args.days):
+        iso_day = from_epoch_day(day)
+        library.today = lambda: iso_day
+        for copy_id in [copy_id for copy_id, due_day in on_loan.items() if due_day <= day]:
+            library.return_book_copy(copy_id)
+            del on_loan[copy_id]
+        for _ in range(args.loans_per_day):
+            copy_id = f"tl-c{rng.randrange(args.books)}-{rng.randrange(args.copies_per_book)}"
+            if copy_id in on_loan:
+                continue
+            due_day = day + rng.randint(3, 28)
+            library.borrow_book_copy_by_id(copy_id, f"tl-u{rng.randrange(5000)}", from_epoch_day(due_day))
+            on_loan[copy_id] = due_day
+    elapsed = perf_counter() - start
+    events = len(library.loan_history)
+    del library.timeline.record
+    print(f"{args.days} days of circulation: {events} loan events in {elapsed:.2f}s, "
+          f"{recording[0] * 1000:.0f} ms of it recording the timeline ({recording[0] / events * 1e6:.1f} us/event)")
+
+    timeline = library.timeline
+    intervals = len(timeline)
+    size = timeline_bytes(timeline)
+    print(f"timeline: {len(timeline.days)} copies, {intervals} intervals, "
+          f"{size / 2 ** 20:.1f} MiB ({size / intervals:.0f} bytes/interval)")
+
+    copy_ids = list(timeline.days)
+    queries = [(rng.choice(copy_ids), from_epoch_day(first_day + rng.randrange(args.days)))
+               for _ in range(args.queries)]
+    start = perf_counter()
+    for copy_id, as_of in queries:
+        library.get_book_copy(copy_id, as_of)
+    elapsed = perf_counter() - start
+    print(f"get_book_copy as_of: {elapsed / len(queries) * 1e6:.1f} us/query")
+
+    start = perf_counter()
+    found = library.search('author_id', "Author7")
+    current = perf_counter() - start
+    start = perf_counter()
+    found_as_of = library.search('author_id', "Author7", as_of=from_epoch_day(first_day + args.days // 2))
+    elapsed = perf_counter() - start
+    print(f"search: {len(found)} copies now in {current * 1000:.1f} ms, "
+          f"{len(found_as_of)} copies half a year ago in {elapsed * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
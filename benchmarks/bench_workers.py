@@ -0,0 +1,79 @@
+"""
+Compare the throughput of a read-heavy command stream run in one process with the reader
+process mode of main.py (--workers N).
+
+    python -m benchmarks.bench_workers --books 5000 --commands 4000 --workers 1 2 4 8
+
+Reads are answered against the catalog published for their generation, so every mutation
+between two reads costs one publication of the copies and loans changed since the last
+checkpoint; --write-ratio sets how often that happens.
+"""
+import argparse
+import contextlib
+import io
+import os
+import random
+from time import perf_counter
+
+import main
+from services.library import Library
+from services.state import reset_registries
+from views import view
+
+
+def build_library(books, copies_per_book):
+    reset_registries()
+    library = Library()
+    library.create_library(books * copies_per_book)
+    library.add_books([{'book_id': f"wk-b{book_no}", 'title': f"Title{book_no}", 'authors': [f"Author{book_no % 100}"],
+                        'publishers': [f"Publisher{book_no % 10}"],
+                        'book_copy_ids': [f"wk-c{book_no}-{copy_no}" for copy_no in range(copies_per_book)]}
+                       for book_no in range(books)])
+    view.set_library(library)
+
+
+def generate_stream(books, copies_per_book, commands, write_ratio, seed=1):
+    rng = random.Random(seed)
+    stream = []
+    for _ in range(commands):
+        if rng.random() < write_ratio:
+            stream.append(f"borrow_book_copy wk-c{rng.randrange(books)}-{rng.randrange(copies_per_book)} "
+                          f"wk-u{rng.randrange(100)} 2024-06-01")
+        elif rng.random() < 0.8:
+            stream.append(f"search author_id Author{rng.randrange(100)}")
+        else:
+            stream.append(f"print_borrowed wk-u{rng.randrange(100)}")
+    return stream
+
+
+def run(stream, args, workers):
+    build_library(args.books, args.copies_per_book)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        start = perf_counter()
+        main.run_commands(lines=stream, workers=workers)
+        elapsed = perf_counter() - start
+    return elapsed, output.getvalue()
+
+
+def main_():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--books', type=int, default=5000)
+    parser.add_argument('--copies-per-book', type=int, default=4)
+    parser.add_argument('--commands', type=int, default=4000)
+    parser.add_argument('--write-ratio', type=float, default=0.01)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+
+    stream = generate_stream(args.books, args.copies_per_book, args.commands, args.write_ratio)
+    print(f"{os.cpu_count()} CPUs, {args.commands} commands, {args.write_ratio:.0%} writes")
+    baseline, expected = run(stream, args, 0)
+    print(f"{'in process':>12}: {args.commands / baseline:9,.0f} commands/s")
+    for workers in args.workers:
+        elapsed, output = run(stream, args, workers)
+        assert output == expected
+        print(f"{workers:>4} readers: {args.commands / elapsed:9,.0f} commands/s ({baseline / elapsed:.2f}x)")
+
+
+if __name__ == '__main__':
+    main_()
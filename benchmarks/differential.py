@@ -0,0 +1,402 @@
+"""
+Differential test and benchmark of library engines.
+
+A seeded random stream of main.py commands, including edge cases such as over-limit borrows,
+full racks, invalid ids and bad argument counts, is run through views/view.py once per engine.
+The output of every command is compared with the output of the reference engine, whose lookups
+are the original list scans, and the time spent executing the commands is recorded per engine.
+The reference engine only reimplements those lookups, see ReferenceLibrary.
+
+    python -m benchmarks.differential --commands 20000 --seed 7
+    python -m benchmarks.differential --engine mypackage.engines:FastLibrary --record results.jsonl
+
+Printing the stats command output is left out of the stream, as it reports timings, and so is
+cold_tier stats, as eviction counts depend on the access pattern of each engine. The cold engine
+runs the stream with every book but one evicted to the cold tier.
+"""
+import argparse
+import contextlib
+import importlib
+import io
+import json
+import os
+import random
+import sys
+import tempfile
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+import main as cli
+from services.book import Book
+from services.bookcopies import BookCopy
+from services.library import Library
+from services.snapshot import versioned
+from services.state import capture_state, reset_registries, restore_state
+from views import view
+
+TODAY = '2024-05-01'
+USERS = 12
+TIERS = ('general', 'student', 'staff')
+ATTRIBUTES = ('book_id', 'title', 'author_id', 'publisher_id', 'genre')
+OUTPUT_FORMATS = ('', '', '', ' text', ' tsv', ' jsonl', ' xml')
+
+
+class ReferenceLibrary(Library):
+    """
+    Library with the original list-scanning rack, search and removal paths, used as the oracle.
+
+    It is only a partial oracle: every other path, such as borrowing, returns, holds and the
+    skipping of copy IDs already in use by add_book, is inherited from Library, so the harness
+    cannot catch a bug in those paths that every engine shares.
+    """
+
+    def find_first_available_rack(self) -> Optional[int]:
+        for rack_no, copies in self.racks.items():
+            if len(copies) < self.MAX_BOOKS_PER_RACK:
+                return rack_no
+        return None
+
+    def add_books(self, books):
+        return [self.add_book(book['book_id'], book['title'], book['authors'], book['publishers'],
+                              book['book_copy_ids'], **book.get('kwargs', {})) for book in books]
+
+    @versioned
+    def remove_book_copy(self, book_copy_id):
+        result = self.get_book_copy_by_field('copy_id', book_copy_id)
+        if result is None:
+            return None, "Invalid Book Copy ID"
+        book_copy, rack_no = result
+        BookCopy.remove_book_copy(book_copy.copy_id)
+        self.remove_book_copy_from_rack(book_copy, rack_no)
+        self.state.remove_copy(book_copy.copy_id)
+        self._publish_book(book_copy.book)
+        return (book_copy, rack_no), None
+
+    def remove_book_copies(self, book_copy_ids):
+        return [self.remove_book_copy(book_copy_id) for book_copy_id in book_copy_ids]
+
+    def get_book_copy(self, copy_id, as_of=None):
+        # Every command runs on TODAY, so the library was empty before it and is unchanged since
+        if as_of is not None and as_of < self.today():
+            return None, f"Book copy {copy_id} not in library on {as_of}"
+        for book_copy in BookCopy.get_all_book_copies():
+            if book_copy.copy_id == copy_id and (book_copy.borrowed_by or self.is_book_copy_shelved(book_copy)):
+                return book_copy, None
+        return None, "Invalid Book Copy ID" if as_of is None else f"Book copy {copy_id} not in library on {as_of}"
+
+    def search(self, attribute, attribute_value, as_of=None):
+        if as_of is not None and as_of < self.today():
+            return []
+        copies_by_book = {}
+        for book_copy in BookCopy.get_all_book_copies():
+            copies_by_book.setdefault(id(book_copy.book), []).append(book_copy)
+        found = []
+        for book in Book.get_all_books():
+            book_value = getattr(book, attribute, None)
+            if isinstance(book_value, list):
+                matched = attribute_value in book_value
+            else:
+                matched = book_value is not None and book_value == attribute_value
+            if matched:
+                found.extend(copies_by_book.get(id(book), []))
+        if as_of is not None:
+            found = [book_copy for book_copy in found
+                     if book_copy.borrowed_by or self.is_book_copy_shelved(book_copy)]
+        return sorted(found, key=lambda book_copy: book_copy.rack_no if book_copy.rack_no is not None else float('inf'))
+
+    def recommend(self, book_id, k=5):
+        self.rebuild_recommendations()
+        return super().recommend(book_id, k)
+
+    def get_rack_occupancy(self, start_rack, end_rack):
+        error = self._validate_rack_range(start_rack, end_rack)
+        if error:
+            return [], error
+        return [(rack_no, len(self.racks[rack_no]), self.MAX_BOOKS_PER_RACK - len(self.racks[rack_no]))
+                for rack_no in range(start_rack, end_rack + 1)], None
+
+    def count_free_slots(self, start_rack, end_rack):
+        error = self._validate_rack_range(start_rack, end_rack)
+        if error:
+            return None, error
+        return sum(self.MAX_BOOKS_PER_RACK - len(self.racks[rack_no])
+                   for rack_no in range(start_rack, end_rack + 1)), None
+
+    def find_racks_with_free_slots(self, min_free_slots, start_rack=1, end_rack=None):
+        if end_rack is None and self.racks is not None:
+            end_rack = len(self.racks)
+        error = self._validate_rack_range(start_rack, end_rack)
+        if error:
+            return [], error
+        racks = []
+        for rack_no in range(start_rack, end_rack + 1):
+            free_slots = self.MAX_BOOKS_PER_RACK - len(self.racks[rack_no])
+            if free_slots >= min_free_slots:
+                racks.append((rack_no, free_slots))
+        return racks, None
+
+    def get_aisle_occupancy(self, racks_per_aisle):
+        if self.racks is None:
+            return [], "Library not created"
+        if racks_per_aisle < 1:
+            return [], "Racks per aisle must be positive"
+        aisles = []
+        for aisle_no, start_rack in enumerate(range(1, len(self.racks) + 1, racks_per_aisle), 1):
+            end_rack = min(start_rack + racks_per_aisle - 1, len(self.racks))
+            occupied = sum(len(self.racks[rack_no]) for rack_no in range(start_rack, end_rack + 1))
+            aisles.append((aisle_no, start_rack, end_rack, occupied,
+                           (end_rack - start_rack + 1) * self.MAX_BOOKS_PER_RACK))
+        return aisles, None
+
+
+def cold_library() -> Library:
+    """
+    Library with a cold tier of memory budget 0, so every book but the most recently used one
+    is evicted and every other read of a title or extra attribute faults a book back in.
+    """
+    library = Library()
+    library.enable_cold_tier(':memory:', 0)
+    return library
+
+
+ENGINES: Dict[str, Callable[[], Library]] = {
+    'reference': ReferenceLibrary,
+    'library': Library,
+    'cold': cold_library,
+}
+
+
+def load_engine(spec: str) -> Tuple[str, Callable[[], Library]]:
+    """
+    Load an engine given as module:Class.
+    """
+    module_name, _, class_name = spec.partition(':')
+    return class_name, getattr(importlib.import_module(module_name), class_name)
+
+
+def write_catalogue(path: str, seed: int, books: int = 20) -> None:
+    rng = random.Random(seed)
+    with open(path, 'w') as catalogue_file:
+        catalogue_file.write("book_id,title,authors,publishers,copy_ids,genre\n")
+        for book_no in range(books):
+            copy_ids = ';'.join(f"i{book_no}-{copy_no}" for copy_no in range(rng.randint(0, 3)))
+            catalogue_file.write(f"ib{book_no},Imported{book_no},a{rng.randrange(8)};a{rng.randrange(8)},"
+                                 f"p{rng.randrange(4)},{copy_ids},g{rng.randrange(3)}\n")
+
+
+def generate_commands(seed: int, count: int, directory: str) -> List[str]:
+    """
+    Generate a random stream of main.py commands.
+    :param seed: The random seed.
+    :param count: The number of commands.
+    :param directory: A directory for the files read and written by the stream.
+    :return: The list of command lines.
+    """
+    rng = random.Random(seed)
+    catalogue_path = os.path.join(directory, 'catalogue.csv')
+    write_catalogue(catalogue_path, seed)
+
+    books, copies, lent = [], [], []
+    racks = rng.randint(20, 80)
+    next_book = next_copy = 0
+
+    def book_id():
+        return rng.choice(books) if books and rng.random() < 0.9 else f"b{rng.randrange(1000, 1100)}"
+
+    def copy_id():
+        return rng.choice(copies) if copies and rng.random() < 0.9 else f"x{rng.randrange(100)}"
+
+    def user_id():
+        return f"u{rng.randrange(USERS)}"
+
+    def date():
+        return f"2024-{rng.randint(4, 6):02d}-{rng.randint(1, 28):02d}"
+
+    def rack_range():
+        start = rng.randint(0, racks + 1)
+        return start, rng.randint(start - 1, racks + 2)
+
+    commands = [f"create_library {racks}"]
+    while len(commands) < count:
+        kind = rng.random()
+        if kind < 0.2:
+            new_copies = [f"c{next_copy + number}" for number in range(rng.randint(1, 4))]
+            if copies and rng.random() < 0.1:
+                new_copies.append(rng.choice(copies))
+            next_copy += len(new_copies)
+            if books and rng.random() < 0.2:
+                new_book = rng.choice(books)
+            else:
+                new_book = f"b{next_book}"
+                next_book += 1
+                books.append(new_book)
+            copies.extend(new_copies)
+            extras = rng.choice(['', ' genre:g1', ' genre:g2 colour:red', ' bad', ' key:'])
+            commands.append(f"add_book {new_book} T{new_book} a{rng.randrange(8)},a{rng.randrange(8)} "
+                            f"p{rng.randrange(4)} {','.join(new_copies)}{extras}")
+        elif kind < 0.32:
+            commands.append(f"borrow_book {book_id()} {user_id()} {date()}")
+        elif kind < 0.42:
+            lent.append(copy_id())
+            commands.append(f"borrow_book_copy {lent[-1]} {user_id()} {date()}")
+        elif kind < 0.54:
+            # Mostly return copies that were asked for, as random ids are rarely on loan
+            commands.append(f"return_book_copy {rng.choice(lent) if lent and rng.random() < 0.7 else copy_id()}")
+        elif kind < 0.6:
+            as_of = rng.choice(['', '', '', 'search_as_of 2024-04-30', f'search_as_of {TODAY}', 'search_as_of 2024-05-02'])
+            commands.append(f"{as_of or 'search'} {rng.choice(ATTRIBUTES)} "
+                            f"{rng.choice([book_id(), f'a{rng.randrange(9)}', f'p{rng.randrange(5)}', 'g1'])}"
+                            f"{rng.choice(OUTPUT_FORMATS)}")
+        elif kind < 0.64:
+            if rng.random() < 0.7:
+                commands.append(f"print_borrowed {user_id()}{rng.choice(OUTPUT_FORMATS)}")
+            else:
+                commands.append(f"get_book_copy {copy_id()}{rng.choice(['', ' 2024-04-30', ' ' + TODAY])}")
+        elif kind < 0.67:
+            commands.append(f"remove_book_copy {copy_id()}")
+        elif kind < 0.69:
+            commands.append(f"remove_book_copies {','.join(copy_id() for _ in range(rng.randint(1, 4)))}")
+        elif kind < 0.73:
+            expiry = f" {date()}" if rng.random() < 0.5 else ''
+            commands.append(f"place_hold {book_id()} {user_id()} {date()}{expiry}")
+        elif kind < 0.75:
+            commands.append(f"cancel_hold {book_id()} {user_id()}")
+        elif kind < 0.76:
+            commands.append(rng.choice(["expire_holds", f"expire_holds {date()}"]))
+        elif kind < 0.78:
+            commands.append("rack_occupancy %d %d" % rack_range())
+        elif kind < 0.8:
+            start, end = rack_range()
+            commands.append(rng.choice([f"free_racks {rng.randint(1, 3)}", f"free_racks 1 {start} {end}"]))
+        elif kind < 0.81:
+            commands.append(f"aisle_occupancy {rng.randint(0, 6)}")
+        elif kind < 0.82:
+            commands.append(f"set_policy {rng.choice(TIERS)} {rng.randint(0, 6)} {rng.randint(1, 21)}")
+        elif kind < 0.84:
+            commands.append(f"set_user_tier {user_id()} {rng.choice(TIERS + ('unknown',))}")
+        elif kind < 0.85:
+            commands.append(f"retier {rng.choice(TIERS)} {rng.choice(TIERS)}")
+        elif kind < 0.86:
+            commands.append(rng.choice(["loan_stats", f"loan_stats {rng.randint(1, 5)}"]))
+        elif kind < 0.88:
+            commands.append(rng.choice(["rebalance", f"rebalance {rng.randint(0, 5)}"]))
+        elif kind < 0.89:
+            racks = max(1, racks + rng.randint(-5, 10))
+            commands.append(rng.choice([f"resize_library {racks}", f"resize_library {racks} {rng.randint(1, 3)}"]))
+        elif kind < 0.9:
+            commands.append(rng.choice(["stats on", "stats off", "stats reset"]))
+        elif kind < 0.91:
+            commands.append(rng.choice([f"import_catalogue {catalogue_path}", f"import_catalogue {catalogue_path} 7"]))
+        elif kind < 0.92:
+            commands.append(rng.choice([f"export_catalogue {os.path.join(directory, 'books.jsonl')}",
+                                        f"export_copies {os.path.join(directory, 'copies.csv')}"]))
+        elif kind < 0.935:
+            commands.append(rng.choice([f"recommend {book_id()}", f"recommend {book_id()} {rng.randint(0, 4)}"]))
+        elif kind < 0.945:
+            cold_path = os.path.join(directory, 'cold.sqlite')
+            commands.append(rng.choice([f"cold_tier {cold_path} 0", f"cold_tier {cold_path} {rng.randint(100, 5000)}",
+                                        f"cold_tier {cold_path} -1", "cold_tier off"]))
+        elif kind < 0.995:
+            commands.append(rng.choice(["borrow_book", "search author_id", "return_book_copy", "rack_occupancy 1",
+                                        "unknown_command", "remove_book_copy", "retier general", "recommend",
+                                        f"borrow_book_copy {copy_id()}", "stats bogus", "cold_tier bogus"]))
+        else:
+            racks = rng.randint(20, 80)
+            commands.append(f"create_library {racks}")
+    return commands
+
+
+def run_engine(factory: Callable[[], Library], commands: List[str]) -> Tuple[List[str], float]:
+    """
+    Run a command stream against a fresh engine.
+    :param factory: Callable returning the engine, a Library or a subclass.
+    :param commands: The command lines.
+    :return: A tuple containing the output of every command and the seconds spent executing them.
+    """
+    reset_registries()
+    library = factory()
+    library.today = lambda: TODAY
+    view.set_library(library)
+
+    outputs = []
+    elapsed = 0.0
+    buffer = io.StringIO()
+    with contextlib.redirect_stdout(buffer), contextlib.redirect_stderr(io.StringIO()):
+        for command in commands:
+            buffer.seek(0)
+            buffer.truncate()
+            parsed_command = cli.parse_input(command)
+            start = perf_counter()
+            try:
+                cli.execute_command(parsed_command)
+            except Exception as e:
+                print(f"Error: {e}")
+            elapsed += perf_counter() - start
+            if parsed_command[0].startswith('export_') and len(parsed_command) == 2 \
+                    and os.path.exists(parsed_command[1]):
+                with open(parsed_command[1]) as export_file:
+                    buffer.write(export_file.read())
+            outputs.append(buffer.getvalue())
+    return outputs, elapsed
+
+
+def run_differential(commands: List[str], engines: Dict[str, Callable[[], Library]]) \
+        -> Tuple[Dict[str, float], List[Tuple[str, int, str, str, str]]]:
+    """
+    Run a command stream against every engine and compare the outputs with the first engine.
+    The class-level registries in use before the run are put back afterwards.
+    :param commands: The command lines.
+    :param engines: The engines by name, the reference engine first.
+    :return: A tuple containing the seconds spent by every engine and the list of mismatches as
+             (engine, command index, command, expected output, actual output) tuples.
+    """
+    saved = capture_state(view.get_library())
+    try:
+        timings, mismatches = {}, []
+        reference = None
+        for name, factory in engines.items():
+            outputs, timings[name] = run_engine(factory, commands)
+            if reference is None:
+                reference = outputs
+                continue
+            for index, (expected, actual) in enumerate(zip(reference, outputs)):
+                if expected != actual:
+                    mismatches.append((name, index, commands[index], expected, actual))
+        return timings, mismatches
+    finally:
+        view.set_library(restore_state(saved))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--commands', type=int, default=5000)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--engine', action='append', default=[], metavar='MODULE:CLASS',
+                        help="an extra engine to compare with the reference")
+    parser.add_argument('--record', metavar='PATH', help="append the throughput of every engine to a JSONL file")
+    args = parser.parse_args()
+
+    engines = dict(ENGINES)
+    engines.update(load_engine(spec) for spec in args.engine)
+
+    with tempfile.TemporaryDirectory() as directory:
+        commands = generate_commands(args.seed, args.commands, directory)
+        timings, mismatches = run_differential(commands, engines)
+
+    for name, elapsed in timings.items():
+        print(f"{name:12} {elapsed:8.3f}s {len(commands) / elapsed:12,.0f} commands/s")
+    for name, index, command, expected, actual in mismatches[:10]:
+        print(f"\n{name} differs at command {index}: {command}\n--- reference\n{expected}--- {name}\n{actual}")
+
+    if args.record:
+        with open(args.record, 'a') as record_file:
+            for name, elapsed in timings.items():
+                record_file.write(json.dumps({'engine': name, 'seed': args.seed, 'commands': len(commands),
+                                              'seconds': elapsed, 'mismatches': sum(1 for m in mismatches
+                                                                                   if m[0] == name)}) + '\n')
+    if mismatches:
+        sys.exit(f"{len(mismatches)} mismatching outputs")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,95 +1,340 @@
+import argparse
+import contextlib
+import io
+import os
+import sys
+
 from views.view import *
 
 
-def main():
+def main(argv=None):
+    args = parse_arguments(argv)
+
+    if args.init:
+        error = initialise_library(args.init, args.cache_dir)
+        if error:
+            print(error, file=sys.stderr)
+
+    if args.cold_store:
+        with contextlib.redirect_stdout(sys.stderr):
+            enable_cold_tier(args.cold_store, args.attribute_budget)
+
+    profiler = None
+    if args.profile:
+        from profiler import CommandProfiler
+        profiler = CommandProfiler(interval=args.profile_interval)
+        profiler.start()
+
+    try:
+        run_commands(profiler, workers=args.workers)
+    finally:
+        if profiler:
+            profiler.stop()
+            error = profiler.write_report(args.profile)
+            if error:
+                print(error, file=sys.stderr)
+            else:
+                print(profiler.format_summary(), file=sys.stderr)
+
+
+def initialise_library(setup_path, cache_dir=None):
+    """
+    Prepare the library by running the commands of a setup file, or by loading the warm state
+    cached for a setup file with the same content. The output of the setup commands is discarded.
+    """
+    from services import state
+
+    key, error = state.setup_key(setup_path)
+    if error:
+        return error
+    cache_path = os.path.join(cache_dir, f"{key}.state") if cache_dir else None
+
+    if cache_path and os.path.exists(cache_path):
+        library, error = state.load_state(cache_path)
+        if library:
+            set_library(library)
+            return None
+        print(error, file=sys.stderr)
+
+    with open(setup_path) as setup_file, contextlib.redirect_stdout(io.StringIO()):
+        run_commands(lines=setup_file)
+    if cache_path:
+        return state.save_state(get_library(), cache_path)
+    return None
+
+
+def read_commands(lines=None):
+    if lines is not None:
+        yield from lines
+        return
     while True:
         try:
-            command = input().strip()
+            yield input()
+        except EOFError:
+            return
+
+
+def run_commands(profiler=None, lines=None, workers=0):
+    pool = None
+    if workers:
+        from views.workers import ReadWorkerPool
+        pool = ReadWorkerPool(workers, get_library)
+    try:
+        for command in read_commands(lines):
+            command = command.strip()
             if command == "exit":
                 break
-
-            parsed_command = parse_input(command)
-
-            if parsed_command is None:
-                continue
-
-            if parsed_command[0] == "create_library":
-                create_library(int(parsed_command[1]))
-
-            elif parsed_command[0] == "add_book":
-                if len(parsed_command) >= 6:
-                    book_id = parsed_command[1]
-                    title = parsed_command[2]
-                    authors = parse_commas_to_list(parsed_command[3])
-                    publishers = parse_commas_to_list(parsed_command[4])
-                    copies = parse_commas_to_list(parsed_command[5])
-
-                    kwargs = {}
-                    if len(parsed_command) > 6:
-                        for pair in parsed_command[6:]:
-                            if ':' in pair:
-                                key, value = pair.split(':', 1)
-                                if key and value:
-                                    kwargs[key] = value
-                                else:
-                                    print(f"Invalid key-value pair: {pair}. Both key and value must have a value.")
-                                    continue
-                            else:
-                                print(
-                                    f"Invalid key-value pair: {pair}. Must contain a colon (':') to separate key and value.")
-                                continue
-                    add_book_to_library(book_id, title, authors, publishers, copies, **kwargs)
-                else:
-                    print_invalid_arguments_message(parsed_command, 5)
-
-            elif parsed_command[0] == "remove_book_copy":
-                if len(parsed_command) == 2:
-                    remove_book_copy_from_library(parsed_command[1])
-                else:
-                    print_invalid_arguments_message(parsed_command, 1)
-
-            elif parsed_command[0] == "borrow_book":
-                if len(parsed_command) == 4:
-                    borrow_book_from_library(parsed_command[1], parsed_command[2], parsed_command[3])
-                else:
-                    print_invalid_arguments_message(parsed_command, 3)
-
-            elif parsed_command[0] == "borrow_book_copy":
-                if len(parsed_command) >= 2:
-                    try:
-                        user_id = parsed_command[2]
-                    except Exception:
-                        user_id = 'user1'
-                    try:
-                        due_date = parsed_command[3]
-                    except Exception:
-                        due_date = '2020-12-31'
-                    borrow_book_copy_from_library(parsed_command[1], user_id, due_date)
-                else:
-                    print_invalid_arguments_message(parsed_command, 1)
-
-            elif parsed_command[0] == "return_book_copy":
-                if len(parsed_command) == 2:
-                    return_book_copy_to_library(parsed_command[1])
-                else:
-                    print_invalid_arguments_message(parsed_command, 1)
-
-            elif parsed_command[0] == "print_borrowed":
-                if len(parsed_command) == 2:
-                    print_borrowed_book_copy_by_user(parsed_command[1])
-                else:
-                    print_invalid_arguments_message(parsed_command, 1)
-
-            elif parsed_command[0] == "search":
-                if len(parsed_command) == 3:
-                    search_library_for_book_by_attribute(parsed_command[1], parsed_command[2])
-                else:
-                    print_invalid_arguments_message(parsed_command, 2)
+            if pool:
+                pool.dispatch(parse_input(command), lambda: run_command(command, profiler))
             else:
-                print("Invalid command was passed")
+                run_command(command, profiler)
+    finally:
+        if pool:
+            pool.close()
+
+
+def run_command(command, profiler=None):
+    try:
+        parsed_command = parse_input(command)
+
+        if parsed_command is None:
+            return
+
+        if profiler:
+            with profiler.command(parsed_command[0]):
+                execute_command(parsed_command)
+        else:
+            execute_command(parsed_command)
+
+    except Exception as e:
+        print(f"Error: {e}")
+
+
+def execute_command(parsed_command):
+    if parsed_command[0] == "create_library":
+        create_library(int(parsed_command[1]))
+
+    elif parsed_command[0] == "resize_library":
+        if len(parsed_command) == 2:
+            resize_library(int(parsed_command[1]))
+        elif len(parsed_command) == 3:
+            resize_library(int(parsed_command[1]), int(parsed_command[2]))
+        else:
+            print_invalid_arguments_message(parsed_command, 2)
+
+    elif parsed_command[0] == "add_book":
+        if len(parsed_command) >= 6:
+            book_id = parsed_command[1]
+            title = parsed_command[2]
+            authors = parse_commas_to_list(parsed_command[3])
+            publishers = parse_commas_to_list(parsed_command[4])
+            copies = parse_commas_to_list(parsed_command[5])
+
+            kwargs = {}
+            if len(parsed_command) > 6:
+                for pair in parsed_command[6:]:
+                    if ':' in pair:
+                        key, value = pair.split(':', 1)
+                        if key and value:
+                            kwargs[key] = value
+                        else:
+                            print(f"Invalid key-value pair: {pair}. Both key and value must have a value.")
+                            continue
+                    else:
+                        print(
+                            f"Invalid key-value pair: {pair}. Must contain a colon (':') to separate key and value.")
+                        continue
+            add_book_to_library(book_id, title, authors, publishers, copies, **kwargs)
+        else:
+            print_invalid_arguments_message(parsed_command, 5)
+
+    elif parsed_command[0] == "import_catalogue":
+        if len(parsed_command) == 2:
+            import_catalogue_to_library(parsed_command[1])
+        elif len(parsed_command) == 3:
+            import_catalogue_to_library(parsed_command[1], int(parsed_command[2]))
+        else:
+            print_invalid_arguments_message(parsed_command, 2)
 
-        except Exception as e:
-            print(f"Error: {e}")
+    elif parsed_command[0] == "export_catalogue":
+        if len(parsed_command) == 2:
+            export_catalogue_from_library(parsed_command[1])
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "export_copies":
+        if len(parsed_command) == 2:
+            export_copies_from_library(parsed_command[1])
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "remove_book_copy":
+        if len(parsed_command) == 2:
+            remove_book_copy_from_library(parsed_command[1])
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "remove_book_copies":
+        if len(parsed_command) == 2:
+            remove_book_copies_from_library(parse_commas_to_list(parsed_command[1]))
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "borrow_book":
+        if len(parsed_command) == 4:
+            borrow_book_from_library(parsed_command[1], parsed_command[2], parsed_command[3])
+        else:
+            print_invalid_arguments_message(parsed_command, 3)
+
+    elif parsed_command[0] == "borrow_book_copy":
+        if len(parsed_command) >= 2:
+            try:
+                user_id = parsed_command[2]
+            except Exception:
+                user_id = 'user1'
+            try:
+                due_date = parsed_command[3]
+            except Exception:
+                due_date = '2020-12-31'
+            borrow_book_copy_from_library(parsed_command[1], user_id, due_date)
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "return_book_copy":
+        if len(parsed_command) == 2:
+            return_book_copy_to_library(parsed_command[1])
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "place_hold":
+        if len(parsed_command) in (4, 5):
+            place_hold_on_book(*parsed_command[1:])
+        else:
+            print_invalid_arguments_message(parsed_command, 4)
+
+    elif parsed_command[0] == "cancel_hold":
+        if len(parsed_command) == 3:
+            cancel_hold_on_book(parsed_command[1], parsed_command[2])
+        else:
+            print_invalid_arguments_message(parsed_command, 2)
+
+    elif parsed_command[0] == "expire_holds":
+        if len(parsed_command) in (1, 2):
+            expire_holds_in_library(*parsed_command[1:])
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "print_borrowed":
+        if len(parsed_command) in (2, 3):
+            print_borrowed_book_copy_by_user(*parsed_command[1:])
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "search":
+        if len(parsed_command) in (3, 4):
+            search_library_for_book_by_attribute(*parsed_command[1:])
+        else:
+            print_invalid_arguments_message(parsed_command, 2)
+
+    elif parsed_command[0] == "search_as_of":
+        if len(parsed_command) in (4, 5):
+            search_library_for_book_by_attribute(*parsed_command[2:4], *parsed_command[4:], as_of=parsed_command[1])
+        else:
+            print_invalid_arguments_message(parsed_command, 3)
+
+    elif parsed_command[0] == "get_book_copy":
+        if len(parsed_command) in (2, 3):
+            print_book_copy(*parsed_command[1:])
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "rack_occupancy":
+        if len(parsed_command) == 3:
+            print_rack_occupancy(int(parsed_command[1]), int(parsed_command[2]))
+        else:
+            print_invalid_arguments_message(parsed_command, 2)
+
+    elif parsed_command[0] == "free_racks":
+        if len(parsed_command) == 2:
+            print_racks_with_free_slots(int(parsed_command[1]))
+        elif len(parsed_command) == 4:
+            print_racks_with_free_slots(int(parsed_command[1]), int(parsed_command[2]), int(parsed_command[3]))
+        else:
+            print_invalid_arguments_message(parsed_command, 3)
+
+    elif parsed_command[0] == "aisle_occupancy":
+        if len(parsed_command) == 2:
+            print_aisle_occupancy(int(parsed_command[1]))
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "set_policy":
+        if len(parsed_command) == 4:
+            set_borrowing_policy(parsed_command[1], int(parsed_command[2]), int(parsed_command[3]))
+        else:
+            print_invalid_arguments_message(parsed_command, 3)
+
+    elif parsed_command[0] == "set_user_tier":
+        if len(parsed_command) == 3:
+            set_user_tier(parsed_command[1], parsed_command[2])
+        else:
+            print_invalid_arguments_message(parsed_command, 2)
+
+    elif parsed_command[0] == "retier":
+        if len(parsed_command) == 3:
+            retier_users(parsed_command[1], parsed_command[2])
+        else:
+            print_invalid_arguments_message(parsed_command, 2)
+
+    elif parsed_command[0] == "loan_stats":
+        if len(parsed_command) == 1:
+            print_loan_statistics()
+        elif len(parsed_command) == 2:
+            print_loan_statistics(int(parsed_command[1]))
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "recommend":
+        if len(parsed_command) == 2:
+            print_recommendations(parsed_command[1])
+        elif len(parsed_command) == 3:
+            print_recommendations(parsed_command[1], int(parsed_command[2]))
+        else:
+            print_invalid_arguments_message(parsed_command, 2)
+
+    elif parsed_command[0] == "cold_tier":
+        if len(parsed_command) == 3:
+            enable_cold_tier(parsed_command[1], int(parsed_command[2]))
+        elif len(parsed_command) == 2 and parsed_command[1] == "off":
+            disable_cold_tier()
+        elif len(parsed_command) == 2 and parsed_command[1] == "stats":
+            print_cold_tier_statistics()
+        else:
+            print_invalid_arguments_message(parsed_command, 2)
+
+    elif parsed_command[0] == "rebalance":
+        if len(parsed_command) == 1:
+            rebalance_library()
+        elif len(parsed_command) == 2:
+            rebalance_library(int(parsed_command[1]))
+        else:
+            print_invalid_arguments_message(parsed_command, 1)
+
+    elif parsed_command[0] == "stats":
+        if len(parsed_command) == 1:
+            print_library_stats()
+        elif len(parsed_command) == 2 and parsed_command[1] == "on":
+            enable_library_stats()
+        elif len(parsed_command) == 2 and parsed_command[1] == "off":
+            disable_library_stats()
+        elif len(parsed_command) == 2 and parsed_command[1] == "reset":
+            reset_library_stats()
+        elif len(parsed_command) == 3 and parsed_command[1] == "dump":
+            dump_library_stats(parsed_command[2])
+        else:
+            print("Invalid stats command. Use: stats [on|off|reset|dump <path>]")
+    else:
+        print("Invalid command was passed")
 
 
 # Parse the input command into a list of arguments
@@ -110,7 +355,32 @@ def print_invalid_arguments_message(parse_command, expected_count):
 
 # Parse string from input string into a list
 def parse_commas_to_list(comma_separated_str):
-    return comma_separated_str.split(',')
+    return [sys.intern(item) for item in comma_separated_str.split(',')]
+
+
+# Parse the command line options of main.py
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Library management system command line")
+    parser.add_argument('--profile', metavar='PREFIX',
+                        help="profile the command stream and write PREFIX.collapsed and PREFIX.summary.txt")
+    parser.add_argument('--profile-interval', type=float, default=0.001, metavar='SECONDS',
+                        help="sampling interval of the profiler (default: 0.001)")
+    parser.add_argument('--init', metavar='SETUP',
+                        help="run the commands of the SETUP file silently before reading commands from stdin")
+    parser.add_argument('--cache-dir', metavar='DIR',
+                        help="cache the library state built by --init in DIR, keyed by the content of the setup file. "
+                             "Cached states are pickles, which can run code when loaded: only use a directory "
+                             "no other user can write to. States not owned by the current user, or writable by "
+                             "others, are ignored")
+    parser.add_argument('--workers', type=int, default=0, metavar='N',
+                        help="answer search and print_borrowed in N reader processes sharing the catalog "
+                             "through shared memory (default: 0, run every command in this process)")
+    parser.add_argument('--cold-store', metavar='PATH',
+                        help="keep the title and extra attributes of rarely used books in the sqlite file PATH")
+    parser.add_argument('--attribute-budget', type=int, default=64 << 20, metavar='BYTES',
+                        help="estimated bytes of book titles and extra attributes kept in memory with --cold-store; "
+                             "books, copies and indexes stay in memory regardless (default: 64 MiB)")
+    return parser.parse_args(argv)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,150 @@
+import os
+import signal
+from collections import Counter
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Dict, List, Optional, Tuple
+
+SERVICE_PACKAGES = ('services', 'views')
+# Instrumentation wrappers show up on every stack, so they are never reported as the hot function
+IGNORED_MODULES = ('stats',)
+
+
+class CommandProfiler:
+    """
+    Sampling profiler for main.py command streams.
+
+    A SIGPROF interval timer samples the Python stack every `interval` seconds of CPU time.
+    Every sample is attributed to the command being executed, so the collapsed stacks are
+    rooted at the command type (add_book, borrow_book, search, ...) and can be fed straight
+    into flamegraph tools. Wall-clock time per command is measured separately.
+    """
+
+    def __init__(self, interval: float = 0.001):
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.command_times: Dict[str, List[float]] = {}
+        self.current_command: Optional[str] = None
+        self.sampling = hasattr(signal, 'setitimer') and hasattr(signal, 'SIGPROF')
+        self.service_modules = self._service_modules()
+        self._previous_handler = None
+
+    def start(self) -> None:
+        """
+        Start sampling. Only the wall-clock summary is collected on platforms without SIGPROF.
+        """
+        if self.sampling:
+            self._previous_handler = signal.signal(signal.SIGPROF, self._sample)
+            signal.setitimer(signal.ITIMER_PROF, self.interval, self.interval)
+
+    def stop(self) -> None:
+        """
+        Stop sampling and restore the previous SIGPROF handler.
+        """
+        if self.sampling:
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, self._previous_handler or signal.SIG_DFL)
+
+    @contextmanager
+    def command(self, name: str):
+        """
+        Attribute the time spent in the block to a command type.
+        :param name: The command type, e.g. 'add_book'.
+        """
+        previous_command = self.current_command
+        self.current_command = name
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = perf_counter() - start
+            self.current_command = previous_command
+            times = self.command_times.setdefault(name, [0, 0.0, 0.0])
+            times[0] += 1
+            times[1] += elapsed
+            times[2] = max(times[2], elapsed)
+
+    def _sample(self, signum, frame) -> None:
+        if self.current_command is None:
+            return
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            if code.co_filename != __file__:
+                stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        stack.append(self.current_command)
+        stack.reverse()
+        self.samples[';'.join(stack)] += 1
+
+    def summary_rows(self) -> List[Tuple[str, int, float, float, float, int]]:
+        """
+        Summarise the time spent per command type.
+        :return: A list of (command, count, total ms, mean ms, max ms, samples) tuples,
+                 most expensive command first.
+        """
+        samples_per_command = Counter()
+        for stack, count in self.samples.items():
+            samples_per_command[stack.split(';', 1)[0]] += count
+
+        rows = []
+        for name, (count, total, maximum) in self.command_times.items():
+            rows.append((name, count, total * 1000, total * 1000 / count, maximum * 1000,
+                         samples_per_command[name]))
+        return sorted(rows, key=lambda row: row[2], reverse=True)
+
+    def top_service_functions(self, command: str, limit: int = 3) -> List[Tuple[str, int]]:
+        """
+        Find the service functions that most samples of a command were spent in.
+        :param command: The command type.
+        :param limit: The maximum number of functions to return.
+        :return: A list of (function, inclusive samples) tuples.
+        """
+        inclusive = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(';')
+            if frames[0] != command:
+                continue
+            for function in set(frames[1:]):
+                if function.split(':', 1)[0][:-len('.py')] in self.service_modules:
+                    inclusive[function] += count
+        return inclusive.most_common(limit)
+
+    @staticmethod
+    def _service_modules() -> set:
+        modules = set()
+        root = os.path.dirname(os.path.abspath(__file__))
+        for package in SERVICE_PACKAGES:
+            package_dir = os.path.join(root, package)
+            if os.path.isdir(package_dir):
+                modules.update(name[:-len('.py')] for name in os.listdir(package_dir) if name.endswith('.py'))
+        return modules.difference(IGNORED_MODULES)
+
+    def format_summary(self) -> str:
+        """
+        Render the per-command summary table.
+        :return: The table as a string.
+        """
+        lines = [f"{'command':<20} {'count':>8} {'total_ms':>10} {'mean_ms':>10} {'max_ms':>10} "
+                 f"{'samples':>8}  top service functions"]
+        for name, count, total, mean, maximum, samples in self.summary_rows():
+            top = ', '.join(f"{function} ({function_samples})"
+                            for function, function_samples in self.top_service_functions(name))
+            lines.append(f"{name:<20} {count:>8} {total:>10.3f} {mean:>10.3f} {maximum:>10.3f} {samples:>8}  {top}")
+        return '\n'.join(lines)
+
+    def write_report(self, prefix: str) -> Optional[str]:
+        """
+        Write PREFIX.collapsed (one 'frame;frame;... count' line per stack) and PREFIX.summary.txt.
+        :param prefix: The path prefix of the report files.
+        :return: None if successful, otherwise an error message.
+        """
+        try:
+            with open(f"{prefix}.collapsed", 'w') as collapsed_file:
+                for stack, count in sorted(self.samples.items()):
+                    collapsed_file.write(f"{stack} {count}\n")
+            with open(f"{prefix}.summary.txt", 'w') as summary_file:
+                summary_file.write(self.format_summary() + '\n')
+            return None
+        except OSError as e:
+            return f"Error writing profile: {str(e)}"
@@ -1,8 +1,19 @@
 from typing import List, Any
 
+from .symbols import SymbolTable
+
 
 class Book:
     books = []
+    books_by_id = {}
+    author_symbols = SymbolTable()
+    publisher_symbols = SymbolTable()
+    BASE_ATTRIBUTES = ('book_id', 'title', 'author_keys', 'publisher_keys')
+    # Attributes stored as interned keys, with the symbol table and the attribute holding the keys
+    KEYED_ATTRIBUTES = {'author_id': (author_symbols, 'author_keys'),
+                        'publisher_id': (publisher_symbols, 'publisher_keys')}
+    # The TieredStore holding the title and extra attributes of cold books, if enabled
+    cold_store = None
 
     def __init__(self, book_id: str, title: str, authors: List[str], publishers: List[str], **kwargs):
         self.book_id = book_id
@@ -13,15 +24,77 @@ class Book:
         for key, value in kwargs.items():
             setattr(self, key, value)
 
+    @property
+    def author_id(self) -> List[str]:
+        """
+            Get the authors of the book.
+            """
+        return self.author_symbols.values_of(self.author_keys)
+
+    @author_id.setter
+    def author_id(self, authors: List[str]) -> None:
+        self.author_keys = self.author_symbols.intern_all(authors)
+
+    @property
+    def publisher_id(self) -> List[str]:
+        """
+            Get the publishers of the book.
+            """
+        return self.publisher_symbols.values_of(self.publisher_keys)
+
+    @publisher_id.setter
+    def publisher_id(self, publishers: List[str]) -> None:
+        self.publisher_keys = self.publisher_symbols.intern_all(publishers)
+
+    def __getattr__(self, name: str) -> Any:
+        """
+            Load the attributes of a book evicted to the cold store on first access.
+            Only called for attributes missing from the instance.
+            """
+        store = Book.cold_store
+        if store is not None and not name.startswith('__') and store.is_cold(vars(self).get('book_id')):
+            store.fault_in(self)
+            return getattr(self, name)
+        raise AttributeError(f"'{type(self).__name__}' object has no attribute '{name}'")
+
+    def __getstate__(self) -> dict:
+        """
+            Pickle cold books with their evicted attributes, so the pickle does not depend on the cold store.
+            """
+        return self.peek_attributes()
+
+    def peek_attributes(self) -> dict:
+        """
+            Get every attribute of the book, reading those of a cold book from the cold store without
+            loading them back onto the book or marking it as used.
+            """
+        attributes = vars(self)
+        store = Book.cold_store
+        if store is not None and store.is_cold(attributes.get('book_id')):
+            attributes = {**attributes, **store.read_payload(attributes['book_id'])}
+        return attributes
+
     def __eq__(self, other):
         """
                 Check if two books are equal based on their attributes.
             """
+        if self is other:
+            return True
         if not isinstance(other, Book):
             return False
 
         return self.book_id == other.book_id
 
+    def get_extra_attributes(self) -> dict:
+        """
+            Get the additional attributes the book was created with.
+            :return: A dictionary of the keyword arguments passed on creation.
+            """
+        self.touch(self)
+        if self.cold_store is not None and self.cold_store.is_cold(self.book_id):
+            self.cold_store.fault_in(self)
+        return {key: value for key, value in vars(self).items() if key not in self.BASE_ATTRIBUTES}
+
     @classmethod
     def get_book(cls, book_id: str) -> Any | None:
         """
@@ -29,10 +102,19 @@ class Book:
             :param book_id: The unique identifier for the book.
             :return: The retrieved Book instance if found, None otherwise.
             """
-        for book in cls.books:
-            if book.book_id == book_id:
-                return book
-        return None
+        book = cls.books_by_id.get(book_id)
+        if book is not None and cls.cold_store is not None:
+            cls.cold_store.touch(book)
+        return book
+
+    @classmethod
+    def touch(cls, book: 'Book') -> None:
+        """
+            Record an access to a book, keeping it out of the cold store for longer.
+            :param book: The accessed Book instance.
+            """
+        if cls.cold_store is not None:
+            cls.cold_store.touch(book)
 
     @classmethod
     def get_all_books(cls) -> List['Book']:
@@ -56,6 +138,9 @@ class Book:
         book = cls(book_id, title, authors, publishers, **kwargs)  # Initialize Book instance with provided
         # arguments
         cls.books.append(book)
+        cls.books_by_id[book_id] = book
+        if cls.cold_store is not None:
+            cls.cold_store.admit(book)
         return book
 
     @classmethod
@@ -1,17 +1,37 @@
 from typing import List, Optional, Any
 from .book import Book
+from .symbols import SymbolTable
 
 
 class BookCopy:
+    COMPACT_MIN_TOMBSTONES = 1024
     bookcopies = []
+    bookcopies_by_id = {}
+    positions = {}
+    tombstones = 0
+    copies_by_book = {}
+    user_symbols = SymbolTable()
 
     def __init__(self, copy_id: Any, book: Book, rack_no: int):
         self.copy_id = copy_id
         self.book = book
         self.rack_no = rack_no
-        self.borrowed_by: Optional[str] = None  # Assuming borrowed_by is a string or None
+        self.borrowed_by_key: Optional[int] = None
         self.due_date: Optional[str] = None  # Assuming due_date is a string or None
 
+    @property
+    def borrowed_by(self) -> Optional[str]:
+        """
+        Get the ID of the user who borrowed the book copy, or None if it is not borrowed.
+        """
+        if self.borrowed_by_key is None:
+            return None
+        return self.user_symbols.value_of(self.borrowed_by_key)
+
+    @borrowed_by.setter
+    def borrowed_by(self, user_id: Optional[str]) -> None:
+        self.borrowed_by_key = None if user_id is None else self.user_symbols.intern(user_id)
+
     def __eq__(self, other):
         return isinstance(other, BookCopy) and self.copy_id == other.copy_id
 
@@ -22,10 +42,7 @@ class BookCopy:
         :param copy_id: The unique identifier for the book copy.
         :return: The retrieved BookCopy instance if found, None otherwise.
         """
-        for book_copy in cls.bookcopies:
-            if book_copy.copy_id == copy_id:
-                return book_copy
-        return None
+        return cls.bookcopies_by_id.get(copy_id)
 
     @classmethod
     def get_all_book_copies(cls) -> List['BookCopy']:
@@ -33,8 +50,19 @@ class BookCopy:
         Retrieve all book copies.
         :return: A list of all BookCopy instances.
         """
+        if cls.tombstones:
+            cls.compact()
         return cls.bookcopies
 
+    @classmethod
+    def compact(cls) -> None:
+        """
+        Drop the tombstones left by removed copies from the bookcopies list, keeping the creation order.
+        """
+        cls.bookcopies = [book_copy for book_copy in cls.bookcopies if book_copy is not None]
+        cls.positions = {book_copy.copy_id: position for position, book_copy in enumerate(cls.bookcopies)}
+        cls.tombstones = 0
+
     @classmethod
     def create_book_copy(cls, copy_id: int, book: Book, rack_no: int) -> 'BookCopy':
         """
@@ -45,9 +73,21 @@ class BookCopy:
         :return: The created BookCopy instance.
         """
         book_copy = cls(copy_id, book, rack_no)
+        cls.positions[copy_id] = len(cls.bookcopies)
         cls.bookcopies.append(book_copy)
+        cls.bookcopies_by_id[copy_id] = book_copy
+        cls.copies_by_book.setdefault(book.book_id, {})[copy_id] = book_copy
         return book_copy
 
+    @classmethod
+    def get_copies_of_book(cls, book: Book) -> List['BookCopy']:
+        """
+        Retrieve all copies of a book, in the order they were created.
+        :param book: The Book instance.
+        :return: A list of BookCopy instances of the book.
+        """
+        return list(cls.copies_by_book.get(book.book_id, {}).values())
+
     @classmethod
     def get_or_create_book_copy(cls, copy_id: int, book: Book, rack_no: int) -> 'BookCopy':
         """
@@ -67,11 +107,19 @@ class BookCopy:
     def remove_book_copy(cls, copy_id: Any) -> Optional['BookCopy']:
         """
         Remove a book copy from the bookcopies list.
+
+        The slot of the copy in the list is replaced by a tombstone, and the list is compacted
+        once the tombstones outnumber the live copies, so a removal costs O(1) amortized.
+
         :param copy_id: The unique identifier for the book copy to remove.
         :return: The removed BookCopy instance if found, None otherwise.
         """
-        book_copy = cls.get_book_copy(copy_id)
+        book_copy = cls.bookcopies_by_id.pop(copy_id, None)
         if book_copy:
-            cls.bookcopies = [bc for bc in cls.bookcopies if bc != book_copy]
+            cls.bookcopies[cls.positions.pop(copy_id)] = None
+            cls.tombstones += 1
+            del cls.copies_by_book[book_copy.book.book_id][copy_id]
+            if cls.tombstones >= cls.COMPACT_MIN_TOMBSTONES and cls.tombstones * 2 > len(cls.bookcopies):
+                cls.compact()
             return book_copy
         return None
@@ -0,0 +1,231 @@
+import csv
+import json
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from .book import Book
+from .bookcopies import BookCopy
+
+LIST_SEPARATOR = ';'
+BOOK_FIELDS = ('book_id', 'title', 'authors', 'publishers', 'copy_ids')
+REQUIRED_BOOK_FIELDS = ('book_id', 'title', 'authors', 'publishers')
+COPY_FIELDS = ('copy_id', 'book_id', 'rack_no', 'borrowed_by', 'due_date')
+FORMATS = ('csv', 'jsonl')
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.books = 0
+        self.copies_added = 0
+        self.copies_not_shelved = 0
+        self.errors: List[Tuple[int, str]] = []
+
+
+def detect_format(path: str, fmt: Optional[str] = None) -> Optional[str]:
+    """
+    Work out the format of a catalogue file from its extension unless given explicitly.
+    :param path: The path of the file.
+    :param fmt: The format, 'csv' or 'jsonl', if known.
+    :return: The format, or None if it is not supported.
+    """
+    if fmt is None:
+        fmt = os.path.splitext(path)[1].lstrip('.').lower()
+    return fmt if fmt in FORMATS else None
+
+
+def _parse_list(value: Any) -> List[Any]:
+    if isinstance(value, list):
+        return value
+    return [item.strip() for item in str(value).split(LIST_SEPARATOR) if item.strip()]
+
+
+def parse_book_record(record: Dict[str, Any]) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+    """
+    Turn a catalogue record into the arguments of Library.add_books.
+    :param record: The record, with the BOOK_FIELDS and any extra attributes.
+    :return: A tuple containing the parsed book and None, or None and an error message.
+    """
+    missing = [field for field in REQUIRED_BOOK_FIELDS if record.get(field) in (None, '', [])]
+    if missing:
+        return None, f"Missing {', '.join(missing)}"
+
+    book = {
+        'book_id': record['book_id'],
+        'title': record['title'],
+        'authors': _parse_list(record['authors']),
+        'publishers': _parse_list(record['publishers']),
+        'book_copy_ids': _parse_list(record.get('copy_ids') or []),
+        'kwargs': {key: value for key, value in record.items()
+                   if key not in BOOK_FIELDS and key and value not in (None, '')},
+    }
+    return book, None
+
+
+def read_catalogue(path: str, fmt: str) -> Iterator[Tuple[int, Optional[Dict[str, Any]], Optional[str]]]:
+    """
+    Stream the books of a catalogue file.
+    :param path: The path of the file.
+    :param fmt: The format of the file, 'csv' or 'jsonl'.
+    :return: An iterator of (line number, parsed book, error message) tuples.
+    """
+    with open(path, newline='') as catalogue_file:
+        if fmt == 'csv':
+            for line_no, record in enumerate(csv.DictReader(catalogue_file), 2):
+                yield (line_no,) + parse_book_record(record)
+            return
+
+        for line_no, line in enumerate(catalogue_file, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError as e:
+                yield line_no, None, f"Invalid JSON: {str(e)}"
+                continue
+            if not isinstance(record, dict):
+                yield line_no, None, "Invalid JSON: expected an object"
+                continue
+            yield (line_no,) + parse_book_record(record)
+
+
+def import_catalogue(library, path: str, fmt: Optional[str] = None, chunk_size: int = 1000,
+                     progress: Optional[Callable[[ImportReport], None]] = None) \
+        -> Tuple[Optional[ImportReport], Optional[str]]:
+    """
+    Stream a CSV or JSONL catalogue into a library in chunks of chunk_size books.
+
+    List fields (authors, publishers, copy_ids) are separated by LIST_SEPARATOR in CSV files and may
+    be JSON arrays in JSONL files; any other column becomes an extra attribute of the book. Rows
+    without copy_ids only add the book. Copies whose id already exists are reported and skipped.
+
+    :param library: The Library to add the books to.
+    :param path: The path of the catalogue file.
+    :param fmt: The format of the file, detected from the extension by default.
+    :param chunk_size: The number of books handed to Library.add_books at a time.
+    :param progress: Optional callback called with the report after every chunk.
+    :return: A tuple containing the import report and an error message if the file could not be read.
+    """
+    fmt = detect_format(path, fmt)
+    if fmt is None:
+        return None, "Unsupported catalogue format"
+    if library.racks is None:
+        return None, "Library not created"
+
+    report = ImportReport()
+    chunk: List[Tuple[int, Dict[str, Any]]] = []
+    chunk_copy_ids = set()
+
+    def flush():
+        results = library.add_books([book for _, book in chunk])
+        for (line_no, book), (rack_numbers, error) in zip(chunk, results):
+            if error:
+                report.errors.append((line_no, error))
+                continue
+            report.books += 1
+            report.copies_added += sum(1 for rack_no in rack_numbers if rack_no is not None)
+            report.copies_not_shelved += len(book['book_copy_ids']) - len(rack_numbers) + rack_numbers.count(None)
+        chunk.clear()
+        chunk_copy_ids.clear()
+        if progress:
+            progress(report)
+
+    try:
+        for line_no, book, error in read_catalogue(path, fmt):
+            report.rows += 1
+            if error:
+                report.errors.append((line_no, error))
+                continue
+
+            copy_ids = []
+            for copy_id in book['book_copy_ids']:
+                if copy_id in chunk_copy_ids or BookCopy.get_book_copy(copy_id):
+                    report.errors.append((line_no, f"Duplicate book copy ID: {copy_id}"))
+                else:
+                    chunk_copy_ids.add(copy_id)
+                    copy_ids.append(copy_id)
+            if book['book_copy_ids'] and not copy_ids:
+                continue
+            book['book_copy_ids'] = copy_ids
+
+            chunk.append((line_no, book))
+            if len(chunk) >= chunk_size:
+                flush()
+        if chunk:
+            flush()
+    except (OSError, csv.Error, UnicodeDecodeError) as e:
+        return None, f"Error reading catalogue: {str(e)}"
+    return report, None
+
+
+def _write_rows(path: str, fmt: str, fields: List[str], rows: Iterator[Dict[str, Any]]) -> int:
+    count = 0
+    with open(path, 'w', newline='') as export_file:
+        if fmt == 'csv':
+            writer = csv.DictWriter(export_file, fieldnames=fields)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow({key: LIST_SEPARATOR.join(map(str, value)) if isinstance(value, list) else value
+                                 for key, value in row.items()})
+                count += 1
+        else:
+            for row in rows:
+                export_file.write(json.dumps(row, default=str) + '\n')
+                count += 1
+    return count
+
+
+def export_books(path: str, fmt: Optional[str] = None) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Stream every book, with the ids of its copies, to a CSV or JSONL file that import_catalogue can read.
+    :param path: The path of the file to write.
+    :param fmt: The format of the file, detected from the extension by default.
+    :return: A tuple containing the number of books written and an error message if any.
+    """
+    fmt = detect_format(path, fmt)
+    if fmt is None:
+        return None, "Unsupported catalogue format"
+
+    books = Book.get_all_books()
+    extra_fields = []
+    if fmt == 'csv':
+        extra_fields = sorted({key for book in books for key in book.get_extra_attributes()})
+
+    def rows():
+        for book in books:
+            row = {'book_id': book.book_id, 'title': book.title, 'authors': list(book.author_id),
+                   'publishers': list(book.publisher_id),
+                   'copy_ids': [book_copy.copy_id for book_copy in BookCopy.get_copies_of_book(book)]}
+            row.update(book.get_extra_attributes())
+            yield row
+
+    try:
+        return _write_rows(path, fmt, list(BOOK_FIELDS) + extra_fields, rows()), None
+    except OSError as e:
+        return None, f"Error writing catalogue: {str(e)}"
+
+
+def export_copies(library, path: str, fmt: Optional[str] = None) -> Tuple[Optional[int], Optional[str]]:
+    """
+    Stream every book copy with its rack position and loan to a CSV or JSONL file.
+    Borrowed copies have an empty rack_no.
+    :param library: The Library the copies are shelved in.
+    :param path: The path of the file to write.
+    :param fmt: The format of the file, detected from the extension by default.
+    :return: A tuple containing the number of copies written and an error message if any.
+    """
+    fmt = detect_format(path, fmt)
+    if fmt is None:
+        return None, "Unsupported catalogue format"
+
+    def rows():
+        for book_copy in BookCopy.get_all_book_copies():
+            shelved = library.racks is not None and library.is_book_copy_shelved(book_copy)
+            yield {'copy_id': book_copy.copy_id, 'book_id': book_copy.book.book_id,
+                   'rack_no': book_copy.rack_no if shelved else None,
+                   'borrowed_by': book_copy.borrowed_by, 'due_date': book_copy.due_date}
+
+    try:
+        return _write_rows(path, fmt, list(COPY_FIELDS), rows()), None
+    except OSError as e:
+        return None, f"Error writing copies: {str(e)}"
@@ -0,0 +1,29 @@
+from datetime import date
+
+EPOCH_ORDINAL = date(1970, 1, 1).toordinal()
+
+
+def today() -> str:
+    """
+        Get the current date.
+        :return: The current date as an ISO date string.
+        """
+    return date.today().isoformat()
+
+
+def epoch_day(iso_date: str) -> int:
+    """
+        Convert an ISO date to the number of days since 1970-01-01.
+        :param iso_date: The date as an ISO date string.
+        :return: The number of days since the epoch.
+        """
+    return date.fromisoformat(iso_date).toordinal() - EPOCH_ORDINAL
+
+
+def from_epoch_day(day: int) -> str:
+    """
+        Convert a number of days since 1970-01-01 to an ISO date.
+        :param day: The number of days since the epoch.
+        :return: The date as an ISO date string.
+        """
+    return date.fromordinal(day + EPOCH_ORDINAL).isoformat()
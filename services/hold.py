@@ -0,0 +1,161 @@
+import heapq
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+
+from .clock import epoch_day
+
+
+class Hold:
+    def __init__(self, hold_id: int, book_id: Any, user_id: str, due_date: str, expires_on: Optional[str] = None):
+        """
+            Initialize a new Hold instance.
+            :param hold_id: The sequence number of the hold, used to keep FIFO order.
+            :param book_id: The ID of the book the hold is placed on.
+            :param user_id: The ID of the user waiting for the book.
+            :param due_date: The due date of the loan once a copy is handed to the user.
+            :param expires_on: Optional ISO date after which the hold lapses.
+            """
+        self.hold_id = hold_id
+        self.book_id = book_id
+        self.user_id = user_id
+        self.due_date = due_date
+        self.expires_on = expires_on
+        self.active = True
+
+
+class HoldQueues:
+    """
+    Per-book FIFO queues of holds.
+
+    Expiry dates are kept in a min-heap of epoch days, so expiring holds only looks at the
+    holds that are due. Expired and cancelled holds are flagged inactive and left in their
+    queue; a queue is compacted once it holds more inactive holds than active ones, so every hold is copied a
+    bounded number of times and scans never walk more dead entries than live ones. The number
+    of active holds of every book is kept up to date, so counting them is O(1).
+    """
+
+    def __init__(self):
+        self.queues: Dict[Any, Deque[Hold]] = {}
+        self.holds_by_user: Dict[Tuple[Any, str], Hold] = {}
+        self.expiry_heap: List[Tuple[int, int, Hold]] = []
+        self.active_counts: Dict[Any, int] = {}
+        self.inactive_counts: Dict[Any, int] = {}
+        self.next_hold_id = 0
+
+    def get_hold(self, book_id: Any, user_id: str) -> Optional[Hold]:
+        """
+        Retrieve the active hold of a user on a book.
+        :param book_id: The ID of the book.
+        :param user_id: The ID of the user.
+        :return: The Hold instance if found, None otherwise.
+        """
+        return self.holds_by_user.get((book_id, user_id))
+
+    def place_hold(self, book_id: Any, user_id: str, due_date: str, expires_on: Optional[str] = None) -> Hold:
+        """
+        Add a hold to the back of the queue of a book.
+        :param book_id: The ID of the book.
+        :param user_id: The ID of the user.
+        :param due_date: The due date of the loan once a copy is handed to the user.
+        :param expires_on: Optional ISO date after which the hold lapses.
+        :return: The created Hold instance.
+        """
+        self.next_hold_id += 1
+        hold = Hold(self.next_hold_id, book_id, user_id, due_date, expires_on)
+        self.queues.setdefault(book_id, deque()).append(hold)
+        self.holds_by_user[(book_id, user_id)] = hold
+        self.active_counts[book_id] = self.active_counts.get(book_id, 0) + 1
+        if expires_on is not None:
+            heapq.heappush(self.expiry_heap, (epoch_day(expires_on), hold.hold_id, hold))
+        return hold
+
+    def cancel_hold(self, book_id: Any, user_id: str) -> Optional[Hold]:
+        """
+        Cancel the hold of a user on a book.
+        :param book_id: The ID of the book.
+        :param user_id: The ID of the user.
+        :return: The cancelled Hold instance if found, None otherwise.
+        """
+        hold = self.holds_by_user.get((book_id, user_id))
+        if hold:
+            self._deactivate(hold)
+            self.inactive_counts[book_id] = self.inactive_counts.get(book_id, 0) + 1
+            self._compact(book_id)
+        return hold
+
+    def expire(self, today: str) -> List[Hold]:
+        """
+        Expire every hold whose expiry date is before today.
+        :param today: The current date as an ISO date string.
+        :return: The list of holds that expired.
+        :raises ValueError: If today is not an ISO date.
+        """
+        expired = []
+        day = epoch_day(today)
+        while self.expiry_heap and self.expiry_heap[0][0] < day:
+            _, _, hold = heapq.heappop(self.expiry_heap)
+            if hold.active:
+                self.cancel_hold(hold.book_id, hold.user_id)
+                expired.append(hold)
+        return expired
+
+    def count_active(self, book_id: Any) -> int:
+        """
+        Count the active holds on a book.
+        :param book_id: The ID of the book.
+        :return: The number of holds waiting for the book.
+        """
+        return self.active_counts.get(book_id, 0)
+
+    def pop_next_eligible(self, book_id: Any, is_eligible: Callable[[str], bool]) -> Optional[Hold]:
+        """
+        Remove and return the oldest active hold on a book whose user is eligible to borrow.
+        :param book_id: The ID of the book.
+        :param is_eligible: Called with a user ID, returns True if the user can borrow now.
+        :return: The Hold instance, or None if no waiting user can borrow the book.
+        """
+        queue = self.queues.get(book_id)
+        if not queue or not self.active_counts.get(book_id):
+            return None
+
+        self._drop_inactive_front(book_id, queue)
+        for position, hold in enumerate(queue):
+            if hold.active and is_eligible(hold.user_id):
+                if position:
+                    # Taken out of the middle of the queue like a cancelled hold
+                    self.cancel_hold(book_id, hold.user_id)
+                else:
+                    queue.popleft()
+                    self._deactivate(hold)
+                    self._drop_inactive_front(book_id, queue)
+                return hold
+        return None
+
+    def _deactivate(self, hold: Hold) -> None:
+        del self.holds_by_user[(hold.book_id, hold.user_id)]
+        hold.active = False
+        self.active_counts[hold.book_id] -= 1
+        if not self.active_counts[hold.book_id]:
+            del self.active_counts[hold.book_id]
+
+    def _drop_inactive_front(self, book_id: Any, queue: Deque[Hold]) -> None:
+        dropped = 0
+        while queue and not queue[0].active:
+            queue.popleft()
+            dropped += 1
+        if dropped:
+            self.inactive_counts[book_id] -= dropped
+        if not queue:
+            del self.queues[book_id]
+            self.inactive_counts.pop(book_id, None)
+
+    def _compact(self, book_id: Any) -> None:
+        inactive = self.inactive_counts[book_id]
+        if inactive <= self.active_counts.get(book_id, 0):
+            return
+        active = deque(hold for hold in self.queues[book_id] if hold.active)
+        del self.inactive_counts[book_id]
+        if active:
+            self.queues[book_id] = active
+        else:
+            del self.queues[book_id]
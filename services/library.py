@@ -1,7 +1,19 @@
+import sqlite3
 from typing import List, Optional, Dict, Tuple, Any
 from .book import Book
 from .user import User
 from .bookcopies import BookCopy
+from .clock import epoch_day, from_epoch_day, today
+from .hold import Hold, HoldQueues
+from .loan_history import BORROW, LoanHistory
+from .policy import BorrowingPolicy, PolicyTable
+from .rack_index import RackIndex
+from .rebalance import RebalanceJob
+from .recommendations import CoBorrowIndex
+from .snapshot import CopyRecord, LibrarySnapshot, VersionedState, versioned
+from .timeline import CopyTimeline
+from .stats import LibraryStats, instrumented
+from .tiered_store import TieredStore
 
 
 class Library:
@@ -10,7 +22,17 @@ class Library:
     def __init__(self):
         self.library_id = None
         self.racks = None
+        self.rack_index = None
+        self.rebalance_job = None
+        self.holds = HoldQueues()
+        self.loan_history = LoanHistory()
+        self.recommendations = CoBorrowIndex()
+        self.today = today
+        self.stats = LibraryStats()
+        self.state = VersionedState()
+        self.timeline = CopyTimeline()
 
+    @versioned
     def create_library(self, no_of_racks: int, **kwargs) -> Tuple[Optional[int], Optional[str]]:
         """
         Create the library with an optional library_id and an optional max number
@@ -22,13 +44,76 @@ class Library:
         try:
             self.MAX_BOOKS_PER_RACK = kwargs.get('max_books_per_rack', 1)
             self.library_id = kwargs.get('library_id', None)
-            self.racks: Dict[int, list] = {rack_no: [] for rack_no in range(1, no_of_racks + 1)}
+            for copies in (self.racks or {}).values():
+                for book_copy in copies.values():
+                    self._record_departure(book_copy)
+            # The copies of every rack by copy ID, in the order they were shelved
+            self.racks: Dict[int, Dict[Any, BookCopy]] = {rack_no: {} for rack_no in range(1, no_of_racks + 1)}
+            self.rack_index = RackIndex(no_of_racks)
+            self.rebalance_job = None
+            self.state.reset_racks()
 
             return len(self.racks), None
 
         except Exception:
             return None, "Error Creating Library"
 
+    @versioned
+    def resize_library(self, no_of_racks: int, max_books_per_rack: Optional[int] = None) \
+            -> Tuple[Optional[Tuple[int, List[Tuple[Any, int, int]]]], Optional[str]]:
+        """
+        Grow or shrink the racks of a live library, optionally changing the capacity of a rack.
+
+        Racks are added to or dropped from the end of the library. Copies on dropped racks, and
+        copies that no longer fit on their rack under the new capacity, are moved to the first
+        available racks. Nothing is changed if the remaining racks cannot hold every shelved copy.
+
+        :param no_of_racks: The new total number of racks.
+        :param max_books_per_rack: The new maximum number of books per rack, defaults to the current one.
+        :return: A tuple containing the new number of racks and the list of (copy id, from rack, to rack)
+                 moves made, and an error message if any.
+        """
+        if self.racks is None:
+            return None, "Library not created"
+        if max_books_per_rack is None:
+            max_books_per_rack = self.MAX_BOOKS_PER_RACK
+        if no_of_racks < 1 or max_books_per_rack < 1:
+            return None, "Number of racks and books per rack must be positive"
+
+        current_racks = len(self.racks)
+        shelved_copies = self.rack_index.count_occupied(1, current_racks) if current_racks else 0
+        if shelved_copies > no_of_racks * max_books_per_rack:
+            return None, "Not enough rack space for the shelved book copies"
+
+        displaced = []
+        for rack_no in range(no_of_racks + 1, current_racks + 1):
+            for book_copy in list(self.racks[rack_no].values()):
+                self.remove_book_copy_from_rack(book_copy, rack_no)
+                displaced.append((book_copy, rack_no))
+            del self.racks[rack_no]
+            self._publish_rack(rack_no)
+        if max_books_per_rack < self.MAX_BOOKS_PER_RACK:
+            for rack_no, copies in self.racks.items():
+                for book_copy in list(copies.values())[max_books_per_rack:]:
+                    self.remove_book_copy_from_rack(book_copy, rack_no)
+                    displaced.append((book_copy, rack_no))
+
+        for rack_no in range(current_racks + 1, no_of_racks + 1):
+            self.racks[rack_no] = {}
+        self.rack_index.resize(no_of_racks)
+        self.MAX_BOOKS_PER_RACK = max_books_per_rack
+        self.rebalance_job = None
+
+        moves = []
+        for book_copy, from_rack in displaced:
+            rack_no, error = self.add_book_copy_to_rack(book_copy, self.find_first_available_rack())
+            if error:
+                return None, error
+            moves.append((book_copy.copy_id, from_rack, rack_no))
+        return (len(self.racks), moves), None
+
+    @instrumented('add_book')
+    @versioned
     def add_book(self, book_id: Any, title: str, authors: List[str], publishers: List[str], book_copy_ids: List[Any],
                  **kwargs) -> Tuple[List[Optional[Any]], Optional[str]]:
         """
@@ -38,29 +123,84 @@ class Library:
         :param title: The title of the book.
         :param authors: A list of authors of the book.
         :param publishers: A list of publishers of the book.
-        :param book_copy_ids: A list of copy IDs for the book copies to be added.
+        :param book_copy_ids: A list of copy IDs for the book copies to be added. IDs of copies already on a rack
+                              or on loan are skipped and get no rack number.
         :return: A tuple containing a list of rack numbers where the book copies were added and an error message if any.
+                 Copies handed straight to users waiting on a hold report the rack they were taken from.
         """
         try:
 
             book = Book.get_or_create_book(book_id, title, authors, publishers, **kwargs)
             rack_numbers = []
+            shelved = []
             for copy_id in book_copy_ids:
+                if self.is_copy_id_in_use(copy_id):
+                    # Shelving the copy again would put it on two racks, or on a rack while on loan
+                    rack_numbers.append(None)
+                    continue
                 rack_no = self.find_first_available_rack()
                 if rack_no:
                     book_copy = BookCopy.get_or_create_book_copy(copy_id, book, rack_no)
                     rack_no, error_msg = self.add_book_copy_to_rack(book_copy, rack_no)
                     if error_msg is None:
                         rack_numbers.append(rack_no)
+                        shelved.append(book_copy)
                     else:
                         rack_numbers.append(None)
                 else:
                     rack_numbers.append(None)
                     break
+            self._publish_book(book)
+            self._serve_holds(shelved)
             return rack_numbers, None
         except Exception:
             return [], "Error adding book"
 
+    @versioned
+    def add_books(self, books: List[Dict[str, Any]]) -> List[Tuple[List[Optional[Any]], Optional[str]]]:
+        """
+        Adds a batch of books to the library.
+
+        Copies are shelved on the first available racks, like add_book. Racks only fill up while the
+        batch is added, so the search for a free rack resumes from the last rack used instead of starting
+        over from rack 1 for every copy. The only exception is a copy handed to a user waiting on a hold,
+        after which the search resumes from the rack it was taken from.
+
+        :param books: A list of dictionaries with the book_id, title, authors, publishers and book_copy_ids
+                      of each book, and optionally a kwargs dictionary of extra attributes.
+        :return: A list with, for every book, a tuple containing the list of rack numbers where its copies
+                 were added and an error message if any.
+        """
+        results = []
+        rack_no = 1
+        for book_row in books:
+            try:
+                book = Book.get_or_create_book(book_row['book_id'], book_row['title'], book_row['authors'],
+                                               book_row['publishers'], **book_row.get('kwargs', {}))
+                rack_numbers = []
+                shelved = []
+                for copy_id in book_row['book_copy_ids']:
+                    if self.is_copy_id_in_use(copy_id):
+                        rack_numbers.append(None)
+                        continue
+                    rack_no = rack_no and self.rack_index.find_first_with_free(self.MAX_BOOKS_PER_RACK,
+                                                                               start_rack=rack_no)
+                    if not rack_no:
+                        rack_numbers.append(None)
+                        break
+                    book_copy = BookCopy.get_or_create_book_copy(copy_id, book, rack_no)
+                    rack_numbers.append(self.add_book_copy_to_rack(book_copy, rack_no)[0])
+                    shelved.append(book_copy)
+                self._publish_book(book)
+                freed_rack = self._serve_holds(shelved)
+                if freed_rack:
+                    rack_no = min(rack_no, freed_rack) if rack_no else freed_rack
+                results.append((rack_numbers, None))
+            except Exception:
+                results.append(([], "Error adding book"))
+        return results
+
+    @versioned
     def remove_book_copy(self, book_copy_id: Any) -> Tuple[Optional[Tuple['BookCopy', int]], Optional[str]]:
         """
             Removes a book copy from the library by its ID.
@@ -70,25 +210,51 @@ class Library:
                     or None and an error message if the book copy ID is invalid.
             """
         try:
-            result = self.get_book_copy_by_field('copy_id', book_copy_id)
-            if result is not None:
-                book_copy, rack_no = result
-                if book_copy:
-                    book_copy = book_copy.remove_book_copy(book_copy.copy_id)
-                    self.racks[rack_no].remove(book_copy)
-                    return (book_copy, rack_no), None
+            book_copy = BookCopy.get_book_copy(book_copy_id)
+            if book_copy and self.is_book_copy_shelved(book_copy):
+                rack_no = self._remove_shelved_book_copy(book_copy)
+                return (book_copy, rack_no), None
 
             return None, "Invalid Book Copy ID"
         except Exception as e:
             return None, f"Error removing book copy: {str(e)}"
 
-    def borrow_book(self, book_id: Any, user_id: str, due_date: str) -> Tuple[Optional[int], Optional[str]]:
+    @versioned
+    def remove_book_copies(self, book_copy_ids: List[Any]) -> List[Tuple[Optional[Tuple['BookCopy', int]], Optional[str]]]:
+        """
+        Removes a batch of book copies from the library by their IDs.
+
+        :param book_copy_ids: The IDs of the book copies to be removed.
+        :return: A list with, for every ID, a tuple containing the removed book copy and the rack number it was
+                 removed from if successful, or None and an error message if the book copy ID is invalid.
+        """
+        results = []
+        for book_copy_id in book_copy_ids:
+            book_copy = BookCopy.get_book_copy(book_copy_id)
+            if book_copy and self.is_book_copy_shelved(book_copy):
+                rack_no = self._remove_shelved_book_copy(book_copy)
+                results.append(((book_copy, rack_no), None))
+            else:
+                results.append((None, "Invalid Book Copy ID"))
+        return results
+
+    def _remove_shelved_book_copy(self, book_copy: BookCopy) -> int:
+        rack_no = book_copy.rack_no
+        BookCopy.remove_book_copy(book_copy.copy_id)
+        self.remove_book_copy_from_rack(book_copy, rack_no)
+        self.state.remove_copy(book_copy.copy_id)
+        self._record_departure(book_copy)
+        return rack_no
+
+    @instrumented('borrow_book')
+    @versioned
+    def borrow_book(self, book_id: Any, user_id: str, due_date: Optional[str] = None) -> Tuple[Optional[int], Optional[str]]:
         """
             Borrow a book copy for a user.
 
             :param book_id: The ID of the book to borrow.
             :param user_id: The ID of the user borrowing the book.
-            :param due_date: The due date for returning the book.
+            :param due_date: The due date for returning the book, defaults to the loan period of the user's tier.
             :return: A tuple containing the rack number and None if the book is successfully borrowed,
                     or None and an error message if borrowing fails.
         """
@@ -106,20 +272,25 @@ class Library:
             return None, "Not available"
 
         book_copy, rack_no = result
-        self.racks[rack_no].remove(book_copy)
+        self.remove_book_copy_from_rack(book_copy, rack_no)
 
-        if not user.borrow_book(book_copy, due_date):
+        if not user.borrow_book(book_copy, due_date or self.get_default_due_date(user)):
             return None, "An Error occurred"
+        self._publish_loan(book_copy, user)
+        self.record_loan_event(book_copy, user_id, returned=False)
 
         return rack_no, None
 
-    def borrow_book_copy_by_id(self, copy_id: Any, user_id: str, due_date: str) -> Tuple[Optional[int], Optional[str]]:
+    @instrumented('borrow_book_copy_by_id')
+    @versioned
+    def borrow_book_copy_by_id(self, copy_id: Any, user_id: str,
+                               due_date: Optional[str] = None) -> Tuple[Optional[int], Optional[str]]:
         """
         Borrow a book copy by its copy ID for a user.
 
         :param copy_id: The ID of the book copy to borrow.
         :param user_id: The ID of the user borrowing the book.
-        :param due_date: The due date for returning the book.
+        :param due_date: The due date for returning the book, defaults to the loan period of the user's tier.
         :return: A tuple containing the rack number and None if the book copy is successfully borrowed,
                 or None and an error message if borrowing fails.
         """
@@ -132,13 +303,18 @@ class Library:
             return None, "Invalid Book Copy ID"
 
         book_copy, rack_no = result
-        self.racks[rack_no].remove(book_copy)
+        self.remove_book_copy_from_rack(book_copy, rack_no)
+        Book.touch(book_copy.book)
 
-        if not user.borrow_book(book_copy, due_date):
+        if not user.borrow_book(book_copy, due_date or self.get_default_due_date(user)):
             return None, "An Error occurred"
+        self._publish_loan(book_copy, user)
+        self.record_loan_event(book_copy, user_id, returned=False)
 
         return rack_no, None
 
+    @instrumented('return_book_copy')
+    @versioned
     def return_book_copy(self, copy_id: Any) -> tuple[None, str] | tuple[str, str | None]:
         """
         Return a book copy by its copy ID.
@@ -157,9 +333,16 @@ class Library:
         user_id = book_copy.borrowed_by
         user = User.get_user(user_id)
         user.return_book(book_copy)
+        self._publish_loan(book_copy, user)
+        self.record_loan_event(book_copy, user_id, returned=True)
+
+        holder_id = self._hand_to_holder(book_copy)
+        if holder_id:
+            return f"Returned book copy {copy_id} and handed to user: {holder_id}", None
 
         rack_no = self.find_first_available_rack()
         if not rack_no:
+            self._record_departure(book_copy)
             return None, f"Returned book copy {copy_id} but no available rack"
 
         rack_no, error = self.add_book_copy_to_rack(book_copy, rack_no)
@@ -169,6 +352,161 @@ class Library:
 
         return f"Returned book copy {copy_id} and added to rack: {rack_no}", None
 
+    def _hand_to_holder(self, book_copy: BookCopy) -> Optional[str]:
+        """
+        Lend a book copy to the first user waiting on a hold who can borrow it. A copy on a rack
+        has to be taken off it by the caller once it is handed over.
+
+        :param book_copy: The BookCopy to hand over.
+        :return: The ID of the user the copy was handed to, or None if nobody took it.
+        """
+        self.holds.expire(self.today())
+        while True:
+            hold = self.holds.pop_next_eligible(book_copy.book.book_id,
+                                                lambda holder_id: User.get_or_create(holder_id).can_borrow_book())
+            if not hold:
+                return None
+            holder = User.get_or_create(hold.user_id)
+            if holder.borrow_book(book_copy, hold.due_date or self.get_default_due_date(holder)):
+                self._publish_loan(book_copy, holder)
+                self.record_loan_event(book_copy, hold.user_id, returned=False)
+                return hold.user_id
+
+    def _serve_holds(self, book_copies: List[BookCopy]) -> Optional[int]:
+        """
+        Hand newly shelved book copies to the users waiting on holds for their books.
+
+        :param book_copies: The BookCopy instances just put on a rack.
+        :return: The lowest rack number a copy was taken off, or None if every copy stayed on its rack.
+        """
+        freed_rack = None
+        for book_copy in book_copies:
+            if not self.holds.count_active(book_copy.book.book_id):
+                continue
+            rack_no = book_copy.rack_no
+            if self._hand_to_holder(book_copy):
+                self.remove_book_copy_from_rack(book_copy, rack_no)
+                freed_rack = rack_no if freed_rack is None else min(freed_rack, rack_no)
+        return freed_rack
+
+    def record_loan_event(self, book_copy: BookCopy, user_id: str, returned: bool) -> None:
+        """
+        Record a borrow or return of a book copy in the loan history.
+
+        :param book_copy: The BookCopy that was borrowed or returned.
+        :param user_id: The ID of the user borrowing or returning the copy.
+        :param returned: True for a return, False for a borrow.
+        """
+        day = epoch_day(self.today())
+        if returned:
+            self.loan_history.record_return(book_copy.copy_id, book_copy.book.book_id, user_id, day)
+        else:
+            self.loan_history.record_borrow(book_copy.copy_id, book_copy.book.book_id, user_id, day)
+            self.recommendations.record_borrow(user_id, book_copy.book.book_id)
+
+    def get_loan_statistics(self, limit: int = 10) -> Dict[str, Any]:
+        """
+        Summarise the loan history.
+
+        :param limit: The maximum number of books and authors to list.
+        :return: A dictionary with the number of loans, the number of completed loans, the average loan
+                 length in days, and the most borrowed books and authors as (id, loans) tuples.
+        """
+        history = self.loan_history
+        loans_per_author = history.loans_per_author(
+            lambda book_id: getattr(Book.get_book(book_id), 'author_id', []))
+        return {
+            'loans': sum(history.loans_by_book.values()),
+            'completed_loans': history.completed_loans,
+            'average_loan_length': history.average_loan_length(),
+            'most_borrowed_books': history.most_borrowed(limit),
+            'most_borrowed_authors': sorted(loans_per_author.items(), key=lambda item: item[1], reverse=True)[:limit],
+        }
+
+    def recommend(self, book_id: Any, k: int = 5) -> Tuple[List[Tuple[Book, int]], Optional[str]]:
+        """
+        Recommend the books most often borrowed by the users who borrowed a book.
+
+        :param book_id: The ID of the book.
+        :param k: The maximum number of books to recommend.
+        :return: A tuple containing a list of (book, number of users who borrowed both) tuples and an error
+                 message if any.
+        """
+        book = Book.get_book(book_id)
+        if not book:
+            return [], "Invalid Book ID"
+        if k < 1:
+            return [], "Number of recommendations must be positive"
+        recommended = []
+        for other_book_id, count in self.recommendations.recommend(book.book_id, k):
+            other_book = Book.get_book(other_book_id)
+            if other_book:
+                recommended.append((other_book, count))
+        return recommended, None
+
+    def rebuild_recommendations(self) -> None:
+        """
+        Rebuild the co-borrow index from the loan history.
+        """
+        self.recommendations = CoBorrowIndex.rebuild(
+            (user_id, book_id) for kind, _, book_id, user_id, _ in self.loan_history.iter_events() if kind == BORROW)
+
+    def place_hold(self, book_id: Any, user_id: str, due_date: str,
+                   expires_on: Optional[str] = None) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Place a hold on a book that has no copy available, so that the next returned copy
+        is handed to the user directly.
+
+        :param book_id: The ID of the book to hold.
+        :param user_id: The ID of the user placing the hold.
+        :param due_date: The due date of the loan once a copy is handed to the user.
+        :param expires_on: Optional ISO date after which the hold lapses.
+        :return: A tuple containing the position of the hold in the queue and None if successful,
+                or None and an error message otherwise.
+        """
+        book = Book.get_book(book_id)
+        if not book:
+            return None, "Invalid Book ID"
+
+        for date in (due_date, expires_on):
+            if date is not None and self._parse_as_of(date)[1]:
+                return None, "Invalid date"
+
+        if self.get_book_copy_by_field('book', book):
+            return None, "Book available"
+
+        if self.holds.get_hold(book.book_id, user_id):
+            return None, "Hold already placed"
+
+        User.get_or_create(user_id)
+        self.holds.place_hold(book.book_id, user_id, due_date, expires_on)
+        return self.holds.count_active(book.book_id), None
+
+    def cancel_hold(self, book_id: Any, user_id: str) -> Tuple[Optional[Hold], Optional[str]]:
+        """
+        Cancel the hold of a user on a book.
+
+        :param book_id: The ID of the book.
+        :param user_id: The ID of the user.
+        :return: A tuple containing the cancelled hold and None if successful, or None and an error message otherwise.
+        """
+        hold = self.holds.cancel_hold(book_id, user_id)
+        if not hold:
+            return None, "Hold not found"
+        return hold, None
+
+    def expire_holds(self, as_of: Optional[str] = None) -> Tuple[List[Hold], Optional[str]]:
+        """
+        Expire the holds whose expiry date is before the given date.
+
+        :param as_of: The ISO date to expire holds at, defaults to today.
+        :return: A tuple containing the list of expired holds and an error message if any.
+        """
+        as_of = as_of or self.today()
+        if self._parse_as_of(as_of)[1]:
+            return [], "Invalid date"
+        return self.holds.expire(as_of), None
+
     @staticmethod
     def get_user_borrowed_book_copy(user_id: Any) -> List[BookCopy]:
         """
@@ -182,28 +520,99 @@ class Library:
         else:
             return []
 
-    def search(self, attribute: str, attribute_value: str) -> List['BookCopy']:
+    def get_book_copy(self, copy_id: Any, as_of: Optional[str] = None) \
+            -> Tuple[Optional[BookCopy | CopyRecord], Optional[str]]:
+        """
+        Retrieve a book copy that is on a rack of the library or on loan from it.
+        :param copy_id: The ID of the book copy.
+        :param as_of: An optional ISO date to get the copy as it was at the end of that day.
+        :return: A tuple containing the BookCopy instance, or a CopyRecord when as_of is given,
+                 and an error message if any.
+        """
+        if as_of is None:
+            if not self.is_copy_id_in_use(copy_id):
+                return None, "Invalid Book Copy ID"
+            return BookCopy.get_book_copy(copy_id), None
+
+        day, error = self._parse_as_of(as_of)
+        if error:
+            return None, error
+        state = self.timeline.state_at(copy_id, day)
+        if state is None:
+            return None, f"Book copy {copy_id} not in library on {as_of}"
+        return self._copy_record(copy_id, state), None
+
+    @instrumented('search')
+    def search(self, attribute: str, attribute_value: str, as_of: Optional[str] = None) \
+            -> List[BookCopy | CopyRecord]:
         """
         Search for books based on a given attribute and attribute value.
         :param attribute: The attribute to search for (e.g., 'book_id', 'author', 'publisher').
         :param attribute_value: The value to search for.
-        :return: A list of BookCopy instances matching the search criteria.
+        :param as_of: An optional ISO date to search the copies as they were at the end of that day.
+        :return: A list of BookCopy instances matching the search criteria, or CopyRecord instances
+                 when as_of is given. An invalid as_of date matches nothing.
         """
         found_books = []
-
-        for book in Book.get_all_books():
-            # Handle case where attribute is a list
-            if isinstance(getattr(book, attribute, None), list):
-                if attribute_value in getattr(book, attribute):
-                    found_books.extend(self.get_copies_of_book(book))
-            else:
-                # Handle case where attribute is not a list
-                attribute_value_book = getattr(book, attribute, None)
-                if attribute_value_book is not None and attribute_value_book == attribute_value:
-                    found_books.extend(self.get_copies_of_book(book))
+        if as_of is None:
+            for book in self._find_books(attribute, attribute_value):
+                found_books.extend(self.get_copies_of_book(book))
+        else:
+            day, error = self._parse_as_of(as_of)
+            if error:
+                return []
+            for book in self._find_books(attribute, attribute_value):
+                for copy_id in self.timeline.copies_of_book(book.book_id):
+                    state = self.timeline.state_at(copy_id, day)
+                    if state is not None and state[0] == book.book_id:
+                        found_books.append(self._copy_record(copy_id, state))
 
         return sorted(found_books, key=lambda book_copy: book_copy.rack_no if book_copy.rack_no is not None else float('inf'))
 
+    def _find_books(self, attribute: str, attribute_value: str) -> List[Book]:
+        found_books = []
+        books = Book.get_all_books()
+
+        keyed_attribute = Book.KEYED_ATTRIBUTES.get(attribute)
+        if keyed_attribute:
+            # Compare interned integer keys instead of strings
+            symbols, keys_attribute = keyed_attribute
+            key = symbols.key_of(attribute_value)
+            if key is not None:
+                for book in books:
+                    if key in getattr(book, keys_attribute):
+                        found_books.append(book)
+        else:
+            # Match cold books against their evicted attributes without loading them all back
+            read_attribute = Book.cold_store.peek if Book.cold_store is not None else getattr
+            for book in books:
+                attribute_value_book = read_attribute(book, attribute, None)
+                # Handle case where attribute is a list
+                if isinstance(attribute_value_book, list):
+                    if attribute_value in attribute_value_book:
+                        found_books.append(book)
+                else:
+                    # Handle case where attribute is not a list
+                    if attribute_value_book is not None and attribute_value_book == attribute_value:
+                        found_books.append(book)
+
+        for book in found_books:
+            Book.touch(book)
+        self.stats.record_scanned('search', len(books))
+        return found_books
+
+    @staticmethod
+    def _parse_as_of(as_of: str) -> Tuple[Optional[int], Optional[str]]:
+        try:
+            return epoch_day(as_of), None
+        except (TypeError, ValueError):
+            return None, "Invalid date"
+
+    @staticmethod
+    def _copy_record(copy_id: Any, state: Tuple[Any, Optional[int], Optional[str], Optional[str]]) -> CopyRecord:
+        book_id, rack_no, borrowed_by, due_date = state
+        return CopyRecord(copy_id, Book.get_book(book_id), rack_no, borrowed_by, due_date)
+
     @staticmethod
     def get_copies_of_book(book: 'Book') -> List['BookCopy']:
         """
@@ -211,11 +620,7 @@ class Library:
         :param book: The book to retrieve copies for.
         :return: A list of copies of the given book.
         """
-        copies = []
-        for book_copy in BookCopy.get_all_book_copies():
-            if book_copy.book == book:
-                copies.append(book_copy)
-        return copies
+        return BookCopy.get_copies_of_book(book)
 
     @staticmethod
     def modify_user_max_borrowed_books_allowed(max_books_allowed: int, user_id: str) -> tuple[User, None] | tuple[
@@ -251,6 +656,102 @@ class Library:
             return max_books_allowed, None
         return None, "Maximum number of books allowed must be non-negative"
 
+    @staticmethod
+    def enable_cold_tier(path: str, attribute_budget: int) -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Keep the title and extra attributes of the least recently used books in an on-disk store,
+        within a budget for those attributes. Books are faulted back in when they are read.
+        The books themselves, their copies and the indexes are not covered by the budget.
+
+        :param path: The path of the sqlite file of the store, replaced if it exists.
+        :param attribute_budget: The estimated number of bytes of titles and extra attributes to keep in memory.
+        :return: A tuple containing the statistics of the store and an error message if any.
+        """
+        if attribute_budget < 0:
+            return None, "Attribute budget must be non-negative"
+        Library.disable_cold_tier()
+        try:
+            store = TieredStore(path, attribute_budget)
+        except sqlite3.Error as e:
+            return None, f"Error opening cold store: {e}"
+        Book.cold_store = store
+        store.admit_all(Book.get_all_books())
+        return store.statistics(), None
+
+    @staticmethod
+    def disable_cold_tier() -> None:
+        """
+        Load every cold book back into memory and close the cold store, if enabled.
+        """
+        store, Book.cold_store = Book.cold_store, None
+        if store is not None:
+            store.close()
+
+    @staticmethod
+    def get_cold_tier_statistics() -> Tuple[Optional[Dict[str, Any]], Optional[str]]:
+        """
+        Get the state and the eviction statistics of the cold store.
+        :return: A tuple containing the statistics and an error message if any.
+        """
+        if Book.cold_store is None:
+            return None, "Cold tier not enabled"
+        return Book.cold_store.statistics(), None
+
+    def get_default_due_date(self, user: User) -> str:
+        """
+        Get the due date of a loan starting today under the policy of the user's tier.
+
+        :param user: The user borrowing a book.
+        :return: The due date as an ISO date string.
+        """
+        return from_epoch_day(epoch_day(self.today()) + user.policy.loan_days)
+
+    @staticmethod
+    def set_borrowing_policy(tier: str, max_books_allowed: int,
+                             loan_days: int) -> Tuple[Optional[BorrowingPolicy], Optional[str]]:
+        """
+        Create or replace the borrowing policy of a tier.
+
+        :param tier: The name of the tier.
+        :param max_books_allowed: Maximum number of books a user of the tier can borrow.
+        :param loan_days: Number of days a user of the tier can keep a book.
+        :return: A tuple containing the policy and None if successful, otherwise None and an error message.
+        """
+        if max_books_allowed < 0 or loan_days < 0:
+            return None, "Maximum number of books and loan days must be non-negative"
+        return PolicyTable.set_policy(tier, max_books_allowed, loan_days), None
+
+    @staticmethod
+    def set_user_tier(user_id: str, tier: str) -> Tuple[Optional[User], Optional[str]]:
+        """
+        Move a user to another borrowing policy tier.
+
+        :param user_id: The ID of the user.
+        :param tier: The name of the tier.
+        :return: A tuple containing the updated user and None if successful, otherwise None and an error message.
+        """
+        if not PolicyTable.get_policy(tier):
+            return None, "Invalid tier"
+        user = User.get_or_create(user_id)
+        user.tier = tier
+        return user, None
+
+    @staticmethod
+    def retier_users(from_tier: str, to_tier: str) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Move every user of a tier to another tier without visiting the users.
+
+        :param from_tier: The tier the users are moved from.
+        :param to_tier: The tier the users are moved to.
+        :return: A tuple containing the number of tier groups moved and None if successful,
+                 otherwise None and an error message.
+        """
+        if not PolicyTable.get_policy(to_tier):
+            return None, "Invalid tier"
+        if from_tier == to_tier:
+            return 0, None
+        return PolicyTable.retier(from_tier, to_tier), None
+
     def add_book_copy_to_rack(self, book_copy: BookCopy, rack_no: int) -> Tuple[Optional[int], Optional[str]]:
         """
         Adds a book copy to the specified rack.
@@ -260,20 +761,256 @@ class Library:
         :return: A tuple containing the rack number and None if successful, or None and an error message if there's an exception.
         """
         try:
-            self.racks[rack_no].append(book_copy)
+            self.racks[rack_no][book_copy.copy_id] = book_copy
+            self.rack_index.increment(rack_no)
+            book_copy.rack_no = rack_no
+            self._publish_rack(rack_no)
+            self._publish_copy(book_copy)
             return rack_no, None
         except Exception:
             return None, f"Error adding book copy to rack {rack_no}"
 
+    def remove_book_copy_from_rack(self, book_copy: BookCopy, rack_no: int) -> None:
+        """
+        Takes a book copy off the specified rack.
+
+        :param book_copy: The BookCopy object to be taken off the rack.
+        :param rack_no: The rack number the book copy is on.
+        """
+        del self.racks[rack_no][book_copy.copy_id]
+        self.rack_index.decrement(rack_no)
+        self._publish_rack(rack_no)
+
+    @instrumented('find_first_available_rack')
     def find_first_available_rack(self) -> Optional[int]:
         """
             Finds the first available rack in the library.
         """
-        for rack_no, copies in self.racks.items():
-            if len(copies) < self.MAX_BOOKS_PER_RACK:
-                return rack_no
+        rack_no = self.rack_index.find_first_with_free(self.MAX_BOOKS_PER_RACK)
+        self.stats.record_scanned('find_first_available_rack', self.rack_index.nodes_visited)
+        return rack_no or None
+
+    def move_book_copy(self, book_copy: BookCopy, from_rack: int, to_rack: int) -> None:
+        """
+        Moves a shelved book copy from one rack to another.
+
+        :param book_copy: The BookCopy object to be moved.
+        :param from_rack: The rack number the book copy is on.
+        :param to_rack: The rack number the book copy should be moved to.
+        """
+        self.remove_book_copy_from_rack(book_copy, from_rack)
+        self.add_book_copy_to_rack(book_copy, to_rack)
+
+    def is_book_copy_shelved(self, book_copy: BookCopy) -> bool:
+        """
+        Check whether a book copy is currently on the rack recorded in its rack_no.
+        """
+        copies = self.racks.get(book_copy.rack_no)
+        return copies is not None and copies.get(book_copy.copy_id) is book_copy
+
+    def is_copy_id_in_use(self, copy_id: Any) -> bool:
+        """
+        Check whether the book copy with the given ID is on loan or on one of the racks of the library.
+        """
+        book_copy = BookCopy.get_book_copy(copy_id)
+        return book_copy is not None and (book_copy.borrowed_by is not None or self.is_book_copy_shelved(book_copy))
+
+    def plan_rebalance(self) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Plan a rebalancing of the racks, replacing any rebalancing in progress.
+
+        :return: A tuple containing the number of planned moves and an error message if any.
+        """
+        if self.racks is None:
+            return None, "Library not created"
+        self.rebalance_job = RebalanceJob.plan(self.racks)
+        return self.rebalance_job.planned_moves, None
+
+    @versioned
+    def rebalance(self, max_moves: int = 100) -> Tuple[Optional[Tuple[List[Tuple[Any, int, int]], int]], Optional[str]]:
+        """
+        Apply the next batch of the rebalancing in progress, planning one first if needed.
+
+        Copies that were borrowed or removed since the plan was made are skipped. When the
+        target rack is full, the copy is swapped with a copy that has to leave that rack.
+
+        :param max_moves: The maximum number of copies to move in this batch.
+        :return: A tuple containing the list of (copy id, from rack, to rack) moves made and the number
+                 of moves still pending, and an error message if any.
+        """
+        if max_moves < 1:
+            return None, "Maximum number of moves must be positive"
+        if self.rebalance_job is None:
+            _, error = self.plan_rebalance()
+            if error:
+                return None, error
+
+        job = self.rebalance_job
+        moves = []
+        while not job.done and len(moves) < max_moves:
+            book_copy, target_rack = job.next_move()
+            from_rack = book_copy.rack_no
+            if from_rack == target_rack or target_rack not in self.racks or not self.is_book_copy_shelved(book_copy):
+                continue
+
+            if self.rack_index.get_occupancy(target_rack) < self.MAX_BOOKS_PER_RACK:
+                self.move_book_copy(book_copy, from_rack, target_rack)
+                moves.append((book_copy.copy_id, from_rack, target_rack))
+                continue
+
+            partner = next((copy for copy in self.racks[target_rack].values()
+                            if job.is_pending_elsewhere(copy, target_rack)), None)
+            if partner is None:
+                continue
+            self.remove_book_copy_from_rack(partner, target_rack)
+            self.move_book_copy(book_copy, from_rack, target_rack)
+            self.add_book_copy_to_rack(partner, from_rack)
+            moves.append((book_copy.copy_id, from_rack, target_rack))
+            moves.append((partner.copy_id, target_rack, from_rack))
+            if not job.is_pending_elsewhere(partner, from_rack):
+                job.targets.pop(partner.copy_id, None)
+
+        remaining = len(job.pending)
+        if job.done:
+            self.rebalance_job = None
+        return (moves, remaining), None
+
+    def snapshot(self) -> LibrarySnapshot:
+        """
+        Take a consistent, read-only view of the library as of the last completed operation.
+
+        The snapshot is not affected by later borrows, returns or rack changes, so reports and
+        searches can run against it while the library keeps changing.
+
+        :return: A LibrarySnapshot.
+        """
+        return self.state.committed
+
+    def __getstate__(self) -> dict:
+        """
+        Pickle the library without its snapshots. The persistent maps place their entries by
+        hash, and string hashes differ between processes, so the maps are rebuilt by
+        rebuild_state instead.
+        """
+        state = dict(vars(self))
+        del state['state']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        vars(self).update(state)
+        self.state = VersionedState()
+
+    @versioned
+    def rebuild_state(self) -> None:
+        """
+        Publish every book, copy, rack and loan again into empty snapshot maps, e.g. once an
+        unpickled library has its registries back.
+        """
+        self.state = VersionedState()
+        for book in Book.get_all_books():
+            self._publish_book(book)
+        for book_copy in BookCopy.get_all_book_copies():
+            self.state.publish_copy(book_copy)
+        for rack_no, copies in (self.racks or {}).items():
+            if copies:
+                self._publish_rack(rack_no)
+        for user in User.users:
+            if user.borrowed_books:
+                self.state.publish_user(user.user_id, tuple(borrowed.copy_id for borrowed in user.borrowed_books))
+
+    def _publish_copy(self, book_copy: BookCopy) -> None:
+        self.state.publish_copy(book_copy)
+        self.timeline.record(book_copy.copy_id, (book_copy.book.book_id, book_copy.rack_no, book_copy.borrowed_by,
+                                                 book_copy.due_date), epoch_day(self.today()))
+
+    def _record_departure(self, book_copy: BookCopy) -> None:
+        # The copy is neither on a rack nor on loan any more
+        self.timeline.record(book_copy.copy_id, None, epoch_day(self.today()))
+
+    def _publish_rack(self, rack_no: int) -> None:
+        self.state.publish_rack(rack_no, tuple(self.racks.get(rack_no, ())))
+
+    def _publish_book(self, book: Book) -> None:
+        self.state.publish_book(book)
+
+    def _publish_loan(self, book_copy: BookCopy, user: User) -> None:
+        self._publish_copy(book_copy)
+        self.state.publish_user(user.user_id, tuple(borrowed.copy_id for borrowed in user.borrowed_books))
+
+    def _validate_rack_range(self, start_rack: int, end_rack: int) -> Optional[str]:
+        if self.racks is None:
+            return "Library not created"
+        if not 1 <= start_rack <= end_rack <= len(self.racks):
+            return "Invalid rack range"
         return None
 
+    def get_rack_occupancy(self, start_rack: int, end_rack: int) -> Tuple[List[Tuple[int, int, int]], Optional[str]]:
+        """
+        Get the occupancy of every rack in a range.
+
+        :param start_rack: The first rack number of the range.
+        :param end_rack: The last rack number of the range.
+        :return: A tuple containing a list of (rack number, occupied slots, free slots) tuples
+                 and an error message if any.
+        """
+        error = self._validate_rack_range(start_rack, end_rack)
+        if error:
+            return [], error
+        occupancy = self.rack_index.occupancy[start_rack - 1:end_rack]
+        return [(rack_no, occupied, self.MAX_BOOKS_PER_RACK - occupied)
+                for rack_no, occupied in enumerate(occupancy, start_rack)], None
+
+    def count_free_slots(self, start_rack: int, end_rack: int) -> Tuple[Optional[int], Optional[str]]:
+        """
+        Count the free slots on the racks in a range.
+
+        :param start_rack: The first rack number of the range.
+        :param end_rack: The last rack number of the range.
+        :return: A tuple containing the number of free slots and an error message if any.
+        """
+        error = self._validate_rack_range(start_rack, end_rack)
+        if error:
+            return None, error
+        return self.rack_index.count_free(start_rack, end_rack, self.MAX_BOOKS_PER_RACK), None
+
+    def find_racks_with_free_slots(self, min_free_slots: int, start_rack: int = 1,
+                                   end_rack: Optional[int] = None) -> Tuple[List[Tuple[int, int]], Optional[str]]:
+        """
+        Find the racks in a range with at least a given number of free slots.
+
+        :param min_free_slots: The minimum number of free slots a rack must have.
+        :param start_rack: The first rack number of the range.
+        :param end_rack: The last rack number of the range, defaults to the last rack.
+        :return: A tuple containing a list of (rack number, free slots) tuples and an error message if any.
+        """
+        if end_rack is None and self.racks is not None:
+            end_rack = len(self.racks)
+        error = self._validate_rack_range(start_rack, end_rack)
+        if error:
+            return [], error
+        return self.rack_index.find_racks_with_free(self.MAX_BOOKS_PER_RACK, min_free_slots, start_rack,
+                                                    end_rack), None
+
+    def get_aisle_occupancy(self, racks_per_aisle: int) -> Tuple[List[Tuple[int, int, int, int, int]], Optional[str]]:
+        """
+        Get the occupancy of every aisle, an aisle being a run of consecutive racks.
+
+        :param racks_per_aisle: The number of racks in an aisle.
+        :return: A tuple containing a list of (aisle number, first rack, last rack, occupied slots, capacity)
+                 tuples and an error message if any.
+        """
+        if self.racks is None:
+            return [], "Library not created"
+        if racks_per_aisle < 1:
+            return [], "Racks per aisle must be positive"
+        aisles = []
+        for aisle_no, start_rack in enumerate(range(1, len(self.racks) + 1, racks_per_aisle), 1):
+            end_rack = min(start_rack + racks_per_aisle - 1, len(self.racks))
+            aisles.append((aisle_no, start_rack, end_rack, self.rack_index.count_occupied(start_rack, end_rack),
+                           (end_rack - start_rack + 1) * self.MAX_BOOKS_PER_RACK))
+        return aisles, None
+
+    @instrumented('get_book_copy_by_field')
     def get_book_copy_by_field(self, field_name: str, value: Any) -> Optional[Tuple['BookCopy', int]]:
         """
         Retrieve a book copy from all racks in the library based on a specified field.
@@ -282,15 +1019,19 @@ class Library:
         :return: A tuple containing the first BookCopy instance found with the specified field value in any rack and the rack number,
                  or None if not found.
         """
+        scanned = 0
         for rack_no, copies in self.racks.items():
-            for book_copy in copies:
+            for book_copy in copies.values():
+                scanned += 1
                 # Check if the field exists in the BookCopy instance
                 if hasattr(book_copy, field_name):
                     # Retrieve the value of the specified field
                     field_value = getattr(book_copy, field_name)
                     # Compare the field value with the provided value
-                    if field_value == value:
+                    if field_value is value or field_value == value:
+                        self.stats.record_scanned('get_book_copy_by_field', scanned)
                         return book_copy, rack_no
+        self.stats.record_scanned('get_book_copy_by_field', scanned)
         return None
 
 
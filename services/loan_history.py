@@ -0,0 +1,215 @@
+import json
+import os
+from array import array
+from collections import Counter
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+BORROW = 0
+RETURN = 1
+
+COLUMNS = ('kind', 'copy', 'book', 'user', 'day')
+COLUMN_TYPES = {'kind': 'b', 'copy': 'l', 'book': 'l', 'user': 'l', 'day': 'l'}
+
+
+class EventChunk:
+    """
+    A fixed-size block of loan events stored column by column in typed arrays.
+    """
+
+    def __init__(self):
+        self.columns: Dict[str, array] = {column: array(COLUMN_TYPES[column]) for column in COLUMNS}
+
+    def __len__(self) -> int:
+        return len(self.columns['kind'])
+
+    def append(self, kind: int, copy_key: int, book_key: int, user_key: int, day: int) -> None:
+        columns = self.columns
+        columns['kind'].append(kind)
+        columns['copy'].append(copy_key)
+        columns['book'].append(book_key)
+        columns['user'].append(user_key)
+        columns['day'].append(day)
+
+
+class LoanHistory:
+    """
+    Append-only store of borrow and return events.
+
+    Copy, book and user ids are coded as dense integers and dates as days since the epoch,
+    and events are kept in chunks of CHUNK_SIZE rows. Loans per book and per day, and the
+    total length of completed loans, are maintained as events are appended, so the common
+    aggregates never replay the log.
+    """
+    CHUNK_SIZE = 4096
+
+    def __init__(self):
+        self.symbols: Dict[str, List[Any]] = {column: [] for column in ('copy', 'book', 'user')}
+        self.keys: Dict[str, Dict[Any, int]] = {column: {} for column in ('copy', 'book', 'user')}
+        self.chunks: List[EventChunk] = [EventChunk()]
+        # The number of full chunks already written to each directory the history was saved to
+        self.saved_chunks: Dict[str, int] = {}
+
+        self.loans_by_book: Counter = Counter()
+        self.loans_by_day: Counter = Counter()
+        self.open_loans: Dict[int, int] = {}
+        self.completed_loans = 0
+        self.total_loan_days = 0
+
+    def __len__(self) -> int:
+        return (len(self.chunks) - 1) * self.CHUNK_SIZE + len(self.chunks[-1])
+
+    def _key(self, column: str, value: Any) -> int:
+        keys = self.keys[column]
+        key = keys.get(value)
+        if key is None:
+            key = keys[value] = len(self.symbols[column])
+            self.symbols[column].append(value)
+        return key
+
+    def _append(self, kind: int, copy_id: Any, book_id: Any, user_id: str, day: int) -> None:
+        copy_key = self._key('copy', copy_id)
+        book_key = self._key('book', book_id)
+        chunk = self.chunks[-1]
+        if len(chunk) == self.CHUNK_SIZE:
+            chunk = EventChunk()
+            self.chunks.append(chunk)
+        chunk.append(kind, copy_key, book_key, self._key('user', user_id), day)
+        self._aggregate(kind, copy_key, book_key, day)
+
+    def _aggregate(self, kind: int, copy_key: int, book_key: int, day: int) -> None:
+        if kind == BORROW:
+            self.loans_by_book[book_key] += 1
+            self.loans_by_day[day] += 1
+            self.open_loans[copy_key] = day
+        else:
+            borrowed_on = self.open_loans.pop(copy_key, None)
+            if borrowed_on is not None:
+                self.completed_loans += 1
+                self.total_loan_days += day - borrowed_on
+
+    def record_borrow(self, copy_id: Any, book_id: Any, user_id: str, day: int) -> None:
+        """
+        Record that a book copy was borrowed.
+        :param copy_id: The ID of the book copy.
+        :param book_id: The ID of the book.
+        :param user_id: The ID of the user borrowing the copy.
+        :param day: The day of the loan, in days since the epoch.
+        """
+        self._append(BORROW, copy_id, book_id, user_id, day)
+
+    def record_return(self, copy_id: Any, book_id: Any, user_id: str, day: int) -> None:
+        """
+        Record that a book copy was returned.
+        :param copy_id: The ID of the book copy.
+        :param book_id: The ID of the book.
+        :param user_id: The ID of the user returning the copy.
+        :param day: The day of the return, in days since the epoch.
+        """
+        self._append(RETURN, copy_id, book_id, user_id, day)
+
+    def iter_events(self) -> Iterator[Tuple[int, Any, Any, str, int]]:
+        """
+        Iterate over the recorded events in order.
+        :return: An iterator of (kind, copy id, book id, user id, day) tuples.
+        """
+        copies, books, users = self.symbols['copy'], self.symbols['book'], self.symbols['user']
+        for chunk in self.chunks:
+            columns = chunk.columns
+            for kind, copy_key, book_key, user_key, day in zip(*(columns[column] for column in COLUMNS)):
+                yield kind, copies[copy_key], books[book_key], users[user_key], day
+
+    def loans_per_book(self) -> Dict[Any, int]:
+        """
+        Count the loans of every book.
+        :return: A dictionary mapping book IDs to their number of loans.
+        """
+        books = self.symbols['book']
+        return {books[book_key]: count for book_key, count in self.loans_by_book.items()}
+
+    def most_borrowed(self, limit: int = 10) -> List[Tuple[Any, int]]:
+        """
+        Find the most borrowed books.
+        :param limit: The maximum number of books to return.
+        :return: A list of (book id, number of loans) tuples, most borrowed first.
+        """
+        books = self.symbols['book']
+        return [(books[book_key], count) for book_key, count in self.loans_by_book.most_common(limit)]
+
+    def loans_per_author(self, get_authors: Callable[[Any], List[str]]) -> Dict[str, int]:
+        """
+        Count the loans of the books of every author.
+        :param get_authors: Called with a book ID, returns the authors of the book.
+        :return: A dictionary mapping authors to their number of loans.
+        """
+        loans = Counter()
+        for book_id, count in self.loans_per_book().items():
+            for author in get_authors(book_id):
+                loans[author] += count
+        return dict(loans)
+
+    def loans_per_day(self, start_day: Optional[int] = None, end_day: Optional[int] = None) -> Dict[int, int]:
+        """
+        Count the loans started on every day in a range.
+        :param start_day: The first day of the range, in days since the epoch.
+        :param end_day: The last day of the range, in days since the epoch.
+        :return: A dictionary mapping days to their number of loans, in day order.
+        """
+        return {day: self.loans_by_day[day] for day in sorted(self.loans_by_day)
+                if (start_day is None or day >= start_day) and (end_day is None or day <= end_day)}
+
+    def average_loan_length(self) -> Optional[float]:
+        """
+        Compute the average length of the completed loans.
+        :return: The average number of days between borrow and return, or None if no loan was completed.
+        """
+        if not self.completed_loans:
+            return None
+        return self.total_loan_days / self.completed_loans
+
+    def save(self, directory: str) -> None:
+        """
+        Write the history to a directory. Full chunks are immutable, so only the chunks
+        written since the last save to the same directory, and the partially filled last
+        chunk, are written.
+        :param directory: The directory to write the history to.
+        """
+        os.makedirs(directory, exist_ok=True)
+        target = os.path.realpath(directory)
+        for chunk_no in range(self.saved_chunks.get(target, 0), len(self.chunks)):
+            with open(os.path.join(directory, f"chunk-{chunk_no:06d}.bin"), 'wb') as chunk_file:
+                for column in COLUMNS:
+                    self.chunks[chunk_no].columns[column].tofile(chunk_file)
+        self.saved_chunks[target] = len(self.chunks) - 1
+
+        with open(os.path.join(directory, "manifest.json"), 'w') as manifest_file:
+            json.dump({'chunk_size': self.CHUNK_SIZE, 'chunks': [len(chunk) for chunk in self.chunks],
+                       'symbols': self.symbols}, manifest_file)
+
+    @classmethod
+    def load(cls, directory: str) -> 'LoanHistory':
+        """
+        Read a history written by save and rebuild its aggregates.
+        :param directory: The directory the history was written to.
+        :return: The loaded LoanHistory instance.
+        """
+        with open(os.path.join(directory, "manifest.json")) as manifest_file:
+            manifest = json.load(manifest_file)
+
+        history = cls()
+        history.CHUNK_SIZE = manifest['chunk_size']
+        history.symbols = manifest['symbols']
+        history.keys = {column: {value: key for key, value in enumerate(values)}
+                        for column, values in history.symbols.items()}
+        history.chunks = []
+        for chunk_no, length in enumerate(manifest['chunks']):
+            chunk = EventChunk()
+            with open(os.path.join(directory, f"chunk-{chunk_no:06d}.bin"), 'rb') as chunk_file:
+                for column in COLUMNS:
+                    chunk.columns[column].fromfile(chunk_file, length)
+            history.chunks.append(chunk)
+            columns = chunk.columns
+            for kind, copy_key, book_key, day in zip(columns['kind'], columns['copy'], columns['book'],
+                                                     columns['day']):
+                history._aggregate(kind, copy_key, book_key, day)
+        history.saved_chunks = {os.path.realpath(directory): len(history.chunks) - 1}
+        return history
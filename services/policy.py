@@ -0,0 +1,107 @@
+from typing import Dict, List, Optional
+
+
+class BorrowingPolicy:
+    def __init__(self, tier: str, max_books_allowed: int, loan_days: int):
+        """
+            Initialize a new BorrowingPolicy instance.
+            :param tier: The name of the tier the policy applies to.
+            :param max_books_allowed: Maximum number of books a user of the tier can borrow.
+            :param loan_days: Number of days a user of the tier can keep a book.
+            """
+        self.tier = tier
+        self.max_books_allowed = max_books_allowed
+        self.loan_days = loan_days
+
+
+class PolicyTable:
+    """
+    Borrowing policies by tier.
+
+    Users do not store their tier directly but a tier group: a small integer that maps to a
+    tier name. Moving every user of one tier to another only remaps the groups of that tier,
+    so bulk re-tiering never touches User objects. Users assigned to a tier afterwards get a
+    fresh group.
+    """
+    DEFAULT_TIER = 'general'
+    DEFAULT_LOAN_DAYS = 14
+
+    policies: Dict[str, BorrowingPolicy] = {}
+    groups: List[str] = []
+    current_groups: Dict[str, int] = {}
+
+    @classmethod
+    def set_policy(cls, tier: str, max_books_allowed: int, loan_days: int) -> BorrowingPolicy:
+        """
+        Create or replace the policy of a tier.
+        :param tier: The name of the tier.
+        :param max_books_allowed: Maximum number of books a user of the tier can borrow.
+        :param loan_days: Number of days a user of the tier can keep a book.
+        :return: The BorrowingPolicy instance.
+        """
+        policy = cls.policies.get(tier)
+        if policy:
+            policy.max_books_allowed = max_books_allowed
+            policy.loan_days = loan_days
+        else:
+            policy = cls.policies[tier] = BorrowingPolicy(tier, max_books_allowed, loan_days)
+        return policy
+
+    @classmethod
+    def get_policy(cls, tier: str) -> Optional[BorrowingPolicy]:
+        """
+        Retrieve the policy of a tier.
+        :param tier: The name of the tier.
+        :return: The BorrowingPolicy instance if found, None otherwise.
+        """
+        return cls.policies.get(tier)
+
+    @classmethod
+    def get_group(cls, tier: str) -> int:
+        """
+        Get the group new users of a tier are assigned to.
+        :param tier: The name of the tier.
+        :return: The group id.
+        """
+        group = cls.current_groups.get(tier)
+        if group is None:
+            group = cls.current_groups[tier] = len(cls.groups)
+            cls.groups.append(tier)
+        return group
+
+    @classmethod
+    def get_tier(cls, group: int) -> str:
+        """
+        Get the tier a group currently belongs to.
+        :param group: The group id.
+        :return: The name of the tier.
+        """
+        return cls.groups[group]
+
+    @classmethod
+    def get_group_policy(cls, group: int) -> BorrowingPolicy:
+        """
+        Get the policy that applies to a group, falling back to the default tier.
+        :param group: The group id.
+        :return: The BorrowingPolicy instance.
+        """
+        policy = cls.policies.get(cls.groups[group])
+        if policy is None:
+            policy = cls.policies[cls.DEFAULT_TIER]
+        return policy
+
+    @classmethod
+    def retier(cls, from_tier: str, to_tier: str) -> int:
+        """
+        Move every user of a tier to another tier.
+        :param from_tier: The tier the users are moved from.
+        :param to_tier: The tier the users are moved to.
+        :return: The number of groups that were moved.
+        """
+        moved = 0
+        for group, tier in enumerate(cls.groups):
+            if tier == from_tier:
+                cls.groups[group] = to_tier
+                moved += 1
+        cls.current_groups.pop(from_tier, None)
+        return moved
@@ -0,0 +1,183 @@
+from array import array
+from typing import List, Tuple
+
+
+class RackIndex:
+    """
+    Per-rack occupancy counts with a segment tree on top.
+
+    Every tree node keeps the total and the minimum occupancy of the racks below it, so
+    range totals and "first rack with at least N free slots" are answered in O(log R)
+    and listing the racks with free slots costs O(log R) per rack returned. Free slots are
+    derived from the occupancy and the rack capacity passed to each query, so changing
+    the capacity of the library does not touch the index.
+    """
+    EMPTY = float('inf')
+
+    def __init__(self, no_of_racks: int):
+        self.no_of_racks = no_of_racks
+        self.occupancy = array('q', [0]) * no_of_racks
+        # Tree nodes looked at by the last find_first_with_free, for the library stats
+        self.nodes_visited = 0
+        self._build(no_of_racks)
+
+    def _build(self, capacity: int) -> None:
+        self.size = 1
+        while self.size < max(capacity, 1):
+            self.size *= 2
+        self.totals = [0] * (2 * self.size)
+        self.minimums = [self.EMPTY] * (2 * self.size)
+        for position, count in enumerate(self.occupancy):
+            self.totals[self.size + position] = count
+            self.minimums[self.size + position] = count
+        for node in range(self.size - 1, 0, -1):
+            self.totals[node] = self.totals[2 * node] + self.totals[2 * node + 1]
+            self.minimums[node] = min(self.minimums[2 * node], self.minimums[2 * node + 1])
+
+    def resize(self, no_of_racks: int) -> None:
+        """
+        Add empty racks to, or drop racks from, the end of the index.
+
+        The tree doubles its capacity when it runs out of leaves, so growing costs amortised
+        O(log R) per added rack. Dropped racks must be empty.
+        :param no_of_racks: The new number of racks.
+        """
+        if no_of_racks > self.size:
+            self.occupancy.extend([0] * (no_of_racks - self.no_of_racks))
+            self.no_of_racks = no_of_racks
+            self._build(max(no_of_racks, 2 * self.size))
+            return
+
+        for rack_no in range(self.no_of_racks + 1, no_of_racks + 1):
+            self.occupancy.append(0)
+            self._update(rack_no, 0)
+        for rack_no in range(self.no_of_racks, no_of_racks, -1):
+            self._update(rack_no, 0)
+            self._clear(rack_no)
+            self.occupancy.pop()
+        self.no_of_racks = no_of_racks
+
+    def _clear(self, rack_no: int) -> None:
+        node = self.size + rack_no - 1
+        self.minimums[node] = self.EMPTY
+        node //= 2
+        while node:
+            self.minimums[node] = min(self.minimums[2 * node], self.minimums[2 * node + 1])
+            node //= 2
+
+    def _update(self, rack_no: int, count: int) -> None:
+        self.occupancy[rack_no - 1] = count
+        totals, minimums = self.totals, self.minimums
+        node = self.size + rack_no - 1
+        totals[node] = count
+        minimums[node] = count
+        node //= 2
+        while node:
+            left, right = 2 * node, 2 * node + 1
+            totals[node] = totals[left] + totals[right]
+            minimums[node] = minimums[left] if minimums[left] < minimums[right] else minimums[right]
+            node //= 2
+
+    def increment(self, rack_no: int) -> None:
+        """
+        Record that a book copy was added to a rack.
+        :param rack_no: The rack number.
+        """
+        self._update(rack_no, self.occupancy[rack_no - 1] + 1)
+
+    def decrement(self, rack_no: int) -> None:
+        """
+        Record that a book copy was taken off a rack.
+        :param rack_no: The rack number.
+        """
+        self._update(rack_no, self.occupancy[rack_no - 1] - 1)
+
+    def get_occupancy(self, rack_no: int) -> int:
+        """
+        Get the number of book copies on a rack.
+        :param rack_no: The rack number.
+        :return: The number of book copies on the rack.
+        """
+        return self.occupancy[rack_no - 1]
+
+    def count_occupied(self, start_rack: int, end_rack: int) -> int:
+        """
+        Count the book copies on racks start_rack to end_rack (inclusive).
+        :param start_rack: The first rack number of the range.
+        :param end_rack: The last rack number of the range.
+        :return: The number of book copies in the range.
+        """
+        total = 0
+        low = self.size + start_rack - 1
+        high = self.size + end_rack
+        while low < high:
+            if low & 1:
+                total += self.totals[low]
+                low += 1
+            if high & 1:
+                high -= 1
+                total += self.totals[high]
+            low //= 2
+            high //= 2
+        return total
+
+    def count_free(self, start_rack: int, end_rack: int, max_per_rack: int) -> int:
+        """
+        Count the free slots on racks start_rack to end_rack (inclusive).
+        :param start_rack: The first rack number of the range.
+        :param end_rack: The last rack number of the range.
+        :param max_per_rack: The capacity of a rack.
+        :return: The number of free slots in the range.
+        """
+        return (end_rack - start_rack + 1) * max_per_rack - self.count_occupied(start_rack, end_rack)
+
+    def find_first_with_free(self, max_per_rack: int, min_free: int = 1, start_rack: int = 1) -> int:
+        """
+        Find the lowest numbered rack from start_rack onwards with at least min_free free slots.
+        :param max_per_rack: The capacity of a rack.
+        :param min_free: The minimum number of free slots.
+        :param start_rack: The rack number to start from.
+        :return: The rack number, or 0 if there is no such rack.
+        """
+        if start_rack > self.no_of_racks:
+            self.nodes_visited = 0
+            return 0
+        return self._find_first_at_most(start_rack - 1, max_per_rack - min_free) + 1
+
+    def _find_first_at_most(self, start: int, threshold: int) -> int:
+        minimums = self.minimums
+        node = self.size + start
+        visited = 1
+        if minimums[node] <= threshold:
+            self.nodes_visited = visited
+            return start
+        while node > 1:
+            visited += 1
+            # Climb until a right sibling covers racks after the start that have enough room
+            if not node & 1 and minimums[node + 1] <= threshold:
+                node += 1
+                while node < self.size:
+                    visited += 1
+                    node = 2 * node if minimums[2 * node] <= threshold else 2 * node + 1
+                self.nodes_visited = visited
+                return node - self.size
+            node //= 2
+        self.nodes_visited = visited
+        return -1
+
+    def find_racks_with_free(self, max_per_rack: int, min_free: int, start_rack: int,
+                             end_rack: int) -> List[Tuple[int, int]]:
+        """
+        List the racks in start_rack to end_rack (inclusive) with at least min_free free slots.
+        :param max_per_rack: The capacity of a rack.
+        :param min_free: The minimum number of free slots.
+        :param start_rack: The first rack number of the range.
+        :param end_rack: The last rack number of the range.
+        :return: A list of (rack number, free slots) tuples.
+        """
+        racks = []
+        rack_no = self.find_first_with_free(max_per_rack, min_free, start_rack)
+        while rack_no and rack_no <= end_rack:
+            racks.append((rack_no, max_per_rack - self.occupancy[rack_no - 1]))
+            rack_no = self.find_first_with_free(max_per_rack, min_free, rack_no + 1)
+        return racks
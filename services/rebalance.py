@@ -0,0 +1,74 @@
+from collections import deque
+from typing import Any, Deque, Dict, List, Tuple
+
+from .bookcopies import BookCopy
+
+
+class RebalanceJob:
+    """
+    A planned set of book copy moves that is applied in bounded batches.
+
+    The target layout puts the copies of a book on consecutive racks, in the order the
+    books first appear on the racks, and spreads the shelved copies evenly so every rack
+    holds either floor(S / R) or ceil(S / R) copies. Copies of a book already sitting on
+    a rack that keeps copies of that book in the target layout stay where they are, so
+    only the surplus copies are moved.
+    """
+
+    def __init__(self, moves: List[Tuple[BookCopy, int]]):
+        self.pending: Deque[Tuple[BookCopy, int]] = deque(moves)
+        self.targets: Dict[Any, int] = {book_copy.copy_id: target_rack for book_copy, target_rack in moves}
+        self.planned_moves = len(moves)
+
+    @classmethod
+    def plan(cls, racks: Dict[int, Dict[Any, BookCopy]]) -> 'RebalanceJob':
+        """
+        Compute the target layout of the shelved copies and the moves needed to reach it.
+        :param racks: The racks of the library.
+        :return: A RebalanceJob holding the planned moves.
+        """
+        copies_by_book: Dict[Any, List[BookCopy]] = {}
+        current: Dict[Tuple[int, Any], List[BookCopy]] = {}
+        for rack_no, copies in racks.items():
+            for book_copy in copies.values():
+                book_id = book_copy.book.book_id
+                copies_by_book.setdefault(book_id, []).append(book_copy)
+                current.setdefault((rack_no, book_id), []).append(book_copy)
+
+        target: Dict[Tuple[int, Any], int] = {}
+        total_copies = sum(len(copies) for copies in copies_by_book.values())
+        per_rack, extra = divmod(total_copies, len(racks)) if racks else (0, 0)
+        book_order = (book_id for book_id, copies in copies_by_book.items() for _ in copies)
+        for rack_no in racks:
+            for _ in range(per_rack + 1 if rack_no <= extra else per_rack):
+                key = (rack_no, next(book_order))
+                target[key] = target.get(key, 0) + 1
+
+        surplus: Dict[Any, List[BookCopy]] = {}
+        for (rack_no, book_id), copies in current.items():
+            surplus.setdefault(book_id, []).extend(copies[target.get((rack_no, book_id), 0):])
+
+        moves = []
+        for (rack_no, book_id), count in target.items():
+            for _ in range(count - len(current.get((rack_no, book_id), []))):
+                moves.append((surplus[book_id].pop(), rack_no))
+        return cls(moves)
+
+    @property
+    def done(self) -> bool:
+        return not self.pending
+
+    def next_move(self) -> Tuple[BookCopy, int]:
+        book_copy, target_rack = self.pending.popleft()
+        self.targets.pop(book_copy.copy_id, None)
+        return book_copy, target_rack
+
+    def is_pending_elsewhere(self, book_copy: BookCopy, rack_no: int) -> bool:
+        """
+        Check whether a copy still has to move away from the given rack.
+        :param book_copy: The book copy.
+        :param rack_no: The rack the copy is currently on.
+        :return: True if the copy has a pending move to another rack, False otherwise.
+        """
+        target_rack = self.targets.get(book_copy.copy_id)
+        return target_rack is not None and target_rack != rack_no
@@ -0,0 +1,135 @@
+import heapq
+from collections import Counter
+from typing import Any, Dict, Iterable, List, Set, Tuple
+
+
+def _rank(item: Tuple[Any, int]) -> Tuple[int, str]:
+    # Most co-borrowed first, ties broken by book id so the order does not depend on insertion
+    return -item[1], str(item[0])
+
+
+class CoBorrowIndex:
+    """
+    Sparse book x book counts of the users who borrowed both books.
+
+    Every user counts once per pair of books, however often they borrowed them. A borrow
+    updates the counts against the books the user borrowed before, so the cost depends on
+    the history of that user only.
+
+    Every book also keeps its TOP_K most co-borrowed books. Counts only grow, so a book can
+    only enter that set by overtaking its weakest member, and keeping it exact costs O(TOP_K)
+    per update. Recommendations of up to TOP_K books are served from it without looking at
+    the full counts.
+    """
+    TOP_K = 32
+
+    def __init__(self):
+        self.books_by_user: Dict[Any, Set[Any]] = {}
+        self.counts: Dict[Any, Counter] = {}
+        self.top_books: Dict[Any, Dict[Any, int]] = {}
+        self.weakest: Dict[Any, Tuple[Any, int]] = {}
+
+    def record_borrow(self, user_id: Any, book_id: Any) -> None:
+        """
+        Count a borrow of a book by a user.
+        :param user_id: The ID of the user.
+        :param book_id: The ID of the borrowed book.
+        """
+        borrowed = self.books_by_user.setdefault(user_id, set())
+        if book_id in borrowed:
+            return
+        for other_book_id in borrowed:
+            self._increment(book_id, other_book_id)
+            self._increment(other_book_id, book_id)
+        borrowed.add(book_id)
+
+    def _increment(self, book_id: Any, other_book_id: Any) -> None:
+        counts = self.counts.get(book_id)
+        if counts is None:
+            counts = self.counts[book_id] = Counter()
+        count = counts[other_book_id] = counts[other_book_id] + 1
+
+        top = self.top_books.get(book_id)
+        if top is None:
+            top = self.top_books[book_id] = {}
+        if other_book_id in top or len(top) < self.TOP_K:
+            top[other_book_id] = count
+            weakest = self.weakest.get(book_id)
+            if weakest and weakest[0] == other_book_id:
+                del self.weakest[book_id]
+            return
+        weakest = self.weakest.get(book_id)
+        if weakest is None:
+            weakest = self.weakest[book_id] = max(top.items(), key=_rank)
+        if count >= weakest[1] and _rank((other_book_id, count)) < _rank(weakest):
+            del top[weakest[0]]
+            del self.weakest[book_id]
+            top[other_book_id] = count
+
+    def recommend(self, book_id: Any, k: int = 5) -> List[Tuple[Any, int]]:
+        """
+        Get the books most often borrowed by the users who borrowed a book.
+        :param book_id: The ID of the book.
+        :param k: The maximum number of books to return.
+        :return: A list of (book id, number of users) tuples, most co-borrowed first.
+        """
+        if k <= self.TOP_K:
+            return sorted(self.top_books.get(book_id, {}).items(), key=_rank)[:k]
+        return heapq.nsmallest(k, self.counts.get(book_id, {}).items(), key=_rank)
+
+    @classmethod
+    def rebuild(cls, borrows: Iterable[Tuple[Any, Any]]) -> 'CoBorrowIndex':
+        """
+        Build the index from scratch from (user id, book id) borrows, e.g. the loan history.
+
+        With numpy and scipy installed the counts are computed as the sparse product of the
+        user x book incidence matrix with its transpose; otherwise the pairs of books of every
+        user are counted in Python.
+
+        :param borrows: An iterable of (user id, book id) tuples.
+        :return: The new CoBorrowIndex instance.
+        """
+        index = cls()
+        for user_id, book_id in borrows:
+            index.books_by_user.setdefault(user_id, set()).add(book_id)
+        try:
+            index.counts = index._count_pairs_sparse()
+        except ImportError:
+            index.counts = index._count_pairs()
+        index.top_books = {book_id: dict(heapq.nsmallest(cls.TOP_K, counts.items(), key=_rank))
+                           for book_id, counts in index.counts.items()}
+        return index
+
+    def _count_pairs(self) -> Dict[Any, Counter]:
+        counts: Dict[Any, Counter] = {}
+        for borrowed in self.books_by_user.values():
+            for book_id in borrowed:
+                book_counts = counts.setdefault(book_id, Counter())
+                book_counts.update(other_book_id for other_book_id in borrowed if other_book_id != book_id)
+        return counts
+
+    def _count_pairs_sparse(self) -> Dict[Any, Counter]:
+        import numpy
+        from scipy import sparse
+
+        book_ids: List[Any] = []
+        book_keys: Dict[Any, int] = {}
+        rows, columns = [], []
+        for user_key, borrowed in enumerate(self.books_by_user.values()):
+            for book_id in borrowed:
+                book_key = book_keys.get(book_id)
+                if book_key is None:
+                    book_key = book_keys[book_id] = len(book_ids)
+                    book_ids.append(book_id)
+                rows.append(user_key)
+                columns.append(book_key)
+
+        incidence = sparse.csr_matrix((numpy.ones(len(rows), dtype=numpy.int32), (rows, columns)),
+                                      shape=(len(self.books_by_user), len(book_ids)))
+        co_borrows = (incidence.T @ incidence).tocoo()
+        counts: Dict[Any, Counter] = {}
+        for book_key, other_book_key, count in zip(co_borrows.row.tolist(), co_borrows.col.tolist(),
+                                                   co_borrows.data.tolist()):
+            if book_key != other_book_key:
+                counts.setdefault(book_ids[book_key], Counter())[book_ids[other_book_key]] = count
+        return counts
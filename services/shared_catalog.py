@@ -0,0 +1,358 @@
+import math
+import os
+import pickle
+import struct
+from collections import ChainMap, namedtuple
+from multiprocessing import shared_memory
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from .book import Book
+from .snapshot import CopyRecord, LibrarySnapshot
+
+# Control segment: (sequence, generation). Books and checkpoint segment header: (number, payload length).
+HEADER = struct.Struct('<QQ')
+# Generation segment header: (generation, books generation, checkpoint, payload length)
+GENERATION_HEADER = struct.Struct('<QQQQ')
+
+# A new checkpoint is written once a generation would carry more changes than this, or than the
+# square root of the number of copies, which balances rewriting the checkpoint against growing deltas
+MIN_CHECKPOINT_CHANGES = 64
+
+BookRecord = namedtuple('BookRecord', ['book_id', 'title', 'author_id', 'publisher_id', 'extras'])
+
+INDEXED_ATTRIBUTES = ('book_id', 'author_id', 'publisher_id')
+
+
+class CatalogBooks:
+    """
+    The books of a snapshot and the IDs of their copies, with search indexes. Loans do not change
+    them, so they are published again only when books or copies are added or removed.
+    """
+
+    def __init__(self, snapshot: LibrarySnapshot):
+        self.books: List[BookRecord] = []
+        self.copy_ids: List[Tuple[Any, ...]] = []
+        self.positions: Dict[Any, int] = {}
+        self.index: Dict[str, Dict[Any, List[int]]] = {attribute: {} for attribute in INDEXED_ATTRIBUTES}
+        for _, book in sorted(snapshot.books.values(), key=lambda entry: entry[0]):
+            position = len(self.books)
+            # Cold books are read from the cold store, publishing must not fault them back in
+            attributes = book.peek_attributes()
+            extras = {name: value for name, value in attributes.items() if name not in Book.BASE_ATTRIBUTES}
+            record = BookRecord(book.book_id, attributes['title'], list(book.author_id), list(book.publisher_id),
+                                extras)
+            self.books.append(record)
+            copy_ids = snapshot.get_copy_ids(book.book_id)
+            self.copy_ids.append(copy_ids)
+            for copy_id in copy_ids:
+                self.positions[copy_id] = position
+            self.index['book_id'].setdefault(record.book_id, []).append(position)
+            for attribute in ('author_id', 'publisher_id'):
+                for value in dict.fromkeys(getattr(record, attribute)):
+                    self.index[attribute].setdefault(value, []).append(position)
+
+    def match(self, attribute: str, attribute_value: Any) -> List[int]:
+        """
+        Find the books matching an attribute value, like Library.search.
+        :return: The positions of the matching books, in catalog order.
+        """
+        index = self.index.get(attribute)
+        if index is not None:
+            return index.get(attribute_value, [])
+        positions = []
+        for position, book in enumerate(self.books):
+            book_value = book.title if attribute == 'title' else book.extras.get(attribute)
+            if isinstance(book_value, list):
+                matched = attribute_value in book_value
+            else:
+                matched = book_value is not None and book_value == attribute_value
+            if matched:
+                positions.append(position)
+        return positions
+
+
+class CatalogImage:
+    """
+    The catalog of one generation: the books, the state of every copy and the copies on loan to
+    every user, enough to answer search and print_borrowed without the library.
+
+    States and loans are mappings from copy and user IDs; a None value stands for a copy or a
+    user that is not in the catalog, so a generation can be laid over its checkpoint.
+    """
+
+    def __init__(self, books: CatalogBooks, states: Mapping[Any, Optional[Tuple[Any, Any, Any]]],
+                 users: Mapping[Any, Optional[Tuple[Any, ...]]]):
+        self.books = books
+        self.states = states
+        self.users = users
+
+    @staticmethod
+    def state_of(record: Optional[CopyRecord]) -> Optional[Tuple[Any, Any, Any]]:
+        """
+        Get the (rack number, borrowed by, due date) of a copy, or None for a removed copy.
+        """
+        return None if record is None else (record.rack_no, record.borrowed_by, record.due_date)
+
+    def _records(self, copy_ids) -> List[CopyRecord]:
+        books, positions, states = self.books.books, self.books.positions, self.states
+        records = []
+        for copy_id in copy_ids:
+            state = states.get(copy_id)
+            if state is not None and copy_id in positions:
+                records.append(CopyRecord(copy_id, books[positions[copy_id]], *state))
+        return records
+
+    def search(self, attribute: str, attribute_value: Any) -> List[CopyRecord]:
+        """
+        Search for book copies, with the same matching and ordering as Library.search.
+        :param attribute: The book attribute to search for.
+        :param attribute_value: The value to search for.
+        :return: A list of CopyRecord instances ordered by rack number.
+        """
+        copy_ids = self.books.copy_ids
+        found = self._records(copy_id for position in self.books.match(attribute, attribute_value)
+                              for copy_id in copy_ids[position])
+        return sorted(found, key=lambda record: record.rack_no if record.rack_no is not None else float('inf'))
+
+    def get_user_borrowed_book_copy(self, user_id: Any) -> List[CopyRecord]:
+        """
+        Get the book copies borrowed by a user, ordered by copy id.
+        :param user_id: The ID of the user.
+        :return: A list of CopyRecord instances.
+        """
+        return sorted(self._records(self.users.get(user_id) or ()), key=lambda record: record.copy_id)
+
+
+def segment_name(prefix: str, generation: int) -> str:
+    return f"{prefix}-{generation}"
+
+
+def books_segment_name(prefix: str, books_generation: int) -> str:
+    return f"{prefix}-books-{books_generation}"
+
+
+def checkpoint_segment_name(prefix: str, checkpoint: int) -> str:
+    return f"{prefix}-checkpoint-{checkpoint}"
+
+
+def _create_segment(name: str, header: struct.Struct, fields: Tuple[int, ...], payload: bytes) \
+        -> shared_memory.SharedMemory:
+    segment = shared_memory.SharedMemory(name=name, create=True, size=header.size + len(payload))
+    header.pack_into(segment.buf, 0, *fields, len(payload))
+    segment.buf[header.size:header.size + len(payload)] = payload
+    return segment
+
+
+def _read_segment(name: str, header: struct.Struct) -> Tuple[Tuple[int, ...], Any]:
+    segment = shared_memory.SharedMemory(name=name)
+    try:
+        *fields, length = header.unpack_from(segment.buf, 0)
+        return tuple(fields), pickle.loads(segment.buf[header.size:header.size + length])
+    finally:
+        segment.close()
+
+
+def _dump(value: Any) -> bytes:
+    return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+class SharedCatalogWriter:
+    """
+    Publishes catalog images to shared memory for reader processes.
+
+    Every publication is a new generation, written to its own segment before the generation
+    counter of the control segment moves to it. The counter is guarded by a sequence number,
+    odd while it is being written, so a reader never sees a torn value (a seqlock).
+
+    A catalog is split in three kinds of segments, so that a generation costs about as much as
+    what changed since the previous ones:
+    - a books segment, written again only when books or their copies change, which borrows
+      and returns never do;
+    - a checkpoint segment, holding the state of every copy and the loans of every user;
+    - the generation segment, holding only the copies and users that changed since the
+      checkpoint, found by diffing the persistent maps of the two snapshots.
+    A new checkpoint is written once the changes since the last one grow past about the square
+    root of the number of copies. Segments are unlinked once a newer generation exists and no
+    reader holds them.
+    """
+
+    def __init__(self, prefix: Optional[str] = None):
+        self.prefix = prefix or f"library-{os.getpid()}-{os.urandom(4).hex()}"
+        self.control = shared_memory.SharedMemory(name=f"{self.prefix}-control", create=True, size=HEADER.size)
+        HEADER.pack_into(self.control.buf, 0, 0, 0)
+        self.generation = 0
+        self.version: Optional[int] = None
+        self.segments: Dict[int, shared_memory.SharedMemory] = {}
+        # The books generation and the checkpoint of every published generation
+        self.bases: Dict[int, Tuple[int, int]] = {}
+        self.readers: Dict[int, int] = {}
+
+        self.books_generation = 0
+        self.books_source = None
+        self.books_segments: Dict[int, shared_memory.SharedMemory] = {}
+
+        self.checkpoint = 0
+        self.checkpoint_source: Optional[LibrarySnapshot] = None
+        self.checkpoint_segments: Dict[int, shared_memory.SharedMemory] = {}
+
+    def publish(self, snapshot: LibrarySnapshot) -> int:
+        """
+        Publish a snapshot as a new generation, unless it is the version already published.
+        :param snapshot: The LibrarySnapshot to publish.
+        :return: The current generation.
+        """
+        if snapshot.version == self.version:
+            return self.generation
+        # Persistent maps are never modified once committed, so an unchanged map is the same object
+        if self.books_source is None or self.books_source[0] is not snapshot.books \
+                or self.books_source[1] is not snapshot.book_copies:
+            self.books_generation += 1
+            self.books_segments[self.books_generation] = _create_segment(
+                books_segment_name(self.prefix, self.books_generation), HEADER, (self.books_generation,),
+                _dump(CatalogBooks(snapshot)))
+            self.books_source = (snapshot.books, snapshot.book_copies)
+
+        states, users = self._changes_since_checkpoint(snapshot)
+        if states is None:
+            self.checkpoint += 1
+            self.checkpoint_segments[self.checkpoint] = _create_segment(
+                checkpoint_segment_name(self.prefix, self.checkpoint), HEADER, (self.checkpoint,),
+                _dump(({record.copy_id: CatalogImage.state_of(record) for record in snapshot.copies.values()},
+                       dict(snapshot.users.items()))))
+            self.checkpoint_source = snapshot
+            states, users = {}, {}
+
+        generation = self.generation + 1
+        self.segments[generation] = _create_segment(segment_name(self.prefix, generation), GENERATION_HEADER,
+                                                    (generation, self.books_generation, self.checkpoint),
+                                                    _dump((states, users)))
+        self.bases[generation] = (self.books_generation, self.checkpoint)
+
+        sequence = HEADER.unpack_from(self.control.buf, 0)[0]
+        HEADER.pack_into(self.control.buf, 0, sequence + 1, self.generation)
+        HEADER.pack_into(self.control.buf, 0, sequence + 2, generation)
+        self.generation = generation
+        self.version = snapshot.version
+        self._unlink_unused()
+        return generation
+
+    def _changes_since_checkpoint(self, snapshot: LibrarySnapshot) \
+            -> Tuple[Optional[Dict[Any, Any]], Optional[Dict[Any, Any]]]:
+        # None when a new checkpoint is due
+        checkpoint = self.checkpoint_source
+        if checkpoint is None:
+            return None, None
+        limit = max(MIN_CHECKPOINT_CHANGES, math.isqrt(len(snapshot.copies)))
+        states = {}
+        for copy_id, record in checkpoint.copies.changes(snapshot.copies):
+            states[copy_id] = CatalogImage.state_of(record)
+            if len(states) > limit:
+                return None, None
+        users = dict(checkpoint.users.changes(snapshot.users))
+        if len(states) + len(users) > limit:
+            return None, None
+        return states, users
+
+    def acquire(self, generation: int) -> None:
+        """
+        Keep the segments of a generation until the reader it was handed to releases it.
+        """
+        self.readers[generation] = self.readers.get(generation, 0) + 1
+
+    def release(self, generation: int) -> None:
+        """
+        Release a generation acquired for a reader.
+        """
+        self.readers[generation] -= 1
+        if not self.readers[generation]:
+            del self.readers[generation]
+        self._unlink_unused()
+
+    def close(self) -> None:
+        """
+        Unlink every segment.
+        """
+        for segments in (self.segments, self.books_segments, self.checkpoint_segments):
+            for segment in segments.values():
+                segment.close()
+                segment.unlink()
+            segments.clear()
+        self.control.close()
+        self.control.unlink()
+
+    def _unlink_unused(self) -> None:
+        for generation in [generation for generation in self.segments
+                           if generation != self.generation and generation not in self.readers]:
+            del self.bases[generation]
+            self._unlink(self.segments, generation)
+        books_in_use = {books_generation for books_generation, _ in self.bases.values()}
+        for books_generation in [books_generation for books_generation in self.books_segments
+                                 if books_generation not in books_in_use]:
+            self._unlink(self.books_segments, books_generation)
+        checkpoints_in_use = {checkpoint for _, checkpoint in self.bases.values()}
+        for checkpoint in [checkpoint for checkpoint in self.checkpoint_segments
+                           if checkpoint not in checkpoints_in_use]:
+            self._unlink(self.checkpoint_segments, checkpoint)
+
+    @staticmethod
+    def _unlink(segments: Dict[int, shared_memory.SharedMemory], number: int) -> None:
+        segment = segments.pop(number)
+        segment.close()
+        segment.unlink()
+
+
+class SharedCatalogReader:
+    """
+    Reads the catalog images published by a SharedCatalogWriter, decoding every generation, books
+    segment and checkpoint once.
+    """
+
+    def __init__(self, prefix: str):
+        self.prefix = prefix
+        self.control = shared_memory.SharedMemory(name=f"{prefix}-control")
+        self.generation: Optional[int] = None
+        self.image: Optional[CatalogImage] = None
+        self.books_generation: Optional[int] = None
+        self.books: Optional[CatalogBooks] = None
+        self.checkpoint: Optional[int] = None
+        self.checkpoint_states: Dict[Any, Tuple[Any, Any, Any]] = {}
+        self.checkpoint_users: Dict[Any, Tuple[Any, ...]] = {}
+
+    def current_generation(self) -> int:
+        """
+        Read the latest published generation.
+        :return: The generation, 0 if nothing was published yet.
+        """
+        while True:
+            sequence, generation = HEADER.unpack_from(self.control.buf, 0)
+            if sequence % 2 == 0 and HEADER.unpack_from(self.control.buf, 0)[0] == sequence:
+                return generation
+
+    def catalog(self, generation: Optional[int] = None) -> CatalogImage:
+        """
+        Get the catalog image of a generation.
+        :param generation: The generation, defaults to the latest one. The writer must keep it
+                           published, see SharedCatalogWriter.acquire.
+        :return: The CatalogImage.
+        """
+        if generation is None:
+            generation = self.current_generation()
+        if generation != self.generation:
+            (published, books_generation, checkpoint), (states, users) = _read_segment(
+                segment_name(self.prefix, generation), GENERATION_HEADER)
+            if published != generation:
+                raise ValueError(f"Segment of generation {generation} holds generation {published}")
+            if books_generation != self.books_generation:
+                _, self.books = _read_segment(books_segment_name(self.prefix, books_generation), HEADER)
+                self.books_generation = books_generation
+            if checkpoint != self.checkpoint:
+                _, (self.checkpoint_states, self.checkpoint_users) = _read_segment(
+                    checkpoint_segment_name(self.prefix, checkpoint), HEADER)
+                self.checkpoint = checkpoint
+            self.image = CatalogImage(self.books, ChainMap(states, self.checkpoint_states),
+                                      ChainMap(users, self.checkpoint_users))
+            self.generation = generation
+        return self.image
+
+    def close(self) -> None:
+        self.control.close()
@@ -0,0 +1,379 @@
+from collections import namedtuple
+from functools import wraps
+from typing import Any, Iterator, List, Optional, Tuple
+
+from .book import Book
+
+CopyRecord = namedtuple('CopyRecord', ['copy_id', 'book', 'rack_no', 'borrowed_by', 'due_date'])
+
+_BITS = 5
+_MASK = (1 << _BITS) - 1
+_HASH_BITS = 64
+_HASH_MASK = (1 << _HASH_BITS) - 1
+
+
+class PersistentMap:
+    """
+    Immutable hash map with structural sharing (a hash array mapped trie).
+
+    Inner nodes are dicts of at most 32 children indexed by five bits of the key hash, and
+    leaves are tuples of (key, value) pairs. set and delete copy only the nodes on the path
+    to the key, about log32(n) small dicts, and share everything else with the previous map,
+    so old versions stay valid and cheap to keep.
+
+    set and delete accept an optional set of owned node ids. Nodes listed there were created
+    by the caller since it last shared the map, so they are updated in place instead of being
+    copied again, which makes a batch of writes to the same map much cheaper.
+    """
+    __slots__ = ('root', 'size')
+
+    def __init__(self, root: Optional[dict] = None, size: int = 0):
+        self.root = root if root is not None else {}
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __contains__(self, key: Any) -> bool:
+        return self.get(key, _MISSING) is not _MISSING
+
+    def get(self, key: Any, default: Any = None) -> Any:
+        """
+        Look up a key.
+        :param key: The key to look up.
+        :param default: The value returned if the key is not in the map.
+        :return: The value of the key, or default.
+        """
+        key_hash = hash(key) & _HASH_MASK
+        node = self.root
+        shift = 0
+        while True:
+            child = node.get((key_hash >> shift) & _MASK)
+            if child is None:
+                return default
+            if type(child) is dict:
+                node = child
+                shift += _BITS
+                continue
+            for child_key, value in child:
+                if child_key == key:
+                    return value
+            return default
+
+    def set(self, key: Any, value: Any, owned: Optional[set] = None) -> 'PersistentMap':
+        """
+        Return a new map with the key set to the value.
+        :param key: The key.
+        :param value: The value.
+        :param owned: Optional set of the ids of nodes that may be updated in place.
+        :return: The new PersistentMap.
+        """
+        root, added = self._set(self.root, key, value, hash(key) & _HASH_MASK, 0, owned)
+        return PersistentMap(root, self.size + added)
+
+    @staticmethod
+    def _copy_node(node: dict, owned: Optional[set]) -> dict:
+        if owned is None:
+            return dict(node)
+        if id(node) in owned:
+            return node
+        new_node = dict(node)
+        owned.add(id(new_node))
+        return new_node
+
+    @classmethod
+    def _set(cls, node: dict, key: Any, value: Any, key_hash: int, shift: int,
+             owned: Optional[set] = None) -> Tuple[dict, bool]:
+        index = (key_hash >> shift) & _MASK
+        new_node = cls._copy_node(node, owned)
+        child = node.get(index)
+        if child is None:
+            new_node[index] = ((key, value),)
+            return new_node, True
+        if type(child) is dict:
+            new_node[index], added = cls._set(child, key, value, key_hash, shift + _BITS, owned)
+            return new_node, added
+
+        for position, (child_key, _) in enumerate(child):
+            if child_key == key:
+                new_node[index] = child[:position] + ((key, value),) + child[position + 1:]
+                return new_node, False
+        if shift + _BITS >= _HASH_BITS:
+            new_node[index] = child + ((key, value),)
+            return new_node, True
+
+        # Split the leaf into an inner node one level down
+        sub_node = {}
+        for child_key, child_value in child + ((key, value),):
+            sub_node, _ = cls._set(sub_node, child_key, child_value, hash(child_key) & _HASH_MASK, shift + _BITS,
+                                   owned)
+        new_node[index] = sub_node
+        return new_node, True
+
+    def delete(self, key: Any, owned: Optional[set] = None) -> 'PersistentMap':
+        """
+        Return a new map without the key.
+        :param key: The key to remove.
+        :param owned: Optional set of the ids of nodes that may be updated in place.
+        :return: The new PersistentMap, or this map if the key is not in it.
+        """
+        root = self._delete(self.root, key, hash(key) & _HASH_MASK, 0, owned)
+        if root is None:
+            return self
+        return PersistentMap(root, self.size - 1)
+
+    @classmethod
+    def _delete(cls, node: dict, key: Any, key_hash: int, shift: int, owned: Optional[set] = None) -> Optional[dict]:
+        index = (key_hash >> shift) & _MASK
+        child = node.get(index)
+        if child is None:
+            return None
+        if type(child) is dict:
+            new_child = cls._delete(child, key, key_hash, shift + _BITS, owned)
+            if new_child is None:
+                return None
+        elif len(child) == 1:
+            if child[0][0] != key:
+                return None
+            new_child = ()
+        else:
+            new_child = tuple(pair for pair in child if pair[0] != key)
+            if len(new_child) == len(child):
+                return None
+
+        new_node = cls._copy_node(node, owned)
+        if new_child:
+            new_node[index] = new_child
+        else:
+            del new_node[index]
+        return new_node
+
+    def items(self) -> Iterator[Tuple[Any, Any]]:
+        """
+        Iterate over the (key, value) pairs of the map, in no particular order.
+        """
+        stack = [self.root]
+        while stack:
+            for child in stack.pop().values():
+                if type(child) is dict:
+                    stack.append(child)
+                else:
+                    yield from child
+
+    def values(self) -> Iterator[Any]:
+        for _, value in self.items():
+            yield value
+
+    def changes(self, newer: 'PersistentMap', removed: Any = None) -> Iterator[Tuple[Any, Any]]:
+        """
+        Iterate over the keys whose value differs in a newer version of this map. Subtrees the
+        two versions share are skipped, so this costs about O(changes * log32(n)).
+        :param newer: A map derived from this one by set and delete.
+        :param removed: The value reported for keys missing from the newer map.
+        :return: An iterator of (key, value in the newer map) pairs.
+        """
+        stack = [(self.root, newer.root)]
+        while stack:
+            old_node, new_node = stack.pop()
+            for index in old_node.keys() | new_node.keys():
+                old_child, new_child = old_node.get(index), new_node.get(index)
+                if old_child is new_child:
+                    continue
+                if type(old_child) is dict and type(new_child) is dict:
+                    stack.append((old_child, new_child))
+                    continue
+                old_items = dict(self._subtree_items(old_child))
+                for key, value in self._subtree_items(new_child):
+                    if old_items.pop(key, _MISSING) is not value:
+                        yield key, value
+                for key in old_items:
+                    yield key, removed
+
+    @staticmethod
+    def _subtree_items(child: Any) -> Iterator[Tuple[Any, Any]]:
+        if child is None:
+            return
+        if type(child) is not dict:
+            yield from child
+            return
+        yield from PersistentMap(child).items()
+
+
+_MISSING = object()
+EMPTY_MAP = PersistentMap()
+
+
+class LibrarySnapshot:
+    """
+    A point-in-time, read-only view of the books, copies, racks and loans of a library.
+
+    Taking a snapshot costs O(1): it only holds on to the persistent maps of a committed
+    version, which later mutations of the library never modify. It covers the books and
+    copies added through the library it was taken from. The copies of every book are kept
+    in a map of their own, from copy ID to a sequence number giving their creation order.
+    """
+
+    def __init__(self, version: int, books: PersistentMap, book_copies: PersistentMap, copies: PersistentMap,
+                 racks: PersistentMap, users: PersistentMap):
+        self.version = version
+        self.books = books
+        self.book_copies = book_copies
+        self.copies = copies
+        self.racks = racks
+        self.users = users
+
+    def get_book_copy(self, copy_id: Any) -> Optional[CopyRecord]:
+        """
+        Retrieve a book copy as of the snapshot.
+        :param copy_id: The ID of the book copy.
+        :return: The CopyRecord if found, None otherwise.
+        """
+        return self.copies.get(copy_id)
+
+    def get_copy_ids(self, book_id: Any) -> Tuple[Any, ...]:
+        """
+        Get the IDs of the copies of a book as of the snapshot, in the order they were created.
+        :param book_id: The ID of the book.
+        :return: A tuple of copy IDs.
+        """
+        copies = sorted(self.book_copies.get(book_id, EMPTY_MAP).items(), key=lambda item: item[1])
+        return tuple(copy_id for copy_id, _ in copies)
+
+    def get_rack(self, rack_no: int) -> List[CopyRecord]:
+        """
+        Retrieve the copies on a rack as of the snapshot.
+        :param rack_no: The rack number.
+        :return: A list of CopyRecord instances.
+        """
+        return [self.copies.get(copy_id) for copy_id in self.racks.get(rack_no, ())]
+
+    def get_user_borrowed_book_copy(self, user_id: Any) -> List[CopyRecord]:
+        """
+        Get the book copies borrowed by a user as of the snapshot, ordered by copy id.
+        :param user_id: The ID of the user.
+        :return: A list of CopyRecord instances.
+        """
+        records = [self.copies.get(copy_id) for copy_id in self.users.get(user_id, ())]
+        return sorted(records, key=lambda record: record.copy_id)
+
+    def search(self, attribute: str, attribute_value: Any) -> List[CopyRecord]:
+        """
+        Search for book copies as of the snapshot, with the same matching and ordering as Library.search.
+        :param attribute: The book attribute to search for.
+        :param attribute_value: The value to search for.
+        :return: A list of CopyRecord instances ordered by rack number.
+        """
+        keyed_attribute = Book.KEYED_ATTRIBUTES.get(attribute)
+        key = None
+        if keyed_attribute:
+            symbols, keys_attribute = keyed_attribute
+            key = symbols.key_of(attribute_value)
+            if key is None:
+                return []
+
+        found = []
+        for sequence, book in self.books.values():
+            if keyed_attribute:
+                matched = key in getattr(book, keys_attribute)
+            else:
+                book_value = getattr(book, attribute, None)
+                if isinstance(book_value, list):
+                    matched = attribute_value in book_value
+                else:
+                    matched = book_value is not None and book_value == attribute_value
+            if matched:
+                for copy_id, position in self.book_copies.get(book.book_id, EMPTY_MAP).items():
+                    found.append((sequence, position, self.copies.get(copy_id)))
+
+        found.sort(key=lambda match: (match[2].rack_no if match[2].rack_no is not None else float('inf'),
+                                      match[0], match[1]))
+        return [record for _, _, record in found]
+
+
+class VersionedState:
+    """
+    The persistent maps behind Library snapshots.
+
+    Mutations are staged on working copies of the maps and made visible together by commit,
+    so a snapshot never observes half of an operation such as a borrow, which touches a rack,
+    a copy and a user. Nodes created since the last commit are not part of any snapshot yet,
+    so they are tracked in owned and updated in place.
+    """
+
+    def __init__(self):
+        self.books = EMPTY_MAP
+        self.book_copies = EMPTY_MAP
+        self.copies = EMPTY_MAP
+        self.racks = EMPTY_MAP
+        self.users = EMPTY_MAP
+        self.next_copy_sequence = 0
+        self.dirty = False
+        self.owned = set()
+        self.committed = LibrarySnapshot(0, EMPTY_MAP, EMPTY_MAP, EMPTY_MAP, EMPTY_MAP, EMPTY_MAP)
+
+    def publish_book(self, book: Book) -> None:
+        entry = self.books.get(book.book_id)
+        if entry is None or entry[1] is not book:
+            self.books = self.books.set(book.book_id, (len(self.books), book), self.owned)
+            self.dirty = True
+
+    def publish_copy(self, book_copy) -> None:
+        if book_copy.copy_id not in self.copies:
+            # A new copy joins the copies of its book, only the map of that book is updated
+            book_id = book_copy.book.book_id
+            copies = self.book_copies.get(book_id, EMPTY_MAP).set(book_copy.copy_id, self.next_copy_sequence,
+                                                                  self.owned)
+            self.book_copies = self.book_copies.set(book_id, copies, self.owned)
+            self.next_copy_sequence += 1
+        self.copies = self.copies.set(book_copy.copy_id, CopyRecord(book_copy.copy_id, book_copy.book,
+                                                                    book_copy.rack_no, book_copy.borrowed_by,
+                                                                    book_copy.due_date), self.owned)
+        self.dirty = True
+
+    def remove_copy(self, copy_id: Any) -> None:
+        record = self.copies.get(copy_id)
+        if record is None:
+            return
+        book_id = record.book.book_id
+        copies = self.book_copies.get(book_id, EMPTY_MAP).delete(copy_id, self.owned)
+        self.book_copies = (self.book_copies.set(book_id, copies, self.owned) if copies
+                            else self.book_copies.delete(book_id, self.owned))
+        self.copies = self.copies.delete(copy_id, self.owned)
+        self.dirty = True
+
+    def publish_rack(self, rack_no: int, copy_ids: Tuple[Any, ...]) -> None:
+        self.racks = (self.racks.set(rack_no, copy_ids, self.owned) if copy_ids
+                      else self.racks.delete(rack_no, self.owned))
+        self.dirty = True
+
+    def reset_racks(self) -> None:
+        self.racks = EMPTY_MAP
+        self.dirty = True
+
+    def publish_user(self, user_id: Any, copy_ids: Tuple[Any, ...]) -> None:
+        self.users = (self.users.set(user_id, copy_ids, self.owned) if copy_ids
+                      else self.users.delete(user_id, self.owned))
+        self.dirty = True
+
+    def commit(self) -> None:
+        """
+        Make the staged changes visible to new snapshots as a new version.
+        """
+        if self.dirty:
+            self.committed = LibrarySnapshot(self.committed.version + 1, self.books, self.book_copies, self.copies,
+                                             self.racks, self.users)
+            self.dirty = False
+            self.owned = set()
+
+
+def versioned(method):
+    """
+    Decorate a mutating Library method so that its changes are committed as one version.
+    """
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self.state.commit()
+    return wrapper
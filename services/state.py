@@ -0,0 +1,178 @@
+import gc
+import hashlib
+import os
+import pickle
+import stat
+from typing import Any, Dict, Optional, Tuple
+
+from .book import Book
+from .bookcopies import BookCopy
+from .library import Library
+from .policy import PolicyTable
+from .user import User
+
+# Bump when the layout of the pickled classes changes so that older warm states are ignored
+STATE_VERSION = 8
+
+REGISTRIES = (
+    (Book, ('books', 'books_by_id')),
+    (BookCopy, ('bookcopies', 'bookcopies_by_id', 'positions', 'tombstones', 'copies_by_book')),
+    (User, ('users', 'users_by_id', 'MAX_BOOK_ALLOWED')),
+    (PolicyTable, ('policies', 'groups', 'current_groups')),
+)
+
+# Symbol tables are referenced from elsewhere (e.g. Book.KEYED_ATTRIBUTES), so they are
+# restored in place instead of being replaced
+SYMBOL_TABLES = (
+    (Book, 'author_symbols'),
+    (Book, 'publisher_symbols'),
+    (BookCopy, 'user_symbols'),
+)
+
+
+def reset_registries() -> None:
+    """
+    Empty the class-level registries of books, copies and users, the symbol tables and the
+    borrowing policies, leaving only the default policy. The cold tier, if enabled, is closed
+    first, so books still referenced elsewhere keep all their attributes.
+    """
+    Library.disable_cold_tier()
+    Book.books = []
+    Book.books_by_id = {}
+    BookCopy.bookcopies = []
+    BookCopy.bookcopies_by_id = {}
+    BookCopy.positions = {}
+    BookCopy.tombstones = 0
+    BookCopy.copies_by_book = {}
+    User.users = []
+    User.users_by_id = {}
+    PolicyTable.policies = {}
+    PolicyTable.groups = []
+    PolicyTable.current_groups = {}
+    for owner, name in SYMBOL_TABLES:
+        symbols = getattr(owner, name)
+        symbols.keys = {}
+        symbols.values = []
+    PolicyTable.set_policy(PolicyTable.DEFAULT_TIER, User.MAX_BOOK_ALLOWED, PolicyTable.DEFAULT_LOAN_DAYS)
+
+
+def capture_state(library: Library) -> Dict[str, Any]:
+    """
+    Collect a library together with the class-level registries it depends on. The snapshots
+    of the library are left out, see Library.__getstate__.
+    :param library: The Library instance.
+    :return: A dictionary that can be pickled and passed to restore_state.
+    """
+    return {
+        'version': STATE_VERSION,
+        'library': library,
+        'registries': [{name: getattr(owner, name) for name in names} for owner, names in REGISTRIES],
+        'symbols': [(getattr(owner, name).keys, getattr(owner, name).values) for owner, name in SYMBOL_TABLES],
+    }
+
+
+def restore_state(state: Dict[str, Any]) -> Library:
+    """
+    Install the registries of a captured state and return its library.
+    :param state: A dictionary returned by capture_state.
+    :return: The restored Library instance.
+    """
+    # The cold tier tracks the books being replaced
+    Library.disable_cold_tier()
+    for (owner, _), attributes in zip(REGISTRIES, state['registries']):
+        for name, value in attributes.items():
+            setattr(owner, name, value)
+    for (owner, name), (keys, values) in zip(SYMBOL_TABLES, state['symbols']):
+        symbols = getattr(owner, name)
+        symbols.keys = keys
+        symbols.values = values
+    library = state['library']
+    library.rebuild_state()
+    return library
+
+
+def setup_key(setup_path: str) -> Tuple[Optional[str], Optional[str]]:
+    """
+    Compute the cache key of a setup file from its content.
+    :param setup_path: The path of the setup file.
+    :return: A tuple containing the hex digest and an error message if any.
+    """
+    digest = hashlib.sha256(f"library-state-{STATE_VERSION}\n".encode())
+    try:
+        with open(setup_path, 'rb') as setup_file:
+            for block in iter(lambda: setup_file.read(1 << 16), b''):
+                digest.update(block)
+    except OSError as e:
+        return None, f"Error reading setup file: {e}"
+    return digest.hexdigest(), None
+
+
+def save_state(library: Library, path: str) -> Optional[str]:
+    """
+    Write the warm state of a library to a file, replacing it atomically.
+    :param library: The Library instance.
+    :param path: The path of the state file.
+    :return: An error message if any, None otherwise.
+    """
+    temporary_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        # Only the current user may write the state, see load_state
+        with open(temporary_path, 'wb', opener=lambda file, flags: os.open(file, flags, 0o600)) as state_file:
+            pickle.dump(capture_state(library), state_file, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_path, path)
+    except (OSError, pickle.PicklingError, TypeError, AttributeError) as e:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)
+        return f"Error saving library state: {e}"
+    return None
+
+
+def load_state(path: str) -> Tuple[Optional[Library], Optional[str]]:
+    """
+    Load a warm state written by save_state and install its registries.
+
+    Unpickling can run arbitrary code, so the file is only loaded if it belongs to the current
+    user and nobody else can write to it.
+    :param path: The path of the state file.
+    :return: A tuple containing the restored Library instance and an error message if any.
+    """
+    error = check_state_file(path)
+    if error:
+        return None, error
+    # The state is millions of small containers; collecting while they are allocated only wastes time
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        with open(path, 'rb') as state_file:
+            state = pickle.load(state_file)
+        if not isinstance(state, dict) or state.get('version') != STATE_VERSION:
+            return None, "Library state version mismatch"
+        library = restore_state(state)
+        # The loaded objects live as long as the process, so keep them out of later collections
+        gc.freeze()
+        return library, None
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as e:
+        return None, f"Error loading library state: {e}"
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+
+def check_state_file(path: str) -> Optional[str]:
+    """
+    Check that a state file can be trusted: owned by the current user and not writable by others.
+    :param path: The path of the state file.
+    :return: An error message if the file must not be loaded, None otherwise.
+    """
+    try:
+        status = os.stat(path)
+    except OSError as e:
+        return f"Error loading library state: {e}"
+    if hasattr(os, 'getuid') and status.st_uid != os.getuid():
+        return f"Refusing to load library state {path}: not owned by the current user"
+    if status.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        return f"Refusing to load library state {path}: writable by other users"
+    return None
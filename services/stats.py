@@ -0,0 +1,227 @@
+from functools import wraps
+from time import perf_counter_ns
+from typing import Dict, List, Optional, Tuple
+
+
+class LatencyHistogram:
+    """
+    Log-linear (HDR-style) latency histogram.
+
+    Values are bucketed by their power of two and then split into SUB_BUCKETS linear
+    sub-buckets, so the relative error of any bucket is bounded by 1 / SUB_BUCKETS
+    while the number of buckets only grows with the logarithm of the largest value.
+    """
+    SUB_BUCKET_BITS = 3
+    SUB_BUCKETS = 1 << SUB_BUCKET_BITS
+
+    def __init__(self):
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.total = 0
+        self.max = 0
+
+    @classmethod
+    def bucket_index(cls, value: int) -> int:
+        """
+        Map a non-negative value to its bucket index.
+        :param value: The recorded value (nanoseconds).
+        :return: The index of the bucket holding the value.
+        """
+        if value < cls.SUB_BUCKETS * 2:
+            return value
+        exponent = value.bit_length() - cls.SUB_BUCKET_BITS - 1
+        return (exponent + 1) * cls.SUB_BUCKETS + (value >> exponent) - cls.SUB_BUCKETS
+
+    @classmethod
+    def bucket_upper_bound(cls, index: int) -> int:
+        """
+        Return the exclusive upper bound of a bucket.
+        :param index: The bucket index.
+        :return: The smallest value that falls in a later bucket.
+        """
+        if index < cls.SUB_BUCKETS * 2:
+            return index + 1
+        exponent = index // cls.SUB_BUCKETS - 1
+        mantissa = index % cls.SUB_BUCKETS + cls.SUB_BUCKETS
+        return (mantissa + 1) << exponent
+
+    def record(self, value: int) -> None:
+        """
+        Record a single value.
+        :param value: The value to record (nanoseconds).
+        """
+        index = self.bucket_index(value)
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+    def percentile(self, percentile: float) -> int:
+        """
+        Return an upper bound for the given percentile of the recorded values.
+        :param percentile: The percentile to compute, between 0 and 100.
+        :return: The upper bound of the bucket containing the percentile, or 0 if empty.
+        """
+        if not self.count:
+            return 0
+        threshold = self.count * percentile / 100
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if seen >= threshold:
+                return min(self.bucket_upper_bound(index), self.max)
+        return self.max
+
+    def cumulative_buckets(self) -> List[Tuple[int, int]]:
+        """
+        Return the non-empty buckets as cumulative counts.
+        :return: A list of (upper bound, number of values below the bound) tuples.
+        """
+        buckets = []
+        seen = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            buckets.append((self.bucket_upper_bound(index), seen))
+        return buckets
+
+
+class OperationStats:
+    def __init__(self, name: str):
+        self.name = name
+        self.calls = 0
+        self.items_scanned = 0
+        self.latency = LatencyHistogram()
+
+
+class LibraryStats:
+    """
+    Call counts, latency histograms and items scanned for the Library hot paths.
+
+    Recording is disabled by default; while disabled, instrumented methods only pay
+    for a single attribute check.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.operations: Dict[str, OperationStats] = {}
+
+    def enable(self) -> None:
+        self.enabled = True
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def reset(self) -> None:
+        """
+        Discard everything recorded so far.
+        """
+        self.operations = {}
+
+    def get_operation(self, name: str) -> OperationStats:
+        """
+        Retrieve the stats of an operation, creating them on first use.
+        :param name: The name of the operation.
+        :return: The OperationStats instance for the operation.
+        """
+        operation = self.operations.get(name)
+        if operation is None:
+            operation = self.operations[name] = OperationStats(name)
+        return operation
+
+    def record_call(self, name: str, elapsed_ns: int) -> None:
+        """
+        Record one call of an operation.
+        :param name: The name of the operation.
+        :param elapsed_ns: The time spent in the call in nanoseconds.
+        """
+        operation = self.get_operation(name)
+        operation.calls += 1
+        operation.latency.record(elapsed_ns)
+
+    def record_scanned(self, name: str, items: int) -> None:
+        """
+        Record the number of items an operation had to look at.
+        :param name: The name of the operation.
+        :param items: The number of racks, copies, books or index nodes scanned.
+        """
+        if self.enabled:
+            self.get_operation(name).items_scanned += items
+
+    def summary(self) -> List[Tuple[str, int, float, float, float, float, int]]:
+        """
+        Summarise the recorded operations.
+        :return: A list of (operation, calls, mean us, p50 us, p99 us, max us, items scanned) tuples.
+        """
+        rows = []
+        for name in sorted(self.operations):
+            operation = self.operations[name]
+            latency = operation.latency
+            mean = latency.total / latency.count if latency.count else 0
+            rows.append((name, operation.calls, mean / 1000, latency.percentile(50) / 1000,
+                         latency.percentile(99) / 1000, latency.max / 1000, operation.items_scanned))
+        return rows
+
+    def to_prometheus(self, prefix: str = 'library') -> str:
+        """
+        Render the recorded stats in the Prometheus text exposition format.
+        :param prefix: The prefix used for every metric name.
+        :return: The metrics as a string.
+        """
+        names = sorted(self.operations)
+        lines = [f'# HELP {prefix}_operation_calls_total Number of calls per Library operation.',
+                 f'# TYPE {prefix}_operation_calls_total counter']
+        for name in names:
+            lines.append(f'{prefix}_operation_calls_total{{operation="{name}"}} {self.operations[name].calls}')
+
+        lines.append(f'# HELP {prefix}_operation_items_scanned_total Items scanned per Library operation.')
+        lines.append(f'# TYPE {prefix}_operation_items_scanned_total counter')
+        for name in names:
+            lines.append(f'{prefix}_operation_items_scanned_total{{operation="{name}"}} '
+                         f'{self.operations[name].items_scanned}')
+
+        lines.append(f'# HELP {prefix}_operation_latency_seconds Latency per Library operation.')
+        lines.append(f'# TYPE {prefix}_operation_latency_seconds histogram')
+        for name in names:
+            latency = self.operations[name].latency
+            for upper_bound, count in latency.cumulative_buckets():
+                lines.append(f'{prefix}_operation_latency_seconds_bucket{{operation="{name}",'
+                             f'le="{upper_bound / 1e9:.9g}"}} {count}')
+            lines.append(f'{prefix}_operation_latency_seconds_bucket{{operation="{name}",le="+Inf"}} '
+                         f'{latency.count}')
+            lines.append(f'{prefix}_operation_latency_seconds_sum{{operation="{name}"}} {latency.total / 1e9:.9g}')
+            lines.append(f'{prefix}_operation_latency_seconds_count{{operation="{name}"}} {latency.count}')
+        return '\n'.join(lines) + '\n'
+
+    def dump_prometheus(self, path: str) -> Optional[str]:
+        """
+        Write the recorded stats to a file in the Prometheus text exposition format.
+        :param path: The file to write.
+        :return: None if successful, otherwise an error message.
+        """
+        try:
+            with open(path, 'w') as metrics_file:
+                metrics_file.write(self.to_prometheus())
+            return None
+        except OSError as e:
+            return f"Error writing stats: {str(e)}"
+
+
+def instrumented(name: str):
+    """
+    Decorate a Library method so that its calls are recorded in `self.stats`.
+    :param name: The operation name the calls are recorded under.
+    """
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, *args, **kwargs):
+            stats = self.stats
+            if not stats.enabled:
+                return method(self, *args, **kwargs)
+            start = perf_counter_ns()
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                stats.record_call(name, perf_counter_ns() - start)
+        return wrapper
+    return decorator
@@ -0,0 +1,67 @@
+import sys
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+
+class SymbolTable:
+    """
+    Maps values such as author names or user ids to dense integer keys.
+
+    Every distinct value is stored once and records keep the integer key instead, so
+    repeated values share memory and are compared as small integers. Strings are also
+    passed through sys.intern so equal values handed back at the API boundary are the
+    same object.
+    """
+
+    def __init__(self):
+        self.keys: Dict[Any, int] = {}
+        self.values: List[Any] = []
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def intern(self, value: Any) -> int:
+        """
+        Get the key of a value, adding the value to the table if needed.
+        :param value: The value to intern.
+        :return: The integer key of the value.
+        """
+        key = self.keys.get(value)
+        if key is None:
+            if isinstance(value, str):
+                value = sys.intern(value)
+            key = self.keys[value] = len(self.values)
+            self.values.append(value)
+        return key
+
+    def intern_all(self, values: Iterable[Any]) -> Tuple[int, ...]:
+        """
+        Intern every value of a collection.
+        :param values: The values to intern.
+        :return: A tuple of the keys of the values, in order.
+        """
+        return tuple(self.intern(value) for value in values)
+
+    def key_of(self, value: Any) -> Optional[int]:
+        """
+        Look up the key of a value without adding it.
+        :param value: The value to look up.
+        :return: The integer key of the value, or None if the value was never interned.
+        """
+        return self.keys.get(value)
+
+    def value_of(self, key: int) -> Any:
+        """
+        Get the value of a key.
+        :param key: The integer key.
+        :return: The interned value.
+        """
+        return self.values[key]
+
+    def values_of(self, keys: Iterable[int]) -> List[Any]:
+        """
+        Get the values of a collection of keys.
+        :param keys: The integer keys.
+        :return: A list of the interned values, in order.
+        """
+        values = self.values
+        return [values[key] for key in keys]
@@ -0,0 +1,204 @@
+import pickle
+import sqlite3
+import sys
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Set
+
+# Kept on every book: searches by author or publisher and the copy registries only need these
+RESIDENT_ATTRIBUTES = ('book_id', 'author_keys', 'publisher_keys')
+
+
+def deep_size(value: Any, seen: Optional[Set[int]] = None) -> int:
+    """
+    Estimate the memory held by a value, following the items of containers and the attributes of
+    objects. Every object is counted once, however many times it is referenced.
+    :param value: The value.
+    :param seen: The ids of the objects already counted.
+    :return: The estimated size in bytes.
+    """
+    if seen is None:
+        seen = set()
+    if id(value) in seen:
+        return 0
+    seen.add(id(value))
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(deep_size(key, seen) + deep_size(item, seen) for key, item in value.items())
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        size += sum(deep_size(item, seen) for item in value)
+    elif hasattr(value, '__dict__') and not isinstance(value, type):
+        size += deep_size(vars(value), seen)
+    return size
+
+
+def payload_size(payload: Dict[str, Any]) -> int:
+    """
+    Estimate the memory held by the evictable attributes of a book, including what they reference.
+    :param payload: The attributes, by name.
+    :return: The estimated size in bytes.
+    """
+    seen: Set[int] = set()
+    return sum(deep_size(value, seen) for value in payload.values())
+
+
+class TieredStore:
+    """
+    An on-disk cold tier for the title and extra attributes of rarely used books.
+
+    Resident books are kept in least recently used order, together with the deep size estimate
+    of their evictable attributes. When the total goes over the attribute budget, the least
+    recently used books are written to a sqlite table and their evictable attributes are dropped.
+    Book.__getattr__ faults a cold book back in on the first access to a missing attribute.
+
+    Only those attributes are covered by the budget. The Book objects, their ids and author and
+    publisher keys, the book copies and every index stay in memory, so the memory of the process
+    never drops below what the rest of the library holds, whatever the budget.
+
+    A book keeps its row once written, so evicting it again replaces the row instead of growing
+    the table. The rows only live as long as the store, and are dropped when it is opened or
+    closed.
+    """
+
+    def __init__(self, path: str, attribute_budget: int):
+        self.path = path
+        self.attribute_budget = attribute_budget
+        # The cold tier only lives as long as the process, so nothing is journaled or synced
+        self.connection = sqlite3.connect(path, isolation_level=None)
+        self.connection.execute("PRAGMA journal_mode = OFF")
+        self.connection.execute("PRAGMA synchronous = OFF")
+        self.connection.execute("CREATE TABLE IF NOT EXISTS cold_books (row_id INTEGER PRIMARY KEY, payload BLOB)")
+        self.connection.execute("DELETE FROM cold_books")
+        self.resident: OrderedDict = OrderedDict()
+        self.resident_bytes = 0
+        self.cold: Dict[Any, Any] = {}
+        self.row_ids: Dict[Any, int] = {}
+
+        self.evictions = 0
+        self.faults = 0
+        self.evicted_bytes = 0
+
+    def statistics(self) -> Dict[str, Any]:
+        """
+        Get the state and the eviction statistics of the tier.
+        :return: A dictionary of counters and sizes.
+        """
+        return {'resident_books': len(self.resident), 'cold_books': len(self.cold),
+                'resident_bytes': self.resident_bytes, 'attribute_budget': self.attribute_budget,
+                'evictions': self.evictions, 'faults': self.faults, 'evicted_bytes': self.evicted_bytes}
+
+    def admit(self, book: Any) -> None:
+        """
+        Start tracking a resident book as the most recently used one, evicting others if needed.
+        :param book: The Book instance.
+        """
+        if book.book_id in self.resident or book.book_id in self.cold:
+            return
+        size = payload_size(self._payload(book))
+        self.resident[book.book_id] = (book, size)
+        self.resident_bytes += size
+        self._enforce_budget()
+
+    def admit_all(self, books: Iterable[Any]) -> None:
+        """
+        Start tracking books, the first ones being the least recently used.
+        :param books: The Book instances.
+        """
+        for book in books:
+            self.admit(book)
+
+    def touch(self, book: Any) -> None:
+        """
+        Mark a book as the most recently used one. Cold books are only loaded when one of their
+        evicted attributes is read.
+        :param book: The Book instance.
+        """
+        if book.book_id in self.resident:
+            self.resident.move_to_end(book.book_id)
+
+    def is_cold(self, book_id: Any) -> bool:
+        """
+        Check whether the evictable attributes of a book are on disk.
+        :param book_id: The ID of the book.
+        """
+        return book_id in self.cold
+
+    def fault_in(self, book: Any) -> None:
+        """
+        Load the evicted attributes of a cold book back onto it, as the most recently used book.
+        :param book: The Book instance.
+        """
+        payload = self.read_payload(book.book_id)
+        if payload is None:
+            return
+        del self.cold[book.book_id]
+        vars(book).update(payload)
+        self.faults += 1
+        size = payload_size(payload)
+        self.resident[book.book_id] = (book, size)
+        self.resident_bytes += size
+        self._enforce_budget()
+
+    def peek(self, book: Any, name: str, default: Any = None) -> Any:
+        """
+        Read an attribute of a book without faulting it in, e.g. to match it in a full scan.
+        :param book: The Book instance.
+        :param name: The name of the attribute.
+        :param default: The value returned if the book has no such attribute.
+        :return: The value of the attribute.
+        """
+        if book.book_id in self.cold and name not in vars(book) and not hasattr(type(book), name):
+            return self.read_payload(book.book_id).get(name, default)
+        return getattr(book, name, default)
+
+    def read_payload(self, book_id: Any) -> Optional[Dict[str, Any]]:
+        """
+        Read the evicted attributes of a cold book without loading them onto the book.
+        :param book_id: The ID of the book.
+        :return: The attributes by name, or None if the book is not cold.
+        """
+        if book_id not in self.cold:
+            return None
+        row = self.connection.execute("SELECT payload FROM cold_books WHERE row_id = ?",
+                                      (self.row_ids[book_id],)).fetchone()
+        return pickle.loads(row[0])
+
+    def evict(self, book_id: Any) -> None:
+        """
+        Write the evictable attributes of a resident book to disk and drop them from the book.
+        :param book_id: The ID of the book.
+        """
+        book, size = self.resident.pop(book_id)
+        self.resident_bytes -= size
+        attributes = vars(book)
+        payload = self._payload(book)
+        blob = pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL)
+        row_id = self.row_ids.get(book_id)
+        if row_id is None:
+            row_id = self.row_ids[book_id] = len(self.row_ids) + 1
+        self.connection.execute("INSERT OR REPLACE INTO cold_books (row_id, payload) VALUES (?, ?)", (row_id, blob))
+        for name in payload:
+            del attributes[name]
+        self.cold[book_id] = book
+        self.evictions += 1
+        self.evicted_bytes += size
+
+    def close(self) -> None:
+        """
+        Load every cold book back into memory and close the store.
+        """
+        for book in list(self.cold.values()):
+            vars(book).update(self.read_payload(book.book_id))
+            del self.cold[book.book_id]
+        self.resident.clear()
+        self.resident_bytes = 0
+        self.connection.execute("DELETE FROM cold_books")
+        self.connection.close()
+
+    def _enforce_budget(self) -> None:
+        # The most recently used book stays resident even if it alone is over the budget
+        while self.resident_bytes > self.attribute_budget and len(self.resident) > 1:
+            self.evict(next(iter(self.resident)))
+
+    @staticmethod
+    def _payload(book: Any) -> Dict[str, Any]:
+        return {name: value for name, value in vars(book).items() if name not in RESIDENT_ATTRIBUTES}
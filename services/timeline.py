@@ -0,0 +1,84 @@
+from array import array
+from bisect import bisect_right
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# (book id, rack number, borrowed by, due date)
+CopyState = Tuple[Any, Optional[int], Optional[str], Optional[str]]
+
+
+class CopyTimeline:
+    """
+    The history of every book copy as intervals of unchanged state.
+
+    Every copy keeps the days its state changed, in a typed array, and the state that started
+    on each of those days. The library clock only moves forward, so both lists grow at the end
+    and the state of a copy on a day is found by bisecting its days. Several changes on the same
+    day collapse into the state at the end of that day, and a change dated before the last
+    change of its copy is rejected.
+
+    States are CopyState tuples, or None while the copy is neither on a rack nor on loan.
+    """
+
+    def __init__(self):
+        self.days: Dict[Any, array] = {}
+        self.states: Dict[Any, List[Optional[CopyState]]] = {}
+        self.copies_by_book: Dict[Any, Dict[Any, None]] = {}
+
+    def __len__(self) -> int:
+        return sum(len(days) for days in self.days.values())
+
+    def record(self, copy_id: Any, state: Optional[CopyState], day: int) -> None:
+        """
+        Record the state of a book copy from a day on.
+        :param copy_id: The ID of the book copy.
+        :param state: The new CopyState of the copy, or None if it left the library.
+        :param day: The day of the change, in days since the epoch, not before the last change
+                    of the copy.
+        :raises ValueError: If the day is before the last change of the copy.
+        """
+        days = self.days.get(copy_id)
+        if days is not None and day < days[-1]:
+            raise ValueError(f"Change of book copy {copy_id} on day {day} is older than its last change")
+        if state is not None:
+            self.copies_by_book.setdefault(state[0], {})[copy_id] = None
+
+        if days is None:
+            if state is not None:
+                self.days[copy_id] = array('l', (day,))
+                self.states[copy_id] = [state]
+            return
+
+        # Same day as the last change, or later
+        states = self.states[copy_id]
+        if states[-1] == state:
+            return
+        if day > days[-1]:
+            days.append(day)
+            states.append(state)
+        elif len(states) > 1 and states[-2] == state:
+            # The last change was undone on the same day
+            days.pop()
+            states.pop()
+        else:
+            states[-1] = state
+
+    def state_at(self, copy_id: Any, day: int) -> Optional[CopyState]:
+        """
+        Get the state of a book copy at the end of a day.
+        :param copy_id: The ID of the book copy.
+        :param day: The day, in days since the epoch.
+        :return: The CopyState of the copy, or None if it was not in the library on that day.
+        """
+        days = self.days.get(copy_id)
+        if days is None:
+            return None
+        index = bisect_right(days, day) - 1
+        return self.states[copy_id][index] if index >= 0 else None
+
+    def copies_of_book(self, book_id: Any) -> Iterable[Any]:
+        """
+        Get the IDs of every copy a book ever had, in the order they first appeared.
+        :param book_id: The ID of the book.
+        :return: An iterable of copy IDs.
+        """
+        return self.copies_by_book.get(book_id, ())
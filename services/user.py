@@ -1,23 +1,50 @@
 from typing import List, Optional
 
 from .bookcopies import BookCopy
+from .policy import BorrowingPolicy, PolicyTable
 
 
 class User:
     users = []
+    users_by_id = {}
     MAX_BOOK_ALLOWED = 5
 
-    def __init__(self, user_id: str, name: str = None, max_books_allowed: Optional[int] = None):
+    def __init__(self, user_id: str, name: str = None, max_books_allowed: Optional[int] = None,
+                 tier: str = PolicyTable.DEFAULT_TIER):
         """
             Initialize a new User instance.
             :param user_id: The unique identifier for the user.
             :param name: Optional name of the user.
-            :param max_books_allowed: Maximum number of books the user can borrow (default is 5).
+            :param max_books_allowed: Maximum number of books the user can borrow, overriding the tier policy.
+            :param tier: The borrowing policy tier of the user (default is 'general').
             """
         self.user_id = user_id
         self.name = name
         self.__max_books_allowed = max_books_allowed
+        self.tier_group = PolicyTable.get_group(tier)
         self.borrowed_books = []
+        self.borrowed_count = 0
+
+    @property
+    def tier(self) -> str:
+        """
+        Get the borrowing policy tier of the user.
+        """
+        return PolicyTable.get_tier(self.tier_group)
+
+    @tier.setter
+    def tier(self, tier: str) -> None:
+        """
+        Move the user to another borrowing policy tier.
+        """
+        self.tier_group = PolicyTable.get_group(tier)
+
+    @property
+    def policy(self) -> BorrowingPolicy:
+        """
+        Get the borrowing policy that currently applies to the user.
+        """
+        return PolicyTable.get_group_policy(self.tier_group)
 
     @property
     def max_books_allowed(self) -> int:
@@ -25,13 +52,13 @@ class User:
         Get the maximum number of books allowed for the user.
 
         If a specific maximum number is set for the user, return that value.
-        Otherwise, return the general maximum number of books allowed.
+        Otherwise, return the maximum number of books allowed by the tier policy of the user.
 
         :return: The maximum number of books allowed for the user.
         """
         if self.__max_books_allowed is not None:
             return self.__max_books_allowed
-        return self.MAX_BOOK_ALLOWED
+        return self.policy.max_books_allowed
 
     @max_books_allowed.setter
     def max_books_allowed(self, max_books_allowed: int) -> None:
@@ -55,6 +82,7 @@ class User:
         """
         if max_books_allowed >= 0:
             cls.MAX_BOOK_ALLOWED = max_books_allowed
+            PolicyTable.get_policy(PolicyTable.DEFAULT_TIER).max_books_allowed = max_books_allowed
             return max_books_allowed
         return None
 
@@ -65,31 +93,29 @@ class User:
             :param user_id: The unique identifier for the user.
             :return: The retrieved User instance if found, None otherwise.
             """
-        for user in cls.users:
-            if user.user_id == user_id:
-                return user
-        return None
+        return cls.users_by_id.get(user_id)
 
     @classmethod
-    def create_user(cls, user_id: str, name: str = None, max_books_allowed: int = 5) -> 'User':
+    def create_user(cls, user_id: str, name: str = None, max_books_allowed: Optional[int] = None) -> 'User':
         """
             Create a new user.
             :param user_id: The unique identifier for the user.
             :param name: Optional name of the user.
-            :param max_books_allowed: Maximum number of books the user can borrow (default is 5).
+            :param max_books_allowed: Maximum number of books the user can borrow (default is the tier policy).
             :return: The created User instance.
             """
         user = cls(user_id, name, max_books_allowed)
         cls.users.append(user)
+        cls.users_by_id[user_id] = user
         return user
 
     @classmethod
-    def get_or_create(cls, user_id: str, name: str = None, max_books_allowed: int = 5) -> 'User':
+    def get_or_create(cls, user_id: str, name: str = None, max_books_allowed: Optional[int] = None) -> 'User':
         """
             Retrieve an existing user or create a new user if not found.
             :param user_id: The unique identifier for the user.
             :param name: Optional name of the user.
-            :param max_books_allowed: Maximum number of books the user can borrow (default is 5).
+            :param max_books_allowed: Maximum number of books the user can borrow (default is the tier policy).
             :return: The retrieved or created User instance.
             """
         existing_user = cls.get_user(user_id)
@@ -109,6 +135,7 @@ class User:
             book_copy.borrowed_by = self.user_id
             book_copy.due_date = due_date
             self.borrowed_books.append(book_copy)
+            self.borrowed_count += 1
             return True
         else:
             return False
@@ -130,6 +157,7 @@ class User:
             book_copy.borrowed_by = None
             book_copy.due_date = None
             self.borrowed_books.remove(book_copy)
+            self.borrowed_count -= 1
             return True
         else:
             return False
@@ -139,4 +167,7 @@ class User:
             Check if the user can borrow another book.
             :return: True if the user can borrow another book, False otherwise.
             """
-        return len(self.borrowed_books) < self.max_books_allowed
+        return self.borrowed_count < self.max_books_allowed
+
+
+PolicyTable.set_policy(PolicyTable.DEFAULT_TIER, User.MAX_BOOK_ALLOWED, PolicyTable.DEFAULT_LOAN_DAYS)
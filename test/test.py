@@ -1,11 +1,39 @@
+import contextlib
+import gc
+import io
+import json
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
 import unittest
+import main
+from benchmarks.differential import ENGINES, generate_commands, run_differential
+from profiler import CommandProfiler
 from services.library import Library
+from services.book import Book
 from services.bookcopies import BookCopy
+from services.catalogue_io import export_books, export_copies, import_catalogue
+from services.hold import HoldQueues
+from services.user import User
+from services.loan_history import LoanHistory, BORROW, RETURN
+from services.rack_index import RackIndex
+from services.recommendations import CoBorrowIndex
+from services.shared_catalog import SharedCatalogReader, SharedCatalogWriter
+from services.snapshot import PersistentMap
+from services.state import capture_state, load_state, reset_registries, restore_state, save_state
+from services.stats import LatencyHistogram
+from services.symbols import SymbolTable
+from services.timeline import CopyTimeline
+from views import view
+from views.render import render_borrowed_book_copies, render_search_results
 
 
 class TestLibrary(unittest.TestCase):
 
     def setUp(self):
+        reset_registries()
         self.library = Library()
         self.library.create_library(10)
 
@@ -65,14 +93,14 @@ class TestLibrary(unittest.TestCase):
         )
         self.assertEqual(len(rack_numbers), 1)
         self.assertIsNone(error_msg)
-        self.assertEqual(self.library.racks[rack_numbers[0]][0].book.book_id, 2)
+        self.assertEqual(self.library.racks[rack_numbers[0]][108].book.book_id, 2)
 
     def test_remove_book_copy_valid_id(self):
         # Ensure the book copy to be removed exists in rack 1
         self.assertEqual(len(self.library.racks[1]), 1)
 
         # Ensure the id of the book in rack one is 101
-        self.assertEqual(self.library.racks[1][0].copy_id, 101)
+        self.assertEqual(list(self.library.racks[1]), [101])
 
         # Remove one of the book copies from rack 1
         removed_result, error_msg = self.library.remove_book_copy(101)
@@ -97,6 +125,56 @@ class TestLibrary(unittest.TestCase):
         self.assertIsNone(removed_result)
         self.assertEqual(error_msg, "Invalid Book Copy ID")
 
+    def test_add_book_skips_copies_in_use(self):
+        self.library.add_book(book_id='duplicate-1', title="Duplicate Book", authors=["Author U"],
+                              publishers=["Publisher U"], book_copy_ids=['du1', 'du2'])
+        self.library.borrow_book_copy_by_id(copy_id='du2', user_id='duplicate-user', due_date='2024-05-10')
+        rack_numbers, error = self.library.add_book(book_id='duplicate-1', title="Duplicate Book",
+                                                    authors=["Author U"], publishers=["Publisher U"],
+                                                    book_copy_ids=['du1', 'du2', 'du3'])
+        self.assertIsNone(error)
+        self.assertEqual(rack_numbers[:2], [None, None])
+        self.assertEqual(sum(copy.copy_id == 'du1' for copies in self.library.racks.values()
+                             for copy in copies.values()), 1)
+        self.assertFalse(self.library.is_book_copy_shelved(BookCopy.get_book_copy('du2')))
+
+    def test_add_book_reports_copies_in_use(self):
+        self.library.add_book(book_id='duplicate-2', title="Duplicate Book", authors=["Author U"],
+                              publishers=["Publisher U"], book_copy_ids=['du4'])
+        self.library.borrow_book_copy_by_id(copy_id='du4', user_id='duplicate-user', due_date='2024-05-10')
+        # The loan is read from the copy, not from the loan history
+        self.library.loan_history = LoanHistory()
+        view.set_library(self.library)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            view.add_book_to_library('duplicate-2', "Duplicate Book", ["Author U"], ["Publisher U"], ['du4', 'du5'])
+        self.assertEqual(output.getvalue(), "Book copy du4 already in library\nAdded Book to racks: 6\n")
+
+    def test_remove_book_copies(self):
+        self.library.add_book(book_id='weed-1', title="Weeded Book", authors=["Author W"], publishers=["Publisher W"],
+                              book_copy_ids=['w1', 'w2', 'w3'])
+        self.library.borrow_book_copy_by_id(copy_id='w2', user_id='weed-user', due_date='2024-05-10')
+
+        results = self.library.remove_book_copies(['w1', 'w2', 'w3', 'w1'])
+        self.assertEqual([error for _, error in results], [None, "Invalid Book Copy ID", None, "Invalid Book Copy ID"])
+        self.assertEqual([result[0].copy_id for result, _ in results if result], ['w1', 'w3'])
+        self.assertIsNone(BookCopy.get_book_copy('w1'))
+        self.assertEqual([copy.copy_id for copy in self.library.search('book_id', 'weed-1')], ['w2'])
+        self.assertNotIn('w3', [copy.copy_id for copy in BookCopy.get_all_book_copies()])
+        self.assertNotIn(None, BookCopy.get_all_book_copies())
+
+    def test_remove_book_copy_compacts_registry(self):
+        copy_ids = [f'compact-{number}' for number in range(BookCopy.COMPACT_MIN_TOMBSTONES * 2)]
+        self.library.create_library(len(copy_ids))
+        self.library.add_book(book_id='compact', title="Compacted Book", authors=["Author C"],
+                              publishers=["Publisher C"], book_copy_ids=copy_ids)
+        self.library.remove_book_copies(copy_ids[1::2])
+
+        remaining = [copy.copy_id for copy in BookCopy.get_all_book_copies() if copy.book.book_id == 'compact']
+        self.assertEqual(remaining, copy_ids[::2])
+        self.assertEqual(BookCopy.tombstones, 0)
+        self.assertIs(BookCopy.bookcopies[BookCopy.positions[copy_ids[2]]], BookCopy.get_book_copy(copy_ids[2]))
+
     def test_borrow_book_success(self):
         # Ensure the book copy is initially in rack 1
         self.assertEqual(len(self.library.racks[1]), 1)
@@ -222,6 +300,10 @@ class TestLibrary(unittest.TestCase):
         self.assertEqual(len(borrowed_books), 0)
 
     def test_search_books_found(self):
+        # Two more copies of Book 1, which this test used to inherit from test_add_book
+        self.library.add_book(book_id=1, title="Test Book 1", authors=["Author 1"], publishers=["Publisher 1"],
+                              book_copy_ids=[106, 107])
+
         # Search for books with author 'Author 1'
         found_books = self.library.search(attribute='author_id', attribute_value='Author 1')
 
@@ -237,5 +319,1103 @@ class TestLibrary(unittest.TestCase):
         self.assertEqual(len(found_books), 0)
 
 
+class TestLibraryStats(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.create_library(5)
+        self.library.add_book(book_id='stats-1', title="Stats Book", authors=["Author S"],
+                              publishers=["Publisher S"], book_copy_ids=['s1', 's2'])
+
+    def test_stats_disabled_by_default(self):
+        self.library.search(attribute='book_id', attribute_value='stats-1')
+
+        # Nothing is recorded until stats are enabled
+        self.assertEqual(self.library.stats.operations, {})
+
+    def test_stats_record_calls_and_items_scanned(self):
+        self.library.stats.enable()
+        self.library.borrow_book(book_id='stats-1', user_id='stats-user', due_date='2024-05-10')
+        self.library.search(attribute='book_id', attribute_value='stats-1')
+
+        operations = self.library.stats.operations
+        self.assertEqual(operations['borrow_book'].calls, 1)
+        self.assertEqual(operations['search'].calls, 1)
+        self.assertEqual(operations['get_book_copy_by_field'].calls, 1)
+        self.assertGreater(operations['get_book_copy_by_field'].items_scanned, 0)
+        self.assertEqual(operations['borrow_book'].latency.count, 1)
+
+    def test_stats_record_rack_index_nodes_visited(self):
+        self.library.stats.enable()
+        self.library.find_first_available_rack()
+
+        operation = self.library.stats.operations['find_first_available_rack']
+        self.assertEqual(operation.calls, 1)
+        self.assertEqual(operation.items_scanned, self.library.rack_index.nodes_visited)
+        self.assertGreater(operation.items_scanned, 0)
+
+    def test_stats_prometheus_dump(self):
+        self.library.stats.enable()
+        self.library.search(attribute='book_id', attribute_value='stats-1')
+        metrics = self.library.stats.to_prometheus()
+
+        self.assertIn('library_operation_calls_total{operation="search"} 1', metrics)
+        self.assertIn('library_operation_latency_seconds_bucket{operation="search",le="+Inf"} 1', metrics)
+
+    def test_histogram_buckets_bound_values(self):
+        for value in [0, 7, 15, 16, 17, 1000, 123456789]:
+            index = LatencyHistogram.bucket_index(value)
+            self.assertLess(value, LatencyHistogram.bucket_upper_bound(index))
+            if index > 0:
+                self.assertGreaterEqual(value, LatencyHistogram.bucket_upper_bound(index - 1))
+
+
+class TestRackIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.index = RackIndex(10)
+        for rack_no, count in [(1, 3), (2, 1), (4, 2), (7, 3), (10, 1)]:
+            for _ in range(count):
+                self.index.increment(rack_no)
+
+    def test_range_counts(self):
+        self.assertEqual(self.index.count_occupied(1, 10), 10)
+        self.assertEqual(self.index.count_occupied(2, 4), 3)
+        self.assertEqual(self.index.count_free(2, 4, 3), 6)
+
+    def test_find_first_with_free(self):
+        self.assertEqual(self.index.find_first_with_free(3), 2)
+        self.assertEqual(self.index.find_first_with_free(3, min_free=3), 3)
+        self.assertEqual(self.index.find_first_with_free(3, start_rack=7), 8)
+        self.assertEqual(self.index.find_first_with_free(1, min_free=1, start_rack=10), 0)
+
+    def test_find_racks_with_free(self):
+        racks = self.index.find_racks_with_free(3, 2, 1, 10)
+        self.assertEqual(racks, [(2, 2), (3, 3), (5, 3), (6, 3), (8, 3), (9, 3), (10, 2)])
+
+    def test_decrement_frees_rack(self):
+        self.index.decrement(1)
+        self.assertEqual(self.index.find_first_with_free(3), 1)
+        self.assertEqual(self.index.get_occupancy(1), 2)
+
+
+class TestRackCapacity(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.create_library(6, max_books_per_rack=2)
+        self.library.add_book(book_id='capacity-1', title="Capacity Book", authors=["Author C"],
+                              publishers=["Publisher C"], book_copy_ids=['c1', 'c2', 'c3'])
+
+    def test_rack_occupancy(self):
+        racks, error = self.library.get_rack_occupancy(1, 3)
+        self.assertIsNone(error)
+        self.assertEqual(racks, [(1, 2, 0), (2, 1, 1), (3, 0, 2)])
+
+    def test_borrow_updates_occupancy(self):
+        self.library.borrow_book_copy_by_id(copy_id='c1', user_id='capacity-user', due_date='2024-05-10')
+        free_slots, error = self.library.count_free_slots(1, 6)
+        self.assertIsNone(error)
+        self.assertEqual(free_slots, 10)
+        self.assertEqual(self.library.find_first_available_rack(), 1)
+
+    def test_racks_with_free_slots(self):
+        racks, error = self.library.find_racks_with_free_slots(2, 1, 4)
+        self.assertIsNone(error)
+        self.assertEqual(racks, [(3, 2), (4, 2)])
+
+    def test_aisle_occupancy(self):
+        aisles, error = self.library.get_aisle_occupancy(4)
+        self.assertIsNone(error)
+        self.assertEqual(aisles, [(1, 1, 4, 3, 8), (2, 5, 6, 0, 4)])
+
+    def test_invalid_rack_range(self):
+        racks, error = self.library.get_rack_occupancy(4, 9)
+        self.assertEqual(racks, [])
+        self.assertEqual(error, "Invalid rack range")
+
+
+class TestRebalance(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.create_library(4, max_books_per_rack=3)
+        self.library.add_book(book_id='rebalance-1', title="Rebalance Book 1", authors=["Author R"],
+                              publishers=["Publisher R"], book_copy_ids=['r1', 'r2', 'r3'])
+        self.library.add_book(book_id='rebalance-2', title="Rebalance Book 2", authors=["Author R"],
+                              publishers=["Publisher R"], book_copy_ids=['r4', 'r5'])
+
+    def racks_of_book(self, book_id):
+        return sorted(rack_no for rack_no, copies in self.library.racks.items()
+                      for book_copy in copies.values() if book_copy.book.book_id == book_id)
+
+    def test_rebalance_evens_out_occupancy(self):
+        result, error = self.library.rebalance()
+        self.assertIsNone(error)
+
+        moves, remaining = result
+        self.assertEqual(remaining, 0)
+        self.assertEqual([len(copies) for copies in self.library.racks.values()], [2, 1, 1, 1])
+        self.assertEqual(list(self.library.rack_index.occupancy), [2, 1, 1, 1])
+        self.assertEqual(self.racks_of_book('rebalance-1'), [1, 1, 2])
+        self.assertEqual(self.racks_of_book('rebalance-2'), [3, 4])
+        for copy_id, from_rack, to_rack in moves:
+            self.assertEqual(BookCopy.get_book_copy(copy_id).rack_no, to_rack)
+
+    def test_rebalance_runs_in_batches(self):
+        result, error = self.library.rebalance(max_moves=1)
+        self.assertIsNone(error)
+        moves, remaining = result
+        self.assertEqual(len(moves), 1)
+        self.assertGreater(remaining, 0)
+
+        # Copies borrowed between batches are skipped
+        self.library.borrow_book_copy_by_id(copy_id='r5', user_id='rebalance-user', due_date='2024-05-10')
+        while remaining:
+            (moves, remaining), error = self.library.rebalance(max_moves=1)
+            self.assertNotIn('r5', [move[0] for move in moves])
+        self.assertIsNone(self.library.rebalance_job)
+
+    def test_rebalance_swaps_copies_in_full_library(self):
+        library = Library()
+        library.create_library(3)
+        library.add_book(book_id='rebalance-3', title="Rebalance Book 3", authors=["Author R"],
+                         publishers=["Publisher R"], book_copy_ids=['r6'])
+        library.add_book(book_id='rebalance-4', title="Rebalance Book 4", authors=["Author R"],
+                         publishers=["Publisher R"], book_copy_ids=['r7'])
+        library.add_book(book_id='rebalance-3', title="Rebalance Book 3", authors=["Author R"],
+                         publishers=["Publisher R"], book_copy_ids=['r8'])
+
+        (moves, remaining), error = library.rebalance()
+        self.assertIsNone(error)
+        self.assertEqual(sorted(moves), [('r7', 2, 3), ('r8', 3, 2)])
+        self.assertEqual([next(iter(copies)) for copies in library.racks.values()], ['r6', 'r8', 'r7'])
+
+
+class TestResizeLibrary(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.create_library(4, max_books_per_rack=2)
+        self.library.add_book(book_id='resize-1', title="Resize Book", authors=["Author Z"],
+                              publishers=["Publisher Z"], book_copy_ids=['z1', 'z2', 'z3', 'z4', 'z5'])
+
+    def test_grow_keeps_shelved_copies(self):
+        result, error = self.library.resize_library(6)
+        self.assertIsNone(error)
+        self.assertEqual(result, (6, []))
+        self.assertEqual([len(copies) for copies in self.library.racks.values()], [2, 2, 1, 0, 0, 0])
+        racks, _ = self.library.find_racks_with_free_slots(2)
+        self.assertEqual([rack_no for rack_no, free in racks], [4, 5, 6])
+
+    def test_shrink_relocates_copies(self):
+        result, error = self.library.resize_library(3, max_books_per_rack=3)
+        self.assertIsNone(error)
+        no_of_racks, moves = result
+        self.assertEqual(no_of_racks, 3)
+        self.assertEqual(moves, [])
+
+        result, error = self.library.resize_library(2)
+        self.assertIsNone(error)
+        self.assertEqual(result, (2, [('z5', 3, 1)]))
+        self.assertEqual(BookCopy.get_book_copy('z5').rack_no, 1)
+        self.assertEqual(list(self.library.rack_index.occupancy), [3, 2])
+
+    def test_lower_capacity_relocates_overflow(self):
+        self.library.resize_library(5, max_books_per_rack=1)
+        self.assertEqual([len(copies) for copies in self.library.racks.values()], [1, 1, 1, 1, 1])
+
+    def test_shrink_without_space_fails(self):
+        result, error = self.library.resize_library(2)
+        self.assertIsNone(result)
+        self.assertEqual(error, "Not enough rack space for the shelved book copies")
+        self.assertEqual(len(self.library.racks), 4)
+
+
+class TestHolds(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.today = lambda: '2024-05-01'
+        self.library.create_library(5)
+        self.library.add_book(book_id='hold-1', title="Hold Book", authors=["Author H"],
+                              publishers=["Publisher H"], book_copy_ids=['h1'])
+        self.library.borrow_book(book_id='hold-1', user_id='hold-user1', due_date='2024-05-10')
+
+    def test_place_hold_on_available_book_fails(self):
+        self.library.return_book_copy('h1')
+        position, error = self.library.place_hold('hold-1', 'hold-user2', '2024-06-01')
+        self.assertIsNone(position)
+        self.assertEqual(error, "Book available")
+
+    def test_return_hands_copy_to_first_holder(self):
+        self.assertEqual(self.library.place_hold('hold-1', 'hold-user2', '2024-06-01'), (1, None))
+        self.assertEqual(self.library.place_hold('hold-1', 'hold-user3', '2024-06-01'), (2, None))
+
+        result, error = self.library.return_book_copy('h1')
+        self.assertIsNone(error)
+        self.assertEqual(result, "Returned book copy h1 and handed to user: hold-user2")
+
+        book_copy = BookCopy.get_book_copy('h1')
+        self.assertEqual(book_copy.borrowed_by, 'hold-user2')
+        self.assertEqual(book_copy.due_date, '2024-06-01')
+        self.assertEqual(self.library.count_free_slots(1, 5), (5, None))
+
+    def test_return_skips_holders_over_limit(self):
+        self.library.modify_user_max_borrowed_books_allowed(0, 'hold-user4')
+        self.library.place_hold('hold-1', 'hold-user4', '2024-06-01')
+        self.library.place_hold('hold-1', 'hold-user5', '2024-06-01')
+
+        result, error = self.library.return_book_copy('h1')
+        self.assertEqual(result, "Returned book copy h1 and handed to user: hold-user5")
+        self.assertIsNotNone(self.library.holds.get_hold('hold-1', 'hold-user4'))
+
+    def test_expired_holds_are_skipped(self):
+        self.library.place_hold('hold-1', 'hold-user6', '2024-06-01', expires_on='2024-04-30')
+
+        result, error = self.library.return_book_copy('h1')
+        self.assertEqual(result, "Returned book copy h1 and added to rack: 1")
+        self.assertIsNone(self.library.holds.get_hold('hold-1', 'hold-user6'))
+
+    def test_place_hold_rejects_invalid_dates(self):
+        self.assertEqual(self.library.place_hold('hold-1', 'hold-user8', '2024-13-01'), (None, "Invalid date"))
+        self.assertEqual(self.library.place_hold('hold-1', 'hold-user8', '2024-06-01', expires_on='soon'),
+                         (None, "Invalid date"))
+        self.assertIsNone(self.library.holds.get_hold('hold-1', 'hold-user8'))
+        self.assertEqual(self.library.expire_holds('2024-5-1'), ([], "Invalid date"))
+
+    def test_holds_expire_by_date_not_by_string(self):
+        # '2024-05-1' sorts after '2024-05-01' as a string, but is not an ISO date
+        self.library.place_hold('hold-1', 'hold-user8', '2024-06-01', expires_on='2024-04-30')
+        self.library.place_hold('hold-1', 'hold-user9', '2024-06-01', expires_on='2024-05-02')
+        expired, error = self.library.expire_holds('2024-05-01')
+        self.assertIsNone(error)
+        self.assertEqual([hold.user_id for hold in expired], ['hold-user8'])
+
+    def test_added_copies_are_handed_to_holders(self):
+        self.library.place_hold('hold-1', 'hold-user2', '2024-06-01')
+        rack_numbers, error = self.library.add_book(book_id='hold-1', title="Hold Book", authors=["Author H"],
+                                                    publishers=["Publisher H"], book_copy_ids=['h2', 'h3'])
+        self.assertIsNone(error)
+        self.assertEqual(rack_numbers, [1, 2])
+        self.assertEqual(BookCopy.get_book_copy('h2').borrowed_by, 'hold-user2')
+        self.assertEqual(self.library.holds.count_active('hold-1'), 0)
+        # The copy handed over left its rack, the other one stays shelved
+        self.assertEqual(self.library.count_free_slots(1, 5), (4, None))
+        self.assertEqual(self.library.get_book_copy_by_field('copy_id', 'h3')[1], 2)
+
+    def test_batch_added_copies_are_handed_to_holders(self):
+        self.library.place_hold('hold-1', 'hold-user2', '2024-06-01')
+        results = self.library.add_books([
+            {'book_id': 'hold-1', 'title': "Hold Book", 'authors': ["Author H"], 'publishers': ["Publisher H"],
+             'book_copy_ids': ['h2']},
+            {'book_id': 'hold-3', 'title': "Other Book", 'authors': ["Author H"], 'publishers': ["Publisher H"],
+             'book_copy_ids': ['h4']}])
+        self.assertEqual(results, [([1], None), ([1], None)])
+        self.assertEqual(BookCopy.get_book_copy('h2').borrowed_by, 'hold-user2')
+
+    def test_cancel_hold(self):
+        self.library.place_hold('hold-1', 'hold-user7', '2024-06-01')
+        hold, error = self.library.cancel_hold('hold-1', 'hold-user7')
+        self.assertIsNone(error)
+        self.assertEqual(hold.user_id, 'hold-user7')
+        self.assertEqual(self.library.cancel_hold('hold-1', 'hold-user7'), (None, "Hold not found"))
+
+    def test_cancelled_holds_are_compacted(self):
+        holds = HoldQueues()
+        for user_no in range(10):
+            holds.place_hold('hold-2', f"user{user_no}", '2024-06-01')
+        for user_no in range(1, 9):
+            holds.cancel_hold('hold-2', f"user{user_no}")
+
+        # Active holds are counted without walking the queue, and the cancelled ones are dropped
+        self.assertEqual(holds.count_active('hold-2'), 2)
+        self.assertEqual([hold.user_id for hold in holds.queues['hold-2'] if hold.active], ['user0', 'user9'])
+        self.assertLessEqual(len(holds.queues['hold-2']), 2 * holds.count_active('hold-2'))
+
+        self.assertEqual(holds.pop_next_eligible('hold-2', lambda user_id: user_id != 'user0').user_id, 'user9')
+        self.assertEqual(holds.count_active('hold-2'), 1)
+        self.assertEqual(holds.pop_next_eligible('hold-2', lambda user_id: True).user_id, 'user0')
+        self.assertEqual(holds.count_active('hold-2'), 0)
+        self.assertNotIn('hold-2', holds.queues)
+        self.assertIsNone(holds.pop_next_eligible('hold-2', lambda user_id: True))
+
+
+class TestLoanHistory(unittest.TestCase):
+
+    def setUp(self):
+        self.history = LoanHistory()
+        self.history.CHUNK_SIZE = 2
+        self.history.record_borrow('copy-1', 'book-1', 'user-1', 100)
+        self.history.record_borrow('copy-2', 'book-2', 'user-2', 100)
+        self.history.record_return('copy-1', 'book-1', 'user-1', 104)
+        self.history.record_borrow('copy-1', 'book-1', 'user-2', 105)
+        self.history.record_return('copy-2', 'book-2', 'user-2', 110)
+
+    def test_events_are_chunked(self):
+        self.assertEqual(len(self.history), 5)
+        self.assertEqual(len(self.history.chunks), 3)
+        self.assertEqual(list(self.history.iter_events())[2], (RETURN, 'copy-1', 'book-1', 'user-1', 104))
+
+    def test_aggregates(self):
+        self.assertEqual(self.history.most_borrowed(1), [('book-1', 2)])
+        self.assertEqual(self.history.loans_per_day(), {100: 2, 105: 1})
+        self.assertEqual(self.history.loans_per_day(start_day=101), {105: 1})
+        self.assertEqual(self.history.average_loan_length(), 7)
+        self.assertEqual(self.history.loans_per_author(lambda book_id: ['A', book_id]),
+                         {'A': 3, 'book-1': 2, 'book-2': 1})
+
+    def test_save_and_load(self):
+        with tempfile.TemporaryDirectory() as directory:
+            self.history.save(directory)
+            self.history.record_borrow('copy-3', 'book-1', 'user-3', 111)
+            self.history.save(directory)
+            loaded = LoanHistory.load(directory)
+
+        self.assertEqual(list(loaded.iter_events()), list(self.history.iter_events()))
+        self.assertEqual(loaded.most_borrowed(), self.history.most_borrowed())
+        self.assertEqual(loaded.average_loan_length(), 7)
+
+    def test_save_to_another_directory(self):
+        with tempfile.TemporaryDirectory() as first, tempfile.TemporaryDirectory() as second:
+            self.history.save(first)
+            self.history.record_borrow('copy-3', 'book-1', 'user-3', 111)
+            self.history.save(second)
+            loaded = LoanHistory.load(second)
+
+        # The full chunks written to the first directory are written to the second one too
+        self.assertEqual(list(loaded.iter_events()), list(self.history.iter_events()))
+
+    def test_library_records_loans(self):
+        library = Library()
+        library.today = lambda: '2024-05-01'
+        library.create_library(3)
+        library.add_book(book_id='history-1', title="History Book", authors=["Author L"],
+                         publishers=["Publisher L"], book_copy_ids=['l1'])
+        library.borrow_book(book_id='history-1', user_id='history-user', due_date='2024-05-10')
+        library.today = lambda: '2024-05-04'
+        library.return_book_copy('l1')
+
+        kinds = [event[0] for event in library.loan_history.iter_events()]
+        self.assertEqual(kinds, [BORROW, RETURN])
+        statistics = library.get_loan_statistics()
+        self.assertEqual(statistics['average_loan_length'], 3)
+        self.assertEqual(statistics['most_borrowed_authors'], [('Author L', 1)])
+
+
+class TestBorrowingPolicy(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.today = lambda: '2024-05-01'
+        self.library.create_library(10)
+        self.library.add_book(book_id='policy-1', title="Policy Book", authors=["Author P"],
+                              publishers=["Publisher P"], book_copy_ids=['p1', 'p2', 'p3', 'p4'])
+        self.library.set_borrowing_policy('policy-student', 1, 7)
+        self.library.set_borrowing_policy('policy-staff', 3, 30)
+
+    def test_tier_limits_and_loan_period(self):
+        self.library.set_user_tier('policy-user1', 'policy-student')
+
+        rack_no, error = self.library.borrow_book(book_id='policy-1', user_id='policy-user1')
+        self.assertIsNone(error)
+        self.assertEqual(User.get_user('policy-user1').borrowed_books[0].due_date, '2024-05-08')
+        self.assertEqual(self.library.borrow_book(book_id='policy-1', user_id='policy-user1'), (None, "Overlimit"))
+
+    def test_policy_changes_apply_to_existing_users(self):
+        self.library.set_user_tier('policy-user2', 'policy-student')
+        self.library.set_borrowing_policy('policy-student', 2, 7)
+
+        for _ in range(2):
+            rack_no, error = self.library.borrow_book(book_id='policy-1', user_id='policy-user2')
+            self.assertIsNone(error)
+        self.assertEqual(User.get_user('policy-user2').borrowed_count, 2)
+
+    def test_retier_moves_users_without_touching_them(self):
+        self.library.set_user_tier('policy-user3', 'policy-student')
+        group = User.get_user('policy-user3').tier_group
+
+        self.assertEqual(self.library.retier_users('policy-student', 'policy-staff'), (1, None))
+        user = User.get_user('policy-user3')
+        self.assertEqual(user.tier_group, group)
+        self.assertEqual(user.tier, 'policy-staff')
+        self.assertEqual(user.max_books_allowed, 3)
+
+        # Users assigned to the old tier afterwards get its policy again
+        self.library.set_user_tier('policy-user4', 'policy-student')
+        self.assertEqual(User.get_user('policy-user4').max_books_allowed, 1)
+
+    def test_invalid_tier(self):
+        self.assertEqual(self.library.set_user_tier('policy-user5', 'policy-unknown'), (None, "Invalid tier"))
+        self.assertEqual(self.library.retier_users('policy-student', 'policy-unknown'), (None, "Invalid tier"))
+
+
+class TestCatalogueImportExport(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.create_library(4)
+        self.directory = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def write(self, name, content):
+        path = os.path.join(self.directory.name, name)
+        with open(path, 'w') as catalogue_file:
+            catalogue_file.write(content)
+        return path
+
+    def test_import_csv(self):
+        path = self.write('catalogue.csv', "book_id,title,authors,publishers,copy_ids,color\n"
+                                           "io-1,IO Book 1,Author I;Author J,Publisher I,io1;io2,red\n"
+                                           "io-2,,Author I,Publisher I,io3,\n"
+                                           "io-3,IO Book 3,Author I,Publisher I,io2;io4;io5;io6,\n")
+        progress = []
+        report, error = import_catalogue(self.library, path, chunk_size=1, progress=progress.append)
+
+        self.assertIsNone(error)
+        self.assertEqual(report.rows, 3)
+        self.assertEqual(report.books, 2)
+        self.assertEqual(report.copies_added, 4)
+        self.assertEqual(report.copies_not_shelved, 1)
+        self.assertEqual(report.errors, [(3, "Missing title"), (4, "Duplicate book copy ID: io2")])
+        self.assertEqual(len(progress), 2)
+        self.assertEqual(self.library.search('color', 'red')[0].book.author_id, ['Author I', 'Author J'])
+
+    def test_import_jsonl(self):
+        path = self.write('catalogue.jsonl', '{"book_id": "io-4", "title": "IO Book 4", "authors": ["Author K"], '
+                                             '"publishers": ["Publisher K"], "copy_ids": ["io7"]}\n'
+                                             'not json\n')
+        report, error = import_catalogue(self.library, path)
+
+        self.assertIsNone(error)
+        self.assertEqual(report.copies_added, 1)
+        self.assertEqual(report.errors[0][0], 2)
+        self.assertEqual(self.library.search('book_id', 'io-4')[0].copy_id, 'io7')
+
+    def test_unsupported_format(self):
+        self.assertEqual(import_catalogue(self.library, 'catalogue.xml'), (None, "Unsupported catalogue format"))
+
+    def test_export(self):
+        self.library.add_book(book_id='io-5', title="IO Book 5", authors=["Author M"], publishers=["Publisher M"],
+                              book_copy_ids=['io8', 'io9'], color='blue')
+        self.library.borrow_book_copy_by_id(copy_id='io9', user_id='io-user', due_date='2024-05-10')
+
+        books_path = os.path.join(self.directory.name, 'books.jsonl')
+        count, error = export_books(books_path)
+        self.assertIsNone(error)
+        with open(books_path) as books_file:
+            books = [json.loads(line) for line in books_file]
+        self.assertEqual(len(books), count)
+        self.assertIn({'book_id': 'io-5', 'title': 'IO Book 5', 'authors': ['Author M'],
+                       'publishers': ['Publisher M'], 'copy_ids': ['io8', 'io9'], 'color': 'blue'}, books)
+
+        copies_path = os.path.join(self.directory.name, 'copies.csv')
+        count, error = export_copies(self.library, copies_path)
+        self.assertIsNone(error)
+        with open(copies_path) as copies_file:
+            copies = {line.split(',')[0]: line.strip() for line in copies_file}
+        self.assertEqual(copies['io8'], 'io8,io-5,1,,')
+        self.assertEqual(copies['io9'], 'io9,io-5,,io-user,2024-05-10')
+
+
+class TestSymbols(unittest.TestCase):
+
+    def test_symbol_table(self):
+        symbols = SymbolTable()
+        first = ''.join(['Author', ' ', 'Q'])
+        second = ''.join(['Author', ' ', 'Q'])
+        self.assertEqual(symbols.intern(first), symbols.intern(second))
+        self.assertIs(symbols.value_of(symbols.key_of(second)), first)
+        self.assertIsNone(symbols.key_of('Author R'))
+        self.assertEqual(symbols.values_of(symbols.intern_all(['b', 'a', 'b'])), ['b', 'a', 'b'])
+
+    def test_books_share_interned_authors(self):
+        library = Library()
+        library.create_library(4)
+        library.add_book(book_id='symbols-1', title="Symbols Book 1", authors=[''.join(['Author ', 'S1'])],
+                         publishers=["Publisher S"], book_copy_ids=['sy1'])
+        library.add_book(book_id='symbols-2', title="Symbols Book 2", authors=[''.join(['Author ', 'S1']), 'Author S2'],
+                         publishers=["Publisher S"], book_copy_ids=['sy2'], color='green')
+
+        first, second = BookCopy.get_book_copy('sy1').book, BookCopy.get_book_copy('sy2').book
+        self.assertIs(first.author_id[0], second.author_id[0])
+        self.assertEqual(second.author_id, ['Author S1', 'Author S2'])
+        self.assertEqual(second.get_extra_attributes(), {'color': 'green'})
+        self.assertEqual([copy.copy_id for copy in library.search('author_id', 'Author S1')], ['sy1', 'sy2'])
+        self.assertEqual(library.search('author_id', 'Author S3'), [])
+
+    def test_borrowed_by_is_interned(self):
+        library = Library()
+        library.create_library(2)
+        library.add_book(book_id='symbols-3', title="Symbols Book 3", authors=["Author S"],
+                         publishers=["Publisher S"], book_copy_ids=['sy3'])
+        library.borrow_book_copy_by_id(copy_id='sy3', user_id='symbols-user', due_date='2024-05-10')
+
+        book_copy = BookCopy.get_book_copy('sy3')
+        self.assertEqual(book_copy.borrowed_by, 'symbols-user')
+        self.assertEqual(book_copy.borrowed_by_key, BookCopy.user_symbols.key_of('symbols-user'))
+        library.return_book_copy('sy3')
+        self.assertIsNone(book_copy.borrowed_by)
+
+
+class TestSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.create_library(4, max_books_per_rack=2)
+        self.library.add_book(book_id='snapshot-1', title="Snapshot Book 1", authors=["Author N"],
+                              publishers=["Publisher N"], book_copy_ids=['sn1', 'sn2', 'sn3'])
+
+    def test_persistent_map(self):
+        first = PersistentMap()
+        maps = [first]
+        for number in range(2000):
+            maps.append(maps[-1].set(number, number * 2))
+        second = maps[-1].set(7, 'seven').delete(8)
+        self.assertEqual(len(maps[-1]), 2000)
+        self.assertEqual(maps[-1].get(7), 14)
+        self.assertEqual(len(second), 1999)
+        self.assertEqual(second.get(7), 'seven')
+        self.assertNotIn(8, second)
+        self.assertIn(8, maps[-1])
+        self.assertEqual(maps[10].get(10), None)
+        self.assertEqual(sorted(second.items())[:3], [(0, 0), (1, 2), (2, 4)])
+        self.assertIs(second.delete('missing'), second)
+
+    def test_removed_copies_leave_book_copies_in_order(self):
+        before = self.library.snapshot()
+        self.library.remove_book_copy('sn2')
+        self.library.add_book(book_id='snapshot-1', title="Snapshot Book 1", authors=["Author N"],
+                              publishers=["Publisher N"], book_copy_ids=['sn4'])
+        after = self.library.snapshot()
+        self.assertEqual(before.get_copy_ids('snapshot-1'), ('sn1', 'sn2', 'sn3'))
+        self.assertEqual(after.get_copy_ids('snapshot-1'), ('sn1', 'sn3', 'sn4'))
+        self.assertEqual([record.copy_id for record in after.get_rack(1)], ['sn1', 'sn4'])
+        self.assertEqual([record.copy_id for record in after.search('book_id', 'snapshot-1')], ['sn1', 'sn4', 'sn3'])
+
+    def test_persistent_map_changes(self):
+        first = PersistentMap()
+        for number in range(2000):
+            first = first.set(number, number * 2)
+        second = first.set(7, 'seven').delete(8).set(5000, 'new').set(9, 18)
+        self.assertEqual(sorted(first.changes(second), key=str), [(5000, 'new'), (7, 'seven'), (8, None)])
+        self.assertEqual(list(second.changes(second)), [])
+        self.assertEqual(sorted(PersistentMap().changes(second.delete(5000)))[:2], [(0, 0), (1, 2)])
+
+    def test_snapshot_is_not_affected_by_later_changes(self):
+        before = self.library.snapshot()
+        self.library.borrow_book_copy_by_id(copy_id='sn1', user_id='snapshot-user', due_date='2024-05-10')
+        self.library.remove_book_copy('sn2')
+        after = self.library.snapshot()
+
+        self.assertGreater(after.version, before.version)
+        self.assertEqual([record.copy_id for record in before.search('book_id', 'snapshot-1')], ['sn1', 'sn2', 'sn3'])
+        self.assertEqual([record.copy_id for record in before.get_rack(1)], ['sn1', 'sn2'])
+        self.assertEqual(before.get_user_borrowed_book_copy('snapshot-user'), [])
+        self.assertIsNone(before.get_book_copy('sn1').borrowed_by)
+
+        borrowed = after.get_user_borrowed_book_copy('snapshot-user')
+        self.assertEqual([(record.copy_id, record.borrowed_by, record.due_date) for record in borrowed],
+                         [('sn1', 'snapshot-user', '2024-05-10')])
+        self.assertIsNone(after.get_book_copy('sn2'))
+        self.assertEqual(after.get_rack(1), [])
+
+    def test_snapshot_search_matches_library(self):
+        self.library.add_book(book_id='snapshot-2', title="Snapshot Book 2", authors=["Author N", "Author M"],
+                              publishers=["Publisher N"], book_copy_ids=['sn4', 'sn5'])
+        self.library.borrow_book_copy_by_id(copy_id='sn2', user_id='snapshot-user', due_date='2024-05-10')
+        self.library.return_book_copy('sn2')
+        snapshot = self.library.snapshot()
+        for attribute, value in (('author_id', 'Author N'), ('publisher_id', 'Publisher N'),
+                                 ('title', 'Snapshot Book 2'), ('author_id', 'Author Unknown')):
+            self.assertEqual([(record.copy_id, record.rack_no) for record in snapshot.search(attribute, value)],
+                             [(copy.copy_id, copy.rack_no) for copy in self.library.search(attribute, value)])
+
+    def test_failed_operation_does_not_commit(self):
+        version = self.library.snapshot().version
+        self.library.borrow_book_copy_by_id(copy_id='missing', user_id='snapshot-user')
+        self.assertEqual(self.library.snapshot().version, version)
+
+
+class TestWarmState(unittest.TestCase):
+
+    def test_save_and_load_state(self):
+        library = Library()
+        library.create_library(4)
+        library.add_book(book_id='warm-1', title="Warm Book", authors=["Author Warm"], publishers=["Publisher Warm"],
+                         book_copy_ids=['wm1', 'wm2'])
+        library.borrow_book_copy_by_id(copy_id='wm1', user_id='warm-user', due_date='2024-05-10')
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'library.state')
+            self.assertIsNone(save_state(library, path))
+            reset_registries()
+            self.assertIsNone(BookCopy.get_book_copy('wm2'))
+            self.assertEqual(library.search('author_id', 'Author Warm'), [])
+
+            restored, error = load_state(path)
+
+        self.assertIsNone(error)
+        self.assertEqual([copy.copy_id for copy in restored.search('author_id', 'Author Warm')], ['wm1', 'wm2'])
+        self.assertEqual([copy.copy_id for copy in restored.get_user_borrowed_book_copy('warm-user')], ['wm1'])
+        self.assertIs(restored.racks[2]['wm2'], BookCopy.get_book_copy('wm2'))
+        self.assertEqual(restored.borrow_book('warm-1', 'warm-user', '2024-05-10'), (2, None))
+        self.assertEqual(restored.find_first_available_rack(), 1)
+
+    def test_load_state_errors(self):
+        freeze_count = gc.get_freeze_count()
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'library.state')
+            self.assertIsNotNone(load_state(path)[1])
+            with open(path, 'wb') as state_file:
+                state_file.write(b'not a state')
+            self.assertIsNotNone(load_state(path)[1])
+            # A file that failed to load leaves the heap collectable
+            self.assertEqual(gc.get_freeze_count(), freeze_count)
+
+    def test_load_state_refuses_files_others_can_write(self):
+        library = Library()
+        library.create_library(1)
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'library.state')
+            self.assertIsNone(save_state(library, path))
+            os.chmod(path, 0o664)
+            restored, error = load_state(path)
+        self.assertIsNone(restored)
+        self.assertEqual(error, f"Refusing to load library state {path}: writable by other users")
+
+    def test_load_state_under_another_hash_seed(self):
+        save = ("import sys\n"
+                "from services.library import Library\n"
+                "from services.state import save_state\n"
+                "library = Library()\n"
+                "library.create_library(30)\n"
+                "library.add_books([{'book_id': f'seed-{n}', 'title': f'Seed {n}', 'authors': [f'Author {n % 3}'],\n"
+                "                    'publishers': ['Publisher'], 'book_copy_ids': [f'c{n}']} for n in range(20)])\n"
+                "library.borrow_book_copy_by_id('c5', 'u1', '2024-05-10')\n"
+                "print(save_state(library, sys.argv[1]))\n")
+        load = ("import sys\n"
+                "from services.state import load_state\n"
+                "library, error = load_state(sys.argv[1])\n"
+                "library.borrow_book_copy_by_id('c6', 'u1', '2024-05-10')\n"
+                "snapshot = library.snapshot()\n"
+                "print(snapshot.get_book_copy('c5').borrowed_by, len(snapshot.copies),\n"
+                "      [record.copy_id for record in snapshot.get_user_borrowed_book_copy('u1')],\n"
+                "      [record.copy_id for record in snapshot.search('author_id', 'Author 1')])\n")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'library.state')
+            outputs = []
+            for seed, script in (('1', save), ('2', load)):
+                result = subprocess.run([sys.executable, '-c', script, path], cwd=root, capture_output=True, text=True,
+                                        env={**os.environ, 'PYTHONHASHSEED': seed}, check=True)
+                outputs.append(result.stdout.strip())
+
+        self.assertEqual(outputs[0], 'None')
+        self.assertEqual(outputs[1], "u1 20 ['c5', 'c6'] ['c1', 'c4', 'c7', 'c10', 'c13', 'c16', 'c19']")
+
+
+class TestDifferential(unittest.TestCase):
+
+    def test_engines_match_reference(self):
+        with tempfile.TemporaryDirectory() as directory:
+            commands = generate_commands(seed=11, count=1500, directory=directory)
+            timings, mismatches = run_differential(commands, ENGINES)
+        self.assertEqual(set(timings), set(ENGINES))
+        self.assertEqual(mismatches, [])
+
+    def test_registries_are_restored(self):
+        library = Library()
+        library.create_library(2)
+        library.add_book(book_id='differential-1', title="Differential Book", authors=["Author D"],
+                         publishers=["Publisher D"], book_copy_ids=['df1'])
+        with tempfile.TemporaryDirectory() as directory:
+            run_differential(generate_commands(seed=3, count=50, directory=directory), ENGINES)
+        self.assertIsNotNone(BookCopy.get_book_copy('df1'))
+        self.assertEqual([copy.copy_id for copy in library.search('author_id', 'Author D')], ['df1'])
+
+
+class TestRecommendations(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.create_library(20)
+        # Users are global, so every test gets its own to start with no books on loan
+        self.user_ids = [f'{self._testMethodName}-{user_no}' for user_no in range(3)]
+        for book_no in range(1, 5):
+            self.library.add_book(book_id=f'recommend-{book_no}', title=f"Recommended Book {book_no}",
+                                  authors=["Author R"], publishers=["Publisher R"],
+                                  book_copy_ids=[f'rc{book_no}-1', f'rc{book_no}-2', f'rc{book_no}-3'])
+        for user_id, book_numbers in zip(self.user_ids, ((1, 2, 3), (1, 2), (1, 4))):
+            for book_no in book_numbers:
+                self.library.borrow_book(f'recommend-{book_no}', user_id, '2024-05-10')
+
+    def test_recommend(self):
+        recommended, error = self.library.recommend('recommend-1')
+        self.assertIsNone(error)
+        self.assertEqual([(book.book_id, count) for book, count in recommended],
+                         [('recommend-2', 2), ('recommend-3', 1), ('recommend-4', 1)])
+        self.assertEqual([book.book_id for book, _ in self.library.recommend('recommend-1', 1)[0]], ['recommend-2'])
+        self.assertEqual(self.library.recommend('recommend-4')[0][0][0].book_id, 'recommend-1')
+        self.assertEqual(self.library.recommend('missing'), ([], "Invalid Book ID"))
+
+    def test_repeat_borrows_count_once(self):
+        self.library.return_book_copy('rc2-1')
+        self.library.borrow_book_copy_by_id('rc2-1', self.user_ids[0], '2024-05-10')
+        self.assertEqual(self.library.recommendations.recommend('recommend-1', 1), [('recommend-2', 2)])
+
+    def test_rebuild_matches_incremental(self):
+        incremental = self.library.recommendations
+        self.library.rebuild_recommendations()
+        for book_no in range(1, 5):
+            self.assertEqual(self.library.recommendations.recommend(f'recommend-{book_no}', 3),
+                             incremental.recommend(f'recommend-{book_no}', 3))
+
+    def test_pure_python_and_sparse_counts_match(self):
+        index = CoBorrowIndex.rebuild([('a', 1), ('a', 2), ('b', 1), ('b', 2), ('b', 3), ('a', 1)])
+        self.assertEqual(index._count_pairs(), {1: {2: 2, 3: 1}, 2: {1: 2, 3: 1}, 3: {1: 1, 2: 1}})
+        try:
+            sparse_counts = index._count_pairs_sparse()
+        except ImportError:
+            self.skipTest("scipy is not installed")
+        self.assertEqual(sparse_counts, index._count_pairs())
+
+
+class TestRender(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.create_library(4)
+        self.library.add_book(book_id='render-1', title="Rendered", authors=["Author X", "Author Y"],
+                              publishers=["Publisher X"], book_copy_ids=['rd1', 'rd2'])
+        # Users are global, so every test gets its own to start with no books on loan
+        self.user_id = f'{self._testMethodName}-user'
+        self.library.borrow_book_copy_by_id(copy_id='rd1', user_id=self.user_id, due_date='2024-05-10')
+        self.book_copies = self.library.search('book_id', 'render-1')
+
+    def test_text_output(self):
+        self.assertEqual(render_search_results(self.book_copies),
+                         f"Book Copy: rd1 render-1 Rendered Author X, Author Y Publisher X -1 {self.user_id} 2024-05-10\n"
+                         "Book Copy: rd2 render-1 Rendered Author X, Author Y Publisher X 2  \n")
+        self.assertEqual(render_borrowed_book_copies(self.library.get_user_borrowed_book_copy(self.user_id)),
+                         "Book Copy: rd1 2024-05-10\n")
+        self.assertEqual(render_search_results([]), '')
+
+    def test_machine_readable_output(self):
+        self.assertEqual(render_search_results(self.book_copies, 'tsv').splitlines(), [
+            "copy_id\tbook_id\ttitle\tauthors\tpublishers\track_no\tborrowed_by\tdue_date",
+            f"rd1\trender-1\tRendered\tAuthor X;Author Y\tPublisher X\t\t{self.user_id}\t2024-05-10",
+            "rd2\trender-1\tRendered\tAuthor X;Author Y\tPublisher X\t2\t\t",
+        ])
+        rows = [json.loads(line) for line in render_search_results(self.book_copies, 'jsonl').splitlines()]
+        self.assertEqual(rows[0], {'copy_id': 'rd1', 'book_id': 'render-1', 'title': "Rendered",
+                                   'authors': ["Author X", "Author Y"], 'publishers': ["Publisher X"],
+                                   'rack_no': None, 'borrowed_by': self.user_id, 'due_date': '2024-05-10'})
+        self.assertEqual(rows[1]['rack_no'], 2)
+        borrowed = render_borrowed_book_copies(self.library.get_user_borrowed_book_copy(self.user_id), 'jsonl')
+        self.assertEqual(json.loads(borrowed)['title'], "Rendered")
+
+    def test_snapshot_records_render_like_copies(self):
+        records = self.library.snapshot().search('book_id', 'render-1')
+        self.assertEqual(render_search_results(records), render_search_results(self.book_copies))
+
+
+class TestTimeTravel(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.today = lambda: '2024-03-01'
+        self.library.create_library(4)
+        self.library.add_book(book_id='travel-1', title="Travelled", authors=["Author Travel"],
+                              publishers=["Publisher Travel"], book_copy_ids=['tt1', 'tt2'])
+        self.user_id = f'{self._testMethodName}-user'
+
+    def test_get_book_copy_as_of(self):
+        self.library.today = lambda: '2024-03-05'
+        self.library.borrow_book_copy_by_id(copy_id='tt1', user_id=self.user_id, due_date='2024-03-20')
+        self.library.today = lambda: '2024-03-10'
+        self.library.return_book_copy('tt1')
+
+        record, _ = self.library.get_book_copy('tt1', as_of='2024-03-04')
+        self.assertEqual((record.rack_no, record.borrowed_by), (1, None))
+        record, _ = self.library.get_book_copy('tt1', as_of='2024-03-07')
+        self.assertEqual((record.borrowed_by, record.due_date, record.book.book_id),
+                         (self.user_id, '2024-03-20', 'travel-1'))
+        record, _ = self.library.get_book_copy('tt1', as_of='2024-03-10')
+        self.assertEqual((record.borrowed_by, record.rack_no), (None, 1))
+        self.assertEqual(self.library.get_book_copy('tt1', as_of='2024-02-28'),
+                         (None, "Book copy tt1 not in library on 2024-02-28"))
+        self.assertEqual(self.library.get_book_copy('tt1', as_of='yesterday'), (None, "Invalid date"))
+        self.assertIs(self.library.get_book_copy('tt1')[0], BookCopy.get_book_copy('tt1'))
+
+    def test_search_as_of(self):
+        self.library.today = lambda: '2024-03-05'
+        self.library.remove_book_copy('tt2')
+
+        before = self.library.search('book_id', 'travel-1', as_of='2024-03-01')
+        self.assertEqual([(record.copy_id, record.rack_no) for record in before], [('tt1', 1), ('tt2', 2)])
+        self.assertEqual([record.copy_id for record in self.library.search('book_id', 'travel-1', as_of='2024-03-05')],
+                         ['tt1'])
+        self.assertEqual(render_search_results(self.library.search('author_id', "Author Travel", as_of='2024-03-05')),
+                         render_search_results(self.library.search('author_id', "Author Travel")))
+        self.assertEqual(self.library.get_book_copy('tt2'), (None, "Invalid Book Copy ID"))
+
+    def test_same_day_changes_keep_end_of_day_state(self):
+        self.library.borrow_book_copy_by_id(copy_id='tt1', user_id=self.user_id, due_date='2024-03-20')
+        self.library.return_book_copy('tt1')
+        self.library.today = lambda: '2024-03-02'
+        self.library.borrow_book_copy_by_id(copy_id='tt2', user_id=self.user_id, due_date='2024-03-20')
+
+        self.assertEqual(len(self.library.timeline.days['tt1']), 1)
+        self.assertEqual(self.library.get_book_copy('tt1', as_of='2024-03-01')[0].rack_no, 1)
+        self.assertEqual(len(self.library.timeline.days['tt2']), 2)
+
+    def test_timeline_rejects_older_changes(self):
+        timeline = CopyTimeline()
+        timeline.record('tl1', ('travel-2', 1, None, None), 10)
+        timeline.record('tl1', ('travel-2', None, 'user', '2024-03-20'), 12)
+        with self.assertRaises(ValueError):
+            timeline.record('tl1', ('travel-2', 1, None, None), 11)
+
+        # Undoing a change on its own day drops it, later days stay in order
+        timeline.record('tl1', ('travel-2', 1, None, None), 12)
+        self.assertEqual(list(timeline.days['tl1']), [10])
+        timeline.record('tl1', None, 14)
+        self.assertEqual(list(timeline.days['tl1']), [10, 14])
+        self.assertEqual(timeline.state_at('tl1', 13), ('travel-2', 1, None, None))
+        self.assertIsNone(timeline.state_at('tl1', 14))
+
+
+class TestColdTier(unittest.TestCase):
+
+    def setUp(self):
+        reset_registries()
+        self.library = Library()
+        self.library.create_library(10)
+        for number in range(4):
+            self.library.add_book(book_id=f'cold-{number}', title=f"Cold {number}", authors=["Author Cold"],
+                                  publishers=["Publisher Cold"], book_copy_ids=[f'cc{number}'],
+                                  shelf_note='x' * 1000, season=f'season-{number}')
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'cold.sqlite')
+
+    def tearDown(self):
+        self.library.disable_cold_tier()
+        self.directory.cleanup()
+
+    def test_least_recently_used_books_are_evicted_and_faulted_in(self):
+        statistics, error = self.library.enable_cold_tier(self.path, attribute_budget=2500)
+        self.assertIsNone(error)
+        self.assertLessEqual(statistics['resident_bytes'], 2500)
+        Book.get_book('cold-2')
+        book = Book.get_book('cold-1')
+        self.assertTrue(Book.cold_store.is_cold('cold-1'))
+        self.assertFalse(Book.cold_store.is_cold('cold-3'))
+        self.assertNotIn('title', vars(book))
+
+        self.assertEqual(book.title, "Cold 1")
+        self.assertEqual(book.get_extra_attributes(), {'shelf_note': 'x' * 1000, 'season': 'season-1'})
+        statistics, _ = self.library.get_cold_tier_statistics()
+        self.assertEqual(statistics['faults'], 1)
+        # cold-2 was used more recently than cold-3, so cold-3 made room for cold-1
+        self.assertTrue(Book.cold_store.is_cold('cold-3'))
+        self.assertFalse(Book.cold_store.is_cold('cold-2'))
+        self.assertRaises(AttributeError, getattr, book, 'missing')
+
+    def test_budget_counts_what_attributes_reference(self):
+        tags = ['tag-%d' % number * 50 for number in range(20)]
+        self.library.add_book(book_id='cold-tags', title="Cold Tags", authors=["Author Cold"],
+                              publishers=["Publisher Cold"], book_copy_ids=['cc-tags'], tags=tags)
+        statistics, _ = self.library.enable_cold_tier(self.path, attribute_budget=1 << 20)
+        self.assertGreater(Book.cold_store.resident['cold-tags'][1], sum(sys.getsizeof(tag) for tag in tags))
+        self.assertEqual(statistics['attribute_budget'], 1 << 20)
+
+    def test_search_matches_cold_books_without_faulting_them_in(self):
+        self.library.enable_cold_tier(self.path, attribute_budget=0)
+        self.assertEqual([book_copy.copy_id for book_copy in self.library.search('season', 'season-2')], ['cc2'])
+        self.assertEqual(len(self.library.search('author_id', "Author Cold")), 4)
+        self.assertEqual(self.library.get_cold_tier_statistics()[0]['faults'], 0)
+        self.assertIn("Cold 2", render_search_results(self.library.search('season', 'season-2')))
+
+    def test_disable_and_pickle_keep_evicted_attributes(self):
+        self.library.enable_cold_tier(self.path, attribute_budget=0)
+        book = Book.get_book('cold-0')
+        self.assertEqual(pickle.loads(pickle.dumps(book)).__dict__['season'], 'season-0')
+        self.library.disable_cold_tier()
+        self.assertEqual(vars(book)['title'], "Cold 0")
+        self.assertEqual(self.library.get_cold_tier_statistics(), (None, "Cold tier not enabled"))
+
+
+class TestWorkers(unittest.TestCase):
+
+    def run_stream(self, commands, workers):
+        reset_registries()
+        library = Library()
+        library.today = lambda: '2024-05-01'
+        view.set_library(library)
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            main.run_commands(lines=commands, workers=workers)
+        return output.getvalue()
+
+    def test_reader_processes_match_sequential_output(self):
+        saved = capture_state(view.get_library())
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                commands = generate_commands(seed=5, count=600, directory=directory)
+                sequential = self.run_stream(commands, workers=0)
+                self.assertEqual(self.run_stream(commands, workers=2), sequential)
+        finally:
+            view.set_library(restore_state(saved))
+
+    def test_reader_processes_on_a_warm_loaded_library(self):
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        commands = "search author_id Author1\nprint_borrowed warm-user\nborrow_book_copy wc3 warm-user 2024-06-01\n" \
+                   "print_borrowed warm-user\nsearch book_id warm-2 tsv\n"
+        with tempfile.TemporaryDirectory() as directory:
+            setup_path = os.path.join(directory, 'setup.txt')
+            with open(setup_path, 'w') as setup_file:
+                setup_file.write("create_library 10\n")
+                for book_no in range(4):
+                    setup_file.write(f"add_book warm-{book_no} Warm{book_no} Author{book_no % 2} Publisher wc{book_no}\n")
+                setup_file.write("borrow_book_copy wc1 warm-user 2024-05-10\n")
+            outputs = []
+            # The first run builds the cache, the next ones load it under other hash seeds
+            for seed, workers in (('1', []), ('2', []), ('3', ['--workers', '2'])):
+                result = subprocess.run([sys.executable, 'main.py', '--init', setup_path, '--cache-dir', directory,
+                                         *workers], cwd=root, input=commands, capture_output=True, text=True,
+                                        env={**os.environ, 'PYTHONHASHSEED': seed}, check=True)
+                outputs.append(result.stdout)
+
+        self.assertEqual(outputs[1], outputs[0])
+        self.assertEqual(outputs[2], outputs[0])
+        self.assertIn('wc3', outputs[2])
+        self.assertEqual(outputs[0].count('wc1'), 3)
+
+    def test_readers_see_the_latest_generation(self):
+        library = Library()
+        library.create_library(2)
+        library.add_book(book_id='shared-1', title="Shared", authors=["Author Shared"], publishers=["Publisher"],
+                         book_copy_ids=['sh1'])
+        writer = SharedCatalogWriter()
+        try:
+            reader = SharedCatalogReader(writer.prefix)
+            self.assertEqual(writer.publish(library.snapshot()), 1)
+            self.assertEqual(writer.publish(library.snapshot()), 1)
+            self.assertEqual([record.rack_no for record in reader.catalog().search('author_id', "Author Shared")], [1])
+
+            writer.acquire(1)
+            library.borrow_book_copy_by_id(copy_id='sh1', user_id='shared-user', due_date='2024-05-10')
+            self.assertEqual(writer.publish(library.snapshot()), 2)
+            self.assertEqual(reader.current_generation(), 2)
+            self.assertEqual([record.copy_id for record in reader.catalog().get_user_borrowed_book_copy('shared-user')],
+                             ['sh1'])
+            self.assertEqual(reader.catalog(1).get_user_borrowed_book_copy('shared-user'), [])
+            writer.release(1)
+            self.assertEqual(list(writer.segments), [2])
+            reader.close()
+        finally:
+            writer.close()
+
+    def test_generations_carry_changes_since_checkpoint(self):
+        library = Library()
+        library.create_library(200)
+        library.add_books([{'book_id': f"delta-{book_no}", 'title': f"Delta {book_no}", 'authors': ["Author Delta"],
+                            'publishers': ["Publisher"], 'book_copy_ids': [f"dl{book_no}"]} for book_no in range(100)])
+        writer = SharedCatalogWriter()
+        try:
+            reader = SharedCatalogReader(writer.prefix)
+            writer.publish(library.snapshot())
+            library.borrow_book_copy_by_id(copy_id='dl1', user_id='delta-user', due_date='2024-05-10')
+            writer.publish(library.snapshot())
+            library.remove_book_copy('dl2')
+            writer.publish(library.snapshot())
+
+            # One checkpoint, the later generations only hold what changed since
+            self.assertEqual(writer.checkpoint, 1)
+            catalog = reader.catalog()
+            self.assertEqual([record.copy_id for record in catalog.get_user_borrowed_book_copy('delta-user')], ['dl1'])
+            records = catalog.search('author_id', "Author Delta")
+            self.assertEqual(len(records), 99)
+            self.assertNotIn('dl2', [record.copy_id for record in records])
+
+            for book_no in range(3, 100):
+                library.borrow_book_copy_by_id(copy_id=f"dl{book_no}", user_id=f"delta-user{book_no}",
+                                               due_date='2024-05-10')
+            writer.publish(library.snapshot())
+            self.assertEqual(writer.checkpoint, 2)
+            self.assertEqual(list(writer.checkpoint_segments), [2])
+            self.assertEqual([record.copy_id for record in reader.catalog().get_user_borrowed_book_copy('delta-user99')],
+                             ['dl99'])
+            reader.close()
+        finally:
+            writer.close()
+
+    def test_publishing_leaves_cold_books_on_disk(self):
+        reset_registries()
+        library = Library()
+        library.create_library(10)
+        writer = SharedCatalogWriter()
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                library.enable_cold_tier(os.path.join(directory, 'cold.sqlite'), 0)
+                library.add_books([{'book_id': f"shared-cold-{book_no}", 'title': f"Cold {book_no}",
+                                    'authors': ["Author Cold"], 'publishers': ["Publisher"],
+                                    'book_copy_ids': [f"shc{book_no}"], 'kwargs': {'genre': 'g1'}}
+                                   for book_no in range(5)])
+                writer.publish(library.snapshot())
+                statistics, _ = library.get_cold_tier_statistics()
+                reader = SharedCatalogReader(writer.prefix)
+                records = reader.catalog().search('genre', 'g1')
+                reader.close()
+                library.disable_cold_tier()
+        finally:
+            writer.close()
+            reset_registries()
+
+        self.assertEqual(statistics['faults'], 0)
+        self.assertEqual(statistics['cold_books'], 4)
+        self.assertEqual([(record.copy_id, record.book.title) for record in records],
+                         [(f"shc{book_no}", f"Cold {book_no}") for book_no in range(5)])
+
+
+class TestCommandProfiler(unittest.TestCase):
+
+    def test_time_is_attributed_per_command(self):
+        profiler = CommandProfiler()
+        with profiler.command('search'):
+            pass
+        with profiler.command('search'):
+            pass
+        with profiler.command('add_book'):
+            pass
+
+        rows = {row[0]: row for row in profiler.summary_rows()}
+        self.assertEqual(rows['search'][1], 2)
+        self.assertEqual(rows['add_book'][1], 1)
+        self.assertIsNone(profiler.current_command)
+
+    def test_samples_are_rooted_at_the_command(self):
+        profiler = CommandProfiler()
+        with profiler.command('borrow_book'):
+            profiler._sample(None, sys._getframe())
+
+        stack, = profiler.samples
+        self.assertTrue(stack.startswith('borrow_book;'))
+
+
 if __name__ == '__main__':
     unittest.main()
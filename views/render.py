@@ -0,0 +1,119 @@
+import json
+import sys
+from json.encoder import encode_basestring_ascii
+
+FORMATS = ('text', 'tsv', 'jsonl')
+
+SEARCH_FIELDS = ('copy_id', 'book_id', 'title', 'authors', 'publishers', 'rack_no', 'borrowed_by', 'due_date')
+BORROWED_FIELDS = ('copy_id', 'book_id', 'title', 'due_date')
+
+
+def check_format(fmt):
+    """
+    Validate an output format.
+    :return: An error message if the format is not supported, None otherwise.
+    """
+    if fmt not in FORMATS:
+        return f"Invalid output format. Use one of: {', '.join(FORMATS)}"
+    return None
+
+
+def _tsv_field(value):
+    # Quote like the csv module only when needed, which is rare for ids, dates and titles
+    text = '' if value is None else str(value)
+    if '\t' in text or '\n' in text or '\r' in text or '"' in text:
+        return '"' + text.replace('"', '""') + '"'
+    return text
+
+
+def _json_value(value):
+    if value is None:
+        return 'null'
+    if type(value) is str:
+        return encode_basestring_ascii(value)
+    return json.dumps(value)
+
+
+def _book_prefix(book, fmt, prefixes):
+    # Copies of the same book share the rendered book columns, so they are formatted once per book
+    prefix = prefixes.get(id(book))
+    if prefix is None:
+        if fmt == 'text':
+            prefix = (f"{book.book_id} {book.title} {', '.join(map(str, book.author_id))} "
+                      f"{', '.join(map(str, book.publisher_id))} ")
+        elif fmt == 'tsv':
+            prefix = '\t'.join([_tsv_field(book.book_id), _tsv_field(book.title),
+                                 _tsv_field(';'.join(map(str, book.author_id))),
+                                 _tsv_field(';'.join(map(str, book.publisher_id)))])
+        else:
+            prefix = (f'"book_id": {_json_value(book.book_id)}, "title": {_json_value(book.title)}, '
+                      f'"authors": {json.dumps(book.author_id)}, "publishers": {json.dumps(book.publisher_id)}')
+        prefixes[id(book)] = prefix
+    return prefix
+
+
+def render_search_results(book_copies, fmt='text'):
+    """
+    Render the book copies found by a search.
+    :param book_copies: The BookCopy instances, or snapshot records, to render.
+    :param fmt: The output format: 'text', 'tsv' with a header row, or 'jsonl'.
+    :return: The rendered rows as a single string.
+    """
+    prefixes = {}
+    rows = []
+    if fmt == 'text':
+        for book_copy in book_copies:
+            borrowed_by = book_copy.borrowed_by
+            prefix = _book_prefix(book_copy.book, fmt, prefixes)
+            if borrowed_by:
+                rows.append(f"Book Copy: {book_copy.copy_id} {prefix}-1 {borrowed_by} {book_copy.due_date}\n")
+            else:
+                rows.append(f"Book Copy: {book_copy.copy_id} {prefix}{book_copy.rack_no}  \n")
+
+    elif fmt == 'tsv':
+        rows.append('\t'.join(SEARCH_FIELDS) + '\n')
+        for book_copy in book_copies:
+            borrowed_by = book_copy.borrowed_by
+            prefix = _book_prefix(book_copy.book, fmt, prefixes)
+            if borrowed_by:
+                rows.append(f"{_tsv_field(book_copy.copy_id)}\t{prefix}\t\t{_tsv_field(borrowed_by)}\t"
+                            f"{_tsv_field(book_copy.due_date)}\n")
+            else:
+                rows.append(f"{_tsv_field(book_copy.copy_id)}\t{prefix}\t{_tsv_field(book_copy.rack_no)}\t\t"
+                            f"{_tsv_field(book_copy.due_date)}\n")
+
+    else:
+        for book_copy in book_copies:
+            borrowed_by = book_copy.borrowed_by
+            rows.append(f'{{"copy_id": {_json_value(book_copy.copy_id)}, {_book_prefix(book_copy.book, fmt, prefixes)}, '
+                        f'"rack_no": {"null" if borrowed_by else _json_value(book_copy.rack_no)}, '
+                        f'"borrowed_by": {_json_value(borrowed_by)}, "due_date": {_json_value(book_copy.due_date)}}}\n')
+    return ''.join(rows)
+
+
+def render_borrowed_book_copies(book_copies, fmt='text'):
+    """
+    Render the book copies borrowed by a user.
+    :param book_copies: The BookCopy instances, or snapshot records, to render.
+    :param fmt: The output format: 'text', 'tsv' with a header row, or 'jsonl'.
+    :return: The rendered rows as a single string.
+    """
+    if fmt == 'text':
+        return ''.join([f"Book Copy: {book_copy.copy_id} {book_copy.due_date}\n" for book_copy in book_copies])
+
+    if fmt == 'tsv':
+        return '\t'.join(BORROWED_FIELDS) + '\n' + ''.join([
+            f"{_tsv_field(book_copy.copy_id)}\t{_tsv_field(book_copy.book.book_id)}\t{_tsv_field(book_copy.book.title)}\t"
+            f"{_tsv_field(book_copy.due_date)}\n" for book_copy in book_copies])
+
+    return ''.join([f'{{"copy_id": {_json_value(book_copy.copy_id)}, "book_id": {_json_value(book_copy.book.book_id)}, '
+                    f'"title": {_json_value(book_copy.book.title)}, "due_date": {_json_value(book_copy.due_date)}}}\n'
+                    for book_copy in book_copies])
+
+
+def write_output(text):
+    """
+    Write rendered output to stdout in a single call.
+    """
+    if text:
+        sys.stdout.write(text)
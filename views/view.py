@@ -1,10 +1,32 @@
-from services.library import library_service
+import sys
+from datetime import date
 
-lib = library_service()
+from views.render import check_format, render_borrowed_book_copies, render_search_results, write_output
+
+_library = None
+
+
+def get_library():
+    """
+    Get the library the commands run against, constructing it and importing the services on first use.
+    """
+    global _library
+    if _library is None:
+        from services.library import library_service
+        _library = library_service()
+    return _library
+
+
+def set_library(library):
+    """
+    Replace the library the commands run against, e.g. with one restored from a warm state.
+    """
+    global _library
+    _library = library
 
 
 def create_library(no_of_rack, **kwargs):
-    no_of_rack, error = lib.create_library(no_of_rack, **kwargs)
+    no_of_rack, error = get_library().create_library(no_of_rack, **kwargs)
 
     if error:
         print(error)
@@ -12,25 +34,85 @@ def create_library(no_of_rack, **kwargs):
     print(f'Created library with {no_of_rack} racks')
 
 
+def resize_library(no_of_racks, max_books_per_rack=None):
+    result, error = get_library().resize_library(no_of_racks, max_books_per_rack)
+
+    if error:
+        print(error)
+        return
+    no_of_racks, moves = result
+    for copy_id, from_rack, to_rack in moves:
+        print(f"Moved book copy {copy_id} from rack {from_rack} to rack {to_rack}")
+    print(f'Resized library to {no_of_racks} racks')
+
+
 def add_book_to_library(book_id, title, authors, publishers, book_copy_ids, **kwargs):
-    rack_no_list, error = lib.add_book(book_id, title, authors, publishers, book_copy_ids, **kwargs)
+    library = get_library()
+    # Copies already on a rack or on loan, including repeated IDs, are skipped by add_book
+    in_use, seen = [], set()
+    for copy_id in book_copy_ids:
+        if copy_id in seen or (library.racks is not None and library.is_copy_id_in_use(copy_id)):
+            in_use.append(copy_id)
+        seen.add(copy_id)
+    rack_no_list, error = library.add_book(book_id, title, authors, publishers, book_copy_ids, **kwargs)
 
     if error:
         print("Error Adding Books")
         return
 
+    for copy_id in in_use:
+        print(f"Book copy {copy_id} already in library")
+
     cleaned_rack_no_list = [rack_no for rack_no in rack_no_list if rack_no is not None]
 
     if cleaned_rack_no_list:
         comma_separated_rack_no = ', '.join(map(str, cleaned_rack_no_list))
         print(f"Added Book to racks: {comma_separated_rack_no}")
 
-    if None in rack_no_list:
+    if rack_no_list.count(None) > len(in_use):
         print("Rack not available")
 
 
+def import_catalogue_to_library(path, chunk_size=1000):
+    from services.catalogue_io import import_catalogue
+
+    def print_progress(report):
+        print(f"Imported {report.rows} rows", file=sys.stderr)
+
+    report, error = import_catalogue(get_library(), path, chunk_size=chunk_size, progress=print_progress)
+    if error:
+        print(error)
+        return
+
+    for line_no, row_error in report.errors:
+        print(f"Row {line_no}: {row_error}")
+    print(f"Imported {report.books} books with {report.copies_added} copies from {report.rows} rows")
+    if report.copies_not_shelved:
+        print(f"Rack not available for {report.copies_not_shelved} copies")
+
+
+def export_catalogue_from_library(path):
+    from services.catalogue_io import export_books
+
+    count, error = export_books(path)
+    if error:
+        print(error)
+        return
+    print(f"Exported {count} books to {path}")
+
+
+def export_copies_from_library(path):
+    from services.catalogue_io import export_copies
+
+    count, error = export_copies(get_library(), path)
+    if error:
+        print(error)
+        return
+    print(f"Exported {count} book copies to {path}")
+
+
 def remove_book_copy_from_library(copy_id):
-    result, error = lib.remove_book_copy(copy_id)
+    result, error = get_library().remove_book_copy(copy_id)
     if error:
         print(error)
         return
@@ -38,8 +120,17 @@ def remove_book_copy_from_library(copy_id):
     print(f"Removed book copy: {book_copy.copy_id} from rack: {rack_no}")
 
 
+def remove_book_copies_from_library(copy_ids):
+    for result, error in get_library().remove_book_copies(copy_ids):
+        if error:
+            print(error)
+            continue
+        book_copy, rack_no = result
+        print(f"Removed book copy: {book_copy.copy_id} from rack: {rack_no}")
+
+
 def borrow_book_from_library(book_id,user_id,due_date):
-    rack_no, error = lib.borrow_book(book_id,user_id,due_date)
+    rack_no, error = get_library().borrow_book(book_id,user_id,due_date)
     if error:
         print(error)
         return
@@ -48,7 +139,7 @@ def borrow_book_from_library(book_id,user_id,due_date):
 
 
 def borrow_book_copy_from_library(copy_id,user_id,due_date):
-    rack_no, error = lib.borrow_book_copy_by_id(copy_id,user_id,due_date)
+    rack_no, error = get_library().borrow_book_copy_by_id(copy_id,user_id,due_date)
 
     if error:
         print(error)
@@ -58,28 +149,230 @@ def borrow_book_copy_from_library(copy_id,user_id,due_date):
 
 
 def return_book_copy_to_library(copy_id):
-    rack_info, error = lib.return_book_copy(copy_id)
+    rack_info, error = get_library().return_book_copy(copy_id)
     if error:
         print(error)
         return
     print(rack_info)
 
 
-def print_borrowed_book_copy_by_user(user_id):
-    book_copies = lib.get_user_borrowed_book_copy(user_id)
+def place_hold_on_book(book_id, user_id, due_date, expires_on=None):
+    position, error = get_library().place_hold(book_id, user_id, due_date, expires_on)
+    if error:
+        print(error)
+        return
+    print(f"Hold placed on book {book_id} at position: {position}")
+
+
+def cancel_hold_on_book(book_id, user_id):
+    hold, error = get_library().cancel_hold(book_id, user_id)
+    if error:
+        print(error)
+        return
+    print(f"Cancelled hold on book {hold.book_id} for user: {hold.user_id}")
+
+
+def expire_holds_in_library(as_of=None):
+    expired_holds, error = get_library().expire_holds(as_of)
+    if error:
+        print(error)
+        return
+    for hold in expired_holds:
+        print(f"Expired hold on book {hold.book_id} for user: {hold.user_id}")
+    print(f"Expired {len(expired_holds)} holds")
+
+
+def print_borrowed_book_copy_by_user(user_id, output_format='text'):
+    error = check_format(output_format)
+    if error:
+        print(error)
+        return
+    book_copies = get_library().get_user_borrowed_book_copy(user_id)
+    write_output(render_borrowed_book_copies(book_copies, output_format))
+
+
+def search_library_for_book_by_attribute(attribute, attribute_value, output_format='text', as_of=None):
+    error = check_format(output_format)
+    if error:
+        print(error)
+        return
+    if as_of is not None and not is_iso_date(as_of):
+        print("Invalid date")
+        return
+    book_copies = get_library().search(attribute, attribute_value, as_of)
+    write_output(render_search_results(book_copies, output_format))
+
+
+def print_book_copy(copy_id, as_of=None):
+    book_copy, error = get_library().get_book_copy(copy_id, as_of)
+    if error:
+        print(error)
+        return
+    write_output(render_search_results([book_copy]))
+
+
+def is_iso_date(value):
+    try:
+        date.fromisoformat(value)
+        return True
+    except ValueError:
+        return False
+
+
+def print_rack_occupancy(start_rack, end_rack):
+    racks, error = get_library().get_rack_occupancy(start_rack, end_rack)
+    if error:
+        print(error)
+        return
+
+    for rack_no, occupied, free in racks:
+        print(f"Rack {rack_no}: {occupied} occupied, {free} free")
+    free_slots, _ = get_library().count_free_slots(start_rack, end_rack)
+    print(f"Free slots in racks {start_rack}-{end_rack}: {free_slots}")
+
+
+def print_racks_with_free_slots(min_free_slots, start_rack=1, end_rack=None):
+    racks, error = get_library().find_racks_with_free_slots(min_free_slots, start_rack, end_rack)
+    if error:
+        print(error)
+        return
+
+    if not racks:
+        print("No racks found")
+        return
+    print(', '.join(f"{rack_no} ({free} free)" for rack_no, free in racks))
+
+
+def print_aisle_occupancy(racks_per_aisle):
+    aisles, error = get_library().get_aisle_occupancy(racks_per_aisle)
+    if error:
+        print(error)
+        return
+
+    for aisle_no, start_rack, end_rack, occupied, capacity in aisles:
+        print(f"Aisle {aisle_no} (racks {start_rack}-{end_rack}): {occupied}/{capacity} occupied "
+              f"({occupied * 100 / capacity if capacity else 0:.1f}%)")
+
+
+def set_borrowing_policy(tier, max_books_allowed, loan_days):
+    policy, error = get_library().set_borrowing_policy(tier, max_books_allowed, loan_days)
+    if error:
+        print(error)
+        return
+    print(f"Policy {policy.tier}: {policy.max_books_allowed} books for {policy.loan_days} days")
+
+
+def set_user_tier(user_id, tier):
+    user, error = get_library().set_user_tier(user_id, tier)
+    if error:
+        print(error)
+        return
+    print(f"User {user.user_id} moved to tier: {user.tier}")
+
+
+def retier_users(from_tier, to_tier):
+    moved, error = get_library().retier_users(from_tier, to_tier)
+    if error:
+        print(error)
+        return
+    print(f"Users of tier {from_tier} moved to tier: {to_tier}")
+
+
+def print_loan_statistics(limit=10):
+    statistics = get_library().get_loan_statistics(limit)
+    average_loan_length = statistics['average_loan_length']
+    average = f"{average_loan_length:.1f} days" if average_loan_length is not None else "n/a"
+    print(f"Loans: {statistics['loans']}, completed: {statistics['completed_loans']}, average length: {average}")
+    for book_id, loans in statistics['most_borrowed_books']:
+        print(f"Book: {book_id} {loans}")
+    for author, loans in statistics['most_borrowed_authors']:
+        print(f"Author: {author} {loans}")
+
 
-    for book_copy in book_copies:
-        print(f"Book Copy: {book_copy.copy_id} {book_copy.due_date}")
+def print_recommendations(book_id, k=5):
+    recommended, error = get_library().recommend(book_id, k)
+    if error:
+        print(error)
+        return
+    if not recommended:
+        print("No recommendations found")
+        return
+    for book, count in recommended:
+        print(f"Recommended Book: {book.book_id} {book.title} {count}")
+
+
+def rebalance_library(max_moves=100):
+    result, error = get_library().rebalance(max_moves)
+    if error:
+        print(error)
+        return
+
+    moves, remaining = result
+    for copy_id, from_rack, to_rack in moves:
+        print(f"Moved book copy {copy_id} from rack {from_rack} to rack {to_rack}")
+    if remaining:
+        print(f"Rebalance in progress: {remaining} moves pending")
+    else:
+        print(f"Rebalance complete: {len(moves)} moves made")
+
+
+def enable_cold_tier(path, attribute_budget):
+    statistics, error = get_library().enable_cold_tier(path, attribute_budget)
+    if error:
+        print(error)
+        return
+    print(f"Cold tier enabled: {statistics['resident_books']} books resident, {statistics['cold_books']} books cold")
+
+
+def disable_cold_tier():
+    get_library().disable_cold_tier()
+    print("Cold tier disabled")
 
 
-def search_library_for_book_by_attribute(attribute,attribute_value):
-    book_copies = lib.search(attribute,attribute_value)
+def print_cold_tier_statistics():
+    statistics, error = get_library().get_cold_tier_statistics()
+    if error:
+        print(error)
+        return
+    print(f"Resident books: {statistics['resident_books']} "
+          f"({statistics['resident_bytes']}/{statistics['attribute_budget']} attribute bytes)")
+    print(f"Cold books: {statistics['cold_books']}")
+    print(f"Evictions: {statistics['evictions']}, faults: {statistics['faults']}, "
+          f"evicted bytes: {statistics['evicted_bytes']}")
+
+
+def enable_library_stats():
+    get_library().stats.enable()
+    print("Stats enabled")
+
+
+def disable_library_stats():
+    get_library().stats.disable()
+    print("Stats disabled")
+
+
+def reset_library_stats():
+    get_library().stats.reset()
+    print("Stats reset")
 
-    for book_copy in book_copies:
-        comma_separated_author = ', '.join(map(str, book_copy.book.author_id))
-        comma_separated_publisher = ', '.join(map(str, book_copy.book.publisher_id))
-        rack_no = book_copy.rack_no if not book_copy.borrowed_by else -1
-        print(f"Book Copy: {book_copy.copy_id} {book_copy.book.book_id} {book_copy.book.title} {comma_separated_author} {comma_separated_publisher} {rack_no} {book_copy.borrowed_by if rack_no == -1 else ''} {book_copy.due_date if rack_no == -1 else ''}")
+
+def print_library_stats():
+    rows = get_library().stats.summary()
+    if not rows:
+        print("No stats recorded")
+        return
+
+    print(f"{'operation':<28} {'calls':>8} {'mean_us':>10} {'p50_us':>10} {'p99_us':>10} {'max_us':>10} {'scanned':>10}")
+    for name, calls, mean, p50, p99, maximum, scanned in rows:
+        print(f"{name:<28} {calls:>8} {mean:>10.1f} {p50:>10.1f} {p99:>10.1f} {maximum:>10.1f} {scanned:>10}")
+
+
+def dump_library_stats(path):
+    error = get_library().stats.dump_prometheus(path)
+    if error:
+        print(error)
+        return
+    print(f"Stats written to {path}")
 
 #
 # create_library(10)
@@ -0,0 +1,105 @@
+import contextlib
+import io
+import multiprocessing
+import sys
+from collections import deque
+
+from views.render import check_format, render_borrowed_book_copies, render_search_results
+
+# Commands answered by the readers, with the numbers of tokens they accept
+READ_COMMANDS = {'search': (3, 4), 'print_borrowed': (2, 3)}
+
+_reader = None
+
+
+def _start_reader(prefix):
+    global _reader
+    from services.shared_catalog import SharedCatalogReader
+    _reader = SharedCatalogReader(prefix)
+
+
+def answer_read_command(generation, parsed_command):
+    """
+    Answer a search or print_borrowed command in a reader process, against the catalog of a generation.
+    :return: The output of the command.
+    """
+    try:
+        catalog = _reader.catalog(generation)
+        command, *arguments = parsed_command
+        if command == 'search':
+            attribute, attribute_value, *output_format = arguments
+        else:
+            user_id, *output_format = arguments
+        output_format = output_format[0] if output_format else 'text'
+        error = check_format(output_format)
+        if error:
+            return f"{error}\n"
+        if command == 'search':
+            return render_search_results(catalog.search(attribute, attribute_value), output_format)
+        return render_borrowed_book_copies(catalog.get_user_borrowed_book_copy(user_id), output_format)
+    except Exception as e:
+        return f"Error: {e}\n"
+
+
+class ReadWorkerPool:
+    """
+    Runs read commands in reader processes while this process keeps executing the mutations.
+
+    Before a read is handed out, the library snapshot is published to shared memory if it changed,
+    and the read is answered against that generation, so every command sees the state left by the
+    commands before it. Outputs are written in command order: the output of a command run here is
+    held back while reads handed out before it are pending.
+    """
+
+    def __init__(self, workers, get_library):
+        from services.shared_catalog import SharedCatalogWriter
+        self.get_library = get_library
+        self.writer = SharedCatalogWriter()
+        self.pool = multiprocessing.Pool(workers, initializer=_start_reader, initargs=(self.writer.prefix,))
+        self.pending = deque()
+
+    def dispatch(self, parsed_command, run_locally):
+        """
+        Run a command in a reader process if it is a read command, or in this process otherwise.
+        :param parsed_command: The tokens of the command.
+        :param run_locally: Called without arguments to run the command in this process.
+        """
+        if parsed_command and len(parsed_command) in READ_COMMANDS.get(parsed_command[0], ()):
+            generation = self.writer.publish(self.get_library().snapshot())
+            self.writer.acquire(generation)
+            self.pending.append((generation, self.pool.apply_async(answer_read_command,
+                                                                    (generation, parsed_command))))
+        elif self.pending:
+            with contextlib.redirect_stdout(io.StringIO()) as output:
+                run_locally()
+            self.pending.append((None, output.getvalue()))
+        else:
+            run_locally()
+        self.flush()
+
+    def flush(self, wait=False):
+        """
+        Write the outputs that are ready, in command order.
+        :param wait: Wait for every pending read.
+        """
+        while self.pending:
+            generation, result = self.pending[0]
+            if generation is not None:
+                if not wait and not result.ready():
+                    return
+                result = result.get()
+                self.writer.release(generation)
+            self.pending.popleft()
+            if result:
+                sys.stdout.write(result)
+
+    def close(self):
+        """
+        Write the remaining outputs and stop the reader processes.
+        """
+        try:
+            self.flush(wait=True)
+        finally:
+            self.pool.close()
+            self.pool.join()
+            self.writer.close()